@@ -0,0 +1,76 @@
+"""
+Benchmark typing with capped read pairs against full-depth typing.
+
+Type a BAM file once on all read pairs, and then once per cap with
+--max_pairs. Report runtime of each, the fractions of read pairs scored
+per gene, and the concordance of typed alleles with the full-depth run.
+
+    python benchmarks/bench_max_pairs.py --bam SYN.bam --freq HLA_FREQ.txt \
+        --max_pairs 1000 300 100
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import polars as pl
+
+from mhctyper import run_mhctyper
+
+
+def concordance(res: pl.DataFrame, ref: pl.DataFrame) -> float:
+    """Share of typed alleles (2 per gene) agreeing with the reference"""
+    res = res.sort("gene", "allele")
+    ref = ref.sort("gene", "allele")
+    return float((res["allele"] == ref["allele"]).mean() or 0.0)
+
+
+def run(
+    args: argparse.Namespace, outdir: Path, max_pairs: Optional[int] = None
+) -> tuple[float, pl.DataFrame]:
+    start = time.perf_counter()
+    res, _ = run_mhctyper(
+        bam=args.bam,
+        freq=args.freq,
+        outdir=outdir,
+        min_ecnt=args.min_ecnt,
+        nproc=args.nproc,
+        max_pairs=max_pairs,
+    )
+    return round(time.perf_counter() - start, 2), res
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bam", type=Path, required=True)
+    parser.add_argument("--freq", type=Path, required=True)
+    parser.add_argument("--min_ecnt", type=int, default=999)
+    parser.add_argument("--nproc", type=int, default=4)
+    parser.add_argument(
+        "--max_pairs", type=int, nargs="+", default=[1000, 300, 100]
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        full_s, full = run(args, Path(workdir) / "full")
+        results: dict[str, Any] = {"full": {"elapsed_s": full_s}}
+        for max_pairs in args.max_pairs:
+            elapsed, res = run(
+                args, Path(workdir) / f"n{max_pairs}", max_pairs
+            )
+            results[f"max_pairs={max_pairs}"] = {
+                "elapsed_s": elapsed,
+                "speedup": round(full_s / elapsed, 2),
+                "fractions": dict(
+                    res.select("gene", "fraction").unique().sort("gene").rows()
+                ),
+                "concordance": concordance(res, full),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark prescreened typing against typing all alleles in full.
+
+Type a BAM file once with all alleles scored in full, and then once per
+top-K (and fraction) with --prescreen. Report runtime of each, and the
+concordance of typed alleles with the full run, at full and at 2-field
+resolution.
+
+    python benchmarks/bench_prescreen.py --bam SYN.bam --freq HLA_FREQ.txt \
+        --top_k 1 3 5 --fractions 0.05 0.1
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import polars as pl
+
+from mhctyper import run_mhctyper
+from mhctyper.prescreen import Prescreen, allele_groups
+
+
+def concordance(res: pl.DataFrame, ref: pl.DataFrame, key: str) -> float:
+    """Share of typed alleles (2 per gene) agreeing with the reference"""
+    res = res.sort("gene", key)
+    ref = ref.sort("gene", key)
+    return float((res[key] == ref[key]).mean() or 0.0)
+
+
+def run(
+    args: argparse.Namespace,
+    outdir: Path,
+    prescreen: Optional[Prescreen] = None,
+) -> dict[str, Any]:
+    start = time.perf_counter()
+    res, _ = run_mhctyper(
+        bam=args.bam,
+        freq=args.freq,
+        outdir=outdir,
+        min_ecnt=args.min_ecnt,
+        nproc=args.nproc,
+        prescreen=prescreen,
+    )
+    elapsed = time.perf_counter() - start
+    res = res.with_columns(
+        group=pl.Series(allele_groups(res["allele"].to_list())["group"])
+    )
+    return {"elapsed_s": round(elapsed, 2), "res": res}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bam", type=Path, required=True)
+    parser.add_argument("--freq", type=Path, required=True)
+    parser.add_argument("--min_ecnt", type=int, default=999)
+    parser.add_argument("--nproc", type=int, default=4)
+    parser.add_argument("--top_k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--fractions", type=float, nargs="+", default=[0.1])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        full = run(args, Path(workdir) / "full")
+        results: dict[str, Any] = {"full": {"elapsed_s": full["elapsed_s"]}}
+        for fraction in args.fractions:
+            for top_k in args.top_k:
+                prescreened = run(
+                    args,
+                    Path(workdir) / f"k{top_k}_f{fraction}",
+                    prescreen=Prescreen(top_k, fraction),
+                )
+                res, ref = prescreened["res"], full["res"]
+                results[f"top_k={top_k},fraction={fraction}"] = {
+                    "elapsed_s": prescreened["elapsed_s"],
+                    "speedup": round(
+                        full["elapsed_s"] / prescreened["elapsed_s"], 2
+                    ),
+                    "concordance": concordance(res, ref, "allele"),
+                    "concordance_2field": concordance(res, ref, "group"),
+                }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
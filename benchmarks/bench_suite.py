@@ -0,0 +1,195 @@
+"""
+Benchmark stages of run_mhctyper on synthetic HLA BAM files at several scales.
+
+Synthetic BAM files are written once per scale with synthetic_bam.py, and
+kept in the work folder across runs. Each scale is typed in a fresh
+process with --metrics, so that peak RSS is measured in isolation, and
+the fastest of --repeat runs is kept per stage. Start-up is timed too,
+as the fastest of --repeat fresh processes importing the package, running
+--help, and importing what worker processes import. Results are printed
+as JSON, and written to --out when given. Given a --baseline of a
+previous run, wall time of each stage and of start-up is compared to it,
+and the benchmark fails if any is slower than the baseline by more than
+--tolerance. Stages shorter than --min_wall_s in the baseline are too
+noisy to fail on. Worker backends are compared by running each with
+--backend, and one as the baseline of the other.
+
+    python benchmarks/bench_suite.py --workdir bench --scales small medium \
+        --out baseline.json
+    python benchmarks/bench_suite.py --workdir bench --scales small medium \
+        --baseline baseline.json
+    python benchmarks/bench_suite.py --workdir bench --scales medium \
+        --backend thread --baseline baseline.json
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).parent))
+from synthetic_bam import SyntheticBAM, write_synthetic_bam  # noqa: E402
+
+# commands timed at start-up, from a fresh process each
+STARTUP: dict[str, list[str]] = {
+    "import": ["-c", "import mhctyper"],
+    "help": ["-m", "mhctyper", "--help"],
+    "worker_import": ["-c", "import mhctyper.score_alleles"],
+}
+
+SCALES: dict[str, SyntheticBAM] = {
+    "small": SyntheticBAM(genes=2, alleles=10, depth=20),
+    "medium": SyntheticBAM(genes=3, alleles=40, depth=40),
+    "large": SyntheticBAM(genes=6, alleles=80, depth=60),
+}
+
+
+def synthetic_bam(workdir: Path, settings: SyntheticBAM) -> Path:
+    """Get synthetic BAM file of given settings, writing it if missing"""
+    outdir = workdir / settings.name
+    bam = outdir / f"{settings.sm}.bam"
+    if not (outdir / "HLA_FREQ.txt").exists():
+        write_synthetic_bam(settings, outdir)
+    return bam
+
+
+def run_scale(
+    bam: Path, outdir: Path, args: argparse.Namespace
+) -> dict[str, Any]:
+    """Type BAM file in a fresh process, and return its metrics"""
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "mhctyper",
+            "--bam",
+            str(bam),
+            "--freq",
+            str(bam.parent / "HLA_FREQ.txt"),
+            "--outdir",
+            str(outdir),
+            "--min_ecnt",
+            str(args.min_ecnt),
+            "--nproc",
+            str(args.nproc),
+            "--backend",
+            args.backend,
+            "--overwrite",
+            "--metrics",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    [metrics] = outdir.glob("*.metrics.json")
+    report: dict[str, Any] = json.loads(metrics.read_text())
+    return report
+
+
+def bench_scale(
+    name: str, args: argparse.Namespace
+) -> dict[str, dict[str, float]]:
+    """Fastest wall time, and its CPU time and peak RSS, per stage"""
+    bam = synthetic_bam(args.workdir, SCALES[name])
+    stages: dict[str, dict[str, float]] = {}
+    for _ in range(args.repeat):
+        report = run_scale(bam, args.workdir / f"out_{name}", args)
+        for s in report["stages"]:
+            best = stages.get(s["stage"])
+            if best is None or s["wall_s"] < best["wall_s"]:
+                stages[s["stage"]] = {
+                    k: v for k, v in s.items() if k != "stage"
+                }
+    return stages
+
+
+def bench_startup(repeat: int) -> dict[str, dict[str, float]]:
+    """Fastest wall time of each start-up command"""
+    startup: dict[str, dict[str, float]] = {}
+    for name, argv in STARTUP.items():
+        walls = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, *argv], check=True, capture_output=True
+            )
+            walls.append(time.perf_counter() - start)
+        startup[name] = {"wall_s": round(min(walls), 4)}
+    return startup
+
+
+def compare(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    tolerance: float,
+    min_wall_s: float,
+) -> list[str]:
+    """Add ratios of wall time to baseline, and return stages regressed"""
+    regressed = []
+    scales = {"startup": results["startup"], **results["scales"]}
+    base_scales = {
+        "startup": baseline.get("startup", {}),
+        **baseline["scales"],
+    }
+    for name, stages in scales.items():
+        base = base_scales.get(name, {})
+        for stage, m in stages.items():
+            if stage not in base or base[stage]["wall_s"] <= 0:
+                continue
+            m["ratio_to_baseline"] = round(
+                m["wall_s"] / base[stage]["wall_s"], 2
+            )
+            if (
+                m["ratio_to_baseline"] > tolerance
+                and (name == "startup" or base[stage]["wall_s"] >= min_wall_s)
+            ):
+                regressed.append(f"{name}/{stage}")
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workdir", type=Path, required=True)
+    parser.add_argument(
+        "--scales", nargs="+", choices=list(SCALES), default=["small"]
+    )
+    parser.add_argument("--min_ecnt", type=int, default=999)
+    parser.add_argument("--nproc", type=int, default=4)
+    parser.add_argument(
+        "--backend", choices=["process", "thread"], default="process"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--tolerance", type=float, default=1.2)
+    parser.add_argument("--min_wall_s", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {
+        "settings": {
+            "min_ecnt": args.min_ecnt,
+            "nproc": args.nproc,
+            "backend": args.backend,
+            "repeat": args.repeat,
+        },
+        "startup": bench_startup(args.repeat),
+        "scales": {name: bench_scale(name, args) for name in args.scales},
+    }
+    regressed: list[str] = []
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        regressed = compare(
+            results, baseline, args.tolerance, args.min_wall_s
+        )
+    if args.out is not None:
+        args.out.write_text(json.dumps(results, indent=2))
+    print(json.dumps(results, indent=2))
+    if regressed:
+        print(f"Slower than baseline: {', '.join(regressed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark memory of typing from a cached first-allele score table.
+
+Type alleles from a synthetic a1 Parquet table, either all at once or
+chunk by chunk with --chunk_size. Each variant runs in a fresh interpreter
+so that peak RSS is measured in isolation.
+
+    python benchmarks/bench_type_alleles.py --genes 6 --alleles 300 \
+        --reads 5000 --chunk_sizes 0 1000000 250000
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+
+def synthetic_a1_scores(
+    n_genes: int, n_alleles: int, n_reads: int, seed: int = 0
+) -> pl.DataFrame:
+    """Synthetic first-allele score table with every read on every allele"""
+    rng = np.random.default_rng(seed)
+    n = n_genes * n_alleles * n_reads
+    gene_idx = np.repeat(np.arange(n_genes), n_alleles * n_reads)
+    allele_idx = np.tile(np.repeat(np.arange(n_alleles), n_reads), n_genes)
+    read_idx = np.tile(np.arange(n_reads), n_genes * n_alleles)
+    return pl.DataFrame(
+        {
+            "qnames": pl.Series(read_idx).cast(pl.String),
+            "scores": rng.normal(4500, 20, n),
+            "allele": pl.Series(allele_idx).cast(pl.String),
+            "gene": pl.Series(gene_idx).cast(pl.String),
+        }
+    ).with_columns(
+        pl.format("{}.{}", "gene", "qnames").alias("qnames"),
+        pl.format("hla_{}_{}", "gene", "allele").alias("allele"),
+        pl.format("hla_{}", "gene").alias("gene"),
+    )
+
+
+def run_variant(args: argparse.Namespace) -> dict[str, float]:
+    from mhctyper.mhctyper import type_alleles
+
+    outdir = Path(args.workdir)
+    chunk_size = args.chunk_size or None
+    start = time.perf_counter()
+    res = type_alleles(
+        pl.scan_parquet(outdir / "a1.parquet"),
+        "bench",
+        outdir / f"a2.{args.chunk_size}.tsv",
+        outdir / f"res.{args.chunk_size}.tsv",
+        chunk_size=chunk_size,
+    )
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "wall_s": round(elapsed, 3),
+        "peak_rss_mb": round(rss / 1024, 1),
+        "alleles": ",".join(res["allele"].to_list()),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--genes", type=int, default=6)
+    parser.add_argument("--alleles", type=int, default=300)
+    parser.add_argument("--reads", type=int, default=3000)
+    parser.add_argument("--chunk_sizes", type=int, nargs="+", default=[0])
+    parser.add_argument("--workdir")
+    parser.add_argument("--chunk_size", type=int)
+    parser.add_argument("--prepare", action="store_true")
+    args = parser.parse_args()
+
+    if args.prepare:
+        a1_scores = synthetic_a1_scores(args.genes, args.alleles, args.reads)
+        a1_scores.write_parquet(Path(args.workdir) / "a1.parquet")
+        print(json.dumps({"rows": a1_scores.shape[0]}))
+        return
+    if args.chunk_size is not None:
+        print(json.dumps(run_variant(args)))
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # tables are made in a subprocess too, as ru_maxrss of a child
+        # carries over the RSS of its parent at fork
+        out = subprocess.run(
+            [sys.executable, *sys.argv, "--workdir", workdir, "--prepare"],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        results = json.loads(out.stdout.strip().splitlines()[-1])
+        for chunk_size in args.chunk_sizes:
+            out = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--workdir",
+                    workdir,
+                    "--chunk_size",
+                    str(chunk_size),
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            line = out.stdout.strip().splitlines()[-1]
+            results[f"chunk_size={chunk_size}"] = json.loads(line)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
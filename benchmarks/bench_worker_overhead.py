@@ -0,0 +1,77 @@
+"""
+Benchmark per-task overhead of first-allele scoring.
+
+Compare the setup each task used to repeat (allele pattern, BAM metadata,
+and opening the BAM file) against the state a worker keeps across tasks.
+Only setup and reading of the allele's alignments are timed, on the
+alleles of a given BAM file.
+
+    python benchmarks/bench_worker_overhead.py --bam SYN.bam --repeat 3
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import pysam
+
+
+def per_task_setup(bam: Path, allele: str) -> None:
+    from tinyscibio import BAMetadata, walk_bam
+
+    from mhctyper.hla_allele import HLAllelePattern, decompose
+
+    decompose(allele, HLAllelePattern())
+    idx2seqname = BAMetadata(str(bam)).idx2seqname()
+    df = walk_bam(
+        str(bam),
+        allele,
+        exclude=3584,
+        return_ecnt=True,
+        return_bq=True,
+        return_md=True,
+        return_qname=True,
+    )
+    df["rnames"].replace_strict(idx2seqname)
+
+
+def per_worker_setup(bam: Path, allele: str) -> None:
+    from mhctyper.bam import read_alignments
+    from mhctyper.worker import worker_state
+
+    state = worker_state()
+    state.hla_gene(allele)
+    read_alignments(state.bam(bam), allele)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bam", type=Path, required=True)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with pysam.AlignmentFile(str(args.bam), "rb") as bamf:
+        alleles = list(bamf.references)
+
+    results = {}
+    for name, task in [
+        ("per_task", per_task_setup),
+        ("per_worker", per_worker_setup),
+    ]:
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for allele in alleles:
+                task(args.bam, allele)
+            best = min(best, time.perf_counter() - start)
+        results[name] = {
+            "alleles": len(alleles),
+            "wall_s": round(best, 3),
+            "per_allele_ms": round(best / len(alleles) * 1e3, 3),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
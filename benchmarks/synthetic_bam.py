@@ -0,0 +1,206 @@
+"""
+Write a synthetic, indexed HLA BAM file and a matching frequency file.
+
+Alleles of each gene are random variants of one gene sequence, and read
+pairs are sampled from 2 true alleles per gene, with random mismatches,
+base qualities, indels, and improper pairs. Every read pair is aligned to
+every allele of its gene, as reads are aligned to all alleles in practice.
+
+    python benchmarks/synthetic_bam.py --outdir syn --genes 2 --alleles 20 \
+        --depth 30 --read_length 100 --mm_rate 0.01 --sm SYN
+"""
+
+import argparse
+import random
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import pysam
+
+BASES = "ACGT"
+LOCI = ("a", "b", "c", "drb1", "dqb1", "dpb1")
+# share of read pairs with a 2bp deletion, and with a 2bp insertion
+DELETION_RATE = 0.05
+INSERTION_RATE = 0.05
+IMPROPER_RATE = 0.03
+
+
+@dataclass
+class SyntheticBAM:
+    """Settings of a synthetic HLA BAM file"""
+
+    genes: int = 2
+    alleles: int = 20
+    depth: int = 30
+    read_length: int = 100
+    ref_length: int = 1000
+    mm_rate: float = 0.01
+    sm: str = "SYN"
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        """Name identifying the settings, e.g. to cache files written"""
+        return "_".join(f"{k}{v}" for k, v in asdict(self).items())
+
+
+def make_md(read: str, ref: str) -> str:
+    """MD tag of a read aligned to ref without indels"""
+    md: list[str] = []
+    run = 0
+    for r, f in zip(read, ref):
+        if r == f:
+            run += 1
+        else:
+            md.extend([str(run), f])
+            run = 0
+    md.append(str(run))
+    return "".join(md)
+
+
+def mutate(seq: str, rate: float, rng: random.Random) -> str:
+    return "".join(
+        rng.choice([b for b in BASES if b != s]) if rng.random() < rate else s
+        for s in seq
+    )
+
+
+def align(
+    read: str, ref: str, start: int, indel: float
+) -> tuple[str, str, str]:
+    """Align read to ref at start, with a 2bp deletion or insertion"""
+    n = len(read)
+    if indel < DELETION_RATE:
+        cut = n * 2 // 5
+        md = (
+            make_md(read[:cut], ref[start : start + cut])
+            + f"^{ref[start + cut : start + cut + 2]}"
+            + make_md(read[cut:], ref[start + cut + 2 : start + n + 2])
+        )
+        return read, f"{cut}M2D{n - cut}M", md
+    if indel < DELETION_RATE + INSERTION_RATE:
+        cut = n // 2
+        read = read[:cut] + "AC" + read[cut : n - 2]
+        # inserted bases are not part of MD
+        md = make_md(read[:cut] + read[cut + 2 :], ref[start : start + n - 2])
+        return read, f"{cut}M2I{n - cut - 2}M", md
+    return read, f"{n}M", make_md(read, ref[start : start + n])
+
+
+def write_synthetic_bam(settings: SyntheticBAM, outdir: Path) -> Path:
+    """
+    Write {SM}.bam, its index, and HLA_FREQ.txt to outdir
+
+    Returns:
+        Path to the BAM file.
+    """
+    s = settings
+    rng = random.Random(s.seed)
+    outdir.mkdir(parents=True, exist_ok=True)
+    refs: dict[str, str] = {}
+    for locus in LOCI[: s.genes]:
+        gene_seq = "".join(rng.choice(BASES) for _ in range(s.ref_length))
+        for i in range(s.alleles):
+            name = f"hla_{locus}_{i // 5 + 1:02d}_{i % 5 + 1:02d}_01"
+            rate = rng.randint(1, 15) / s.ref_length
+            refs[name] = mutate(gene_seq, rate, rng)
+    names = list(refs)
+    header = {
+        "HD": {"VN": "1.6", "SO": "coordinate"},
+        "SQ": [{"SN": n, "LN": s.ref_length} for n in names],
+        "RG": [{"ID": s.sm, "SM": s.sm}],
+    }
+    n_pairs = s.ref_length * s.depth // (2 * s.read_length)
+    records = []
+    for locus in LOCI[: s.genes]:
+        alleles = [n for n in names if n.startswith(f"hla_{locus}_")]
+        truths = rng.sample(alleles, 2)
+        for k in range(n_pairs):
+            truth = refs[truths[k % 2]]
+            insert = rng.randint(s.read_length, 3 * s.read_length)
+            start = rng.randrange(0, s.ref_length - insert - 2)
+            starts = (start, start + insert - s.read_length)
+            reads = [
+                mutate(truth[p : p + s.read_length], s.mm_rate, rng)
+                for p in starts
+            ]
+            quals = [
+                [rng.randint(2, 40) for _ in range(s.read_length)]
+                for _ in starts
+            ]
+            indel = rng.random()
+            proper = rng.random() > IMPROPER_RATE
+            for allele in alleles:
+                for mate in (0, 1):
+                    seq, cigar, md = align(
+                        reads[mate],
+                        refs[allele],
+                        starts[mate],
+                        indel if mate == 0 else 1.0,
+                    )
+                    records.append(
+                        (
+                            names.index(allele),
+                            starts[mate],
+                            f"{s.sm}.{locus}.{k}",
+                            mate,
+                            seq,
+                            quals[mate],
+                            cigar,
+                            md,
+                            starts[1 - mate],
+                            proper,
+                        )
+                    )
+    records.sort(key=lambda r: (r[0], r[1]))
+
+    bam = outdir / f"{s.sm}.bam"
+    with pysam.AlignmentFile(str(bam), "wb", header=header) as out:
+        for rid, pos, qname, mate, seq, qual, cigar, md, mpos, proper in (
+            records
+        ):
+            a = pysam.AlignedSegment(out.header)
+            a.query_name = qname
+            a.query_sequence = seq
+            # paired, proper, first or second in pair, mate reversed or not
+            a.flag = (
+                1
+                | (2 if proper else 0)
+                | (64 | 32 if mate == 0 else 128 | 16)
+            )
+            a.reference_id = rid
+            a.reference_start = pos
+            a.mapping_quality = 60
+            a.cigarstring = cigar
+            a.next_reference_id = rid
+            a.next_reference_start = mpos
+            a.query_qualities = pysam.qualitystring_to_array(
+                "".join(chr(q + 33) for q in qual)
+            )
+            a.set_tag("MD", md)
+            a.set_tag("RG", s.sm)
+            out.write(a)
+    pysam.index(str(bam))
+
+    # frequencies are given at 3-field resolution
+    groups = dict.fromkeys(n.rsplit("_", 1)[0] for n in names)
+    with (outdir / "HLA_FREQ.txt").open("w") as fh:
+        fh.write("Allele\tCaucasian\tBlack\n")
+        for group in groups:
+            fh.write(f"{group}\t{rng.random():.4f}\t0.0\n")
+    return bam
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outdir", type=Path, required=True)
+    defaults = SyntheticBAM()
+    for key, value in asdict(defaults).items():
+        parser.add_argument(f"--{key}", type=type(value), default=value)
+    args = vars(parser.parse_args())
+    outdir = args.pop("outdir")
+    print(write_synthetic_bam(SyntheticBAM(**args), outdir))
+
+
+if __name__ == "__main__":
+    main()
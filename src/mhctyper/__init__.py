@@ -1,5 +1,33 @@
-from mhctyper.mhctyper import mhctyper_main, run_mhctyper
+from typing import TYPE_CHECKING, Any
 
 from ._version import version as __version__
+from .cli import mhctyper_main
 
-__all__ = ["mhctyper_main", "run_mhctyper", "__version__"]
+if TYPE_CHECKING:
+    from .mhctyper import (
+        merge_shards,
+        run_mhctyper,
+        run_mhctyper_batch,
+        run_mhctyper_shard,
+        run_mhctyper_sweep,
+    )
+
+__all__ = [
+    "merge_shards",
+    "mhctyper_main",
+    "run_mhctyper",
+    "run_mhctyper_batch",
+    "run_mhctyper_shard",
+    "run_mhctyper_sweep",
+    "__version__",
+]
+
+
+# polars, pysam, and tinyscibio are slow to import, so the API is imported
+# on first use, and not at all by --help, --version, or worker processes
+def __getattr__(name: str) -> Any:
+    if name in __all__:
+        from . import mhctyper
+
+        return getattr(mhctyper, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,192 @@
+import zlib
+from collections.abc import Sequence
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+import pysam
+
+from .likelihood import Alignments, offsets
+
+# QC-failed, duplicate, and supplementary alignments
+EXCLUDE_FLAG: int = 3584
+
+# read names are sampled by their CRC-32 checksums
+_HASH_SPACE: int = 2**32
+
+# MD tokens: matched bases, a deletion, or a mismatched base
+MD_TOKEN: str = r"\d+|\^[A-Za-z]+|[A-Za-z]"
+# as tinyscibio.parse_md, MD strings start with a digit, and mismatched
+# bases are separated by digits, e.g. 10AA90 is invalid
+_MD_EVENT: str = r"(?:\^[A-Za-z]+|[A-Za-z])"
+MD_STRING: str = rf"^\d+(?:{_MD_EVENT}\d+)*{_MD_EVENT}?$"
+
+
+def sampled_qname(qname: str, fraction: float) -> bool:
+    """
+    Check if read name falls in the sampled fraction of read names
+
+    Sampling only depends on the read name, so that both reads of a pair,
+    and the same pairs on every allele, are kept. A smaller fraction keeps
+    a subset of the reads a larger one keeps.
+    """
+    return zlib.crc32(qname.encode()) < fraction * _HASH_SPACE
+
+
+def parse_mds(
+    mds: pl.Series,
+) -> tuple[
+    npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.int64]
+]:
+    """
+    Parse MD strings of a batch of alignments into mismatched bases
+
+    MD strings are split into the same tokens as tinyscibio.parse_md gives,
+    e.g. "10A0^GT5" into ["10", "A", "0", "^GT", "5"], but all at once.
+    Digit tokens cover that many matched bases, and other letters one
+    mismatched base each, while deletions (^) cover no read bases. Missing
+    MD strings cover no bases.
+
+    Returns:
+        A tuple of (mm_pos, mm_lens, md_lens), where mm_pos are the read
+        positions of mismatched bases of all alignments back to back,
+        mm_lens the # of them per alignment, and md_lens the # of read
+        bases each MD string covers.
+
+    Raises:
+        ValueError: when any MD string is invalid.
+    """
+    invalid = mds.filter(~mds.str.contains(MD_STRING))
+    if invalid.len() > 0:
+        raise ValueError(f"Invalid MD string md={invalid[0]!r}.")
+    is_mm = pl.col("mds").str.contains("^[A-Za-z]$")
+    tokens = (
+        pl.DataFrame({"mds": mds.str.extract_all(MD_TOKEN)})
+        .with_row_index("aln")
+        .explode("mds")
+        .select(
+            pl.col("aln"),
+            is_mm.fill_null(False).alias("is_mm"),
+            pl.when(is_mm)
+            .then(1)
+            .otherwise(pl.col("mds").cast(pl.Int64, strict=False))
+            .fill_null(0)
+            .cast(pl.Int64)
+            .alias("n"),
+        )
+        # read position each token starts at
+        .with_columns(pos=pl.col("n").cum_sum().over("aln") - pl.col("n"))
+    )
+    n = mds.len()
+    aln = tokens["aln"].to_numpy()
+    mm = tokens["is_mm"].to_numpy()
+    mm_lens = np.bincount(aln[mm], minlength=n)
+    md_lens = np.bincount(aln, weights=tokens["n"].to_numpy(), minlength=n)
+    return (
+        tokens["pos"].to_numpy()[mm],
+        mm_lens.astype(np.int64),
+        md_lens.astype(np.int64),
+    )
+
+
+def flat_alignments(
+    bqs: Sequence[bytes],
+    mds: pl.Series,
+    table: Optional[pl.DataFrame] = None,
+) -> Alignments:
+    """
+    Lay out base qualities and MD strings of alignments flat
+
+    bqs are base qualities of alignments as bytes, and mds their MD
+    strings, parsed with parse_mds. Columns locating them in the flat
+    arrays are added to table, which has a row per alignment when given.
+
+    Raises:
+        ValueError: when bqs and mds are of different lengths, or any MD
+            string is invalid.
+    """
+    if len(bqs) != mds.len():
+        raise ValueError(
+            f"Number of base qualities {len(bqs)} does not match number of "
+            f"MDs {mds.len()}."
+        )
+    bq_lens = np.fromiter(map(len, bqs), dtype=np.int64, count=len(bqs))
+    mm_pos, mm_lens, md_lens = parse_mds(mds)
+    flat = pl.DataFrame(
+        {
+            "bq_offset": offsets(bq_lens),
+            "bq_len": bq_lens,
+            "mm_offset": offsets(mm_lens),
+            "mm_len": mm_lens,
+            "md_len": md_lens,
+        }
+    )
+    return Alignments(
+        table=flat if table is None else table.hstack(flat),
+        bqs=np.frombuffer(b"".join(bqs), dtype=np.uint8),
+        mm_pos=mm_pos,
+    )
+
+
+def read_alignments(
+    bamf: pysam.AlignmentFile,
+    contig: str,
+    exclude: int = EXCLUDE_FLAG,
+    fraction: float = 1.0,
+) -> Alignments:
+    """
+    Read alignments to the given contig from an opened BAM file
+
+    This mirrors the columns used from tinyscibio.walk_bam, so that the same
+    filters and scoring apply, but reuses a BAM handle already opened by the
+    caller instead of opening the file (and parsing its header) per contig.
+    Only raw tags are collected per alignment: MD strings and CIGARs are
+    parsed and counted for all alignments at once, and base qualities are
+    copied into one flat buffer, as laid out by flat_alignments.
+
+    Parameters:
+        bamf: opened and indexed BAM file.
+        contig: reference sequence name.
+        exclude: skip alignments with any of these flag bits set.
+        fraction: keep only alignments of this fraction of read names,
+            sampled with sampled_qname.
+
+    Returns:
+        Alignments with qnames, propers, mm_ecnt, and indel_ecnt.
+    """
+    qnames: list[str] = []
+    propers: list[bool] = []
+    cigars: list[Optional[str]] = []
+    mds: list[Optional[str]] = []
+    bqs: list[bytes] = []
+    for aln in bamf.fetch(contig=contig):
+        if aln.query_name is None:
+            continue
+        if aln.flag & exclude:
+            continue
+        if fraction < 1.0 and not sampled_qname(aln.query_name, fraction):
+            continue
+        qnames.append(aln.query_name)
+        propers.append(aln.is_proper_pair)
+        cigars.append(aln.cigarstring)
+        mds.append(str(aln.get_tag("MD")) if aln.has_tag("MD") else None)
+        quals = aln.query_qualities
+        bqs.append(b"" if quals is None else quals.tobytes())
+
+    md_strs = pl.Series(mds, dtype=pl.String)
+    table = pl.DataFrame(
+        {
+            "qnames": pl.Series(qnames, dtype=pl.String),
+            "propers": pl.Series(propers, dtype=pl.Boolean),
+            # a mismatched base always follows a digit in valid MD strings
+            "mm_ecnt": md_strs.str.count_matches(r"\d[A-Za-z]")
+            .fill_null(-1)
+            .cast(pl.Int16),
+            "indel_ecnt": pl.Series(cigars, dtype=pl.String)
+            .str.count_matches("[ID]")
+            .fill_null(-1)
+            .cast(pl.Int16),
+        }
+    )
+    return flat_alignments(bqs, md_strs, table)
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+import polars as pl
+import pysam
+
+from ._version import version as __version__
+from .logger import logger
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def bam_identity(bam: Path) -> dict[str, Any]:
+    """Identify BAM file by its size, modification time, and header"""
+    stat = bam.stat()
+    with pysam.AlignmentFile(str(bam), "rb") as bamf:
+        header = str(bamf.header)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "header_digest": _digest(header),
+    }
+
+
+def make_manifest(
+    bam: Path,
+    min_ecnt: Optional[int],
+    alleles: Sequence[str],
+    prescreen: Optional[dict[str, Any]] = None,
+    max_pairs: Optional[int] = None,
+) -> dict[str, Any]:
+    """
+    Make manifest describing how first-allele scores are computed
+
+    Scores are only reused when every entry of the manifest matches.
+    min_ecnt is None for unfiltered per-alignment scores. prescreen
+    settings and max_pairs are only recorded when given.
+    """
+    manifest = {
+        "mhctyper_version": __version__,
+        "bam": bam_identity(bam),
+        "min_ecnt": min_ecnt,
+        "n_alleles": len(alleles),
+        "alleles_digest": _digest("\n".join(alleles)),
+    }
+    if prescreen is not None:
+        manifest["prescreen"] = prescreen
+    if max_pairs is not None:
+        manifest["max_pairs"] = max_pairs
+    return manifest
+
+
+# manifest keys specific to a shard of alleles
+_SHARD_KEYS: tuple[str, ...] = ("shard", "shard_alleles")
+
+
+def make_shard_manifest(
+    manifest: dict[str, Any], shard: tuple[int, int], alleles: Sequence[str]
+) -> dict[str, Any]:
+    """Extend manifest of all alleles with the i-th of N shards of them"""
+    return {**manifest, "shard": list(shard), "shard_alleles": list(alleles)}
+
+
+def _stale_keys(a: dict[str, Any], b: dict[str, Any]) -> list[str]:
+    return sorted(k for k in a.keys() | b.keys() if a.get(k) != b.get(k))
+
+
+def merge_shard_manifests(
+    manifests: Sequence[dict[str, Any]],
+) -> dict[str, Any]:
+    """
+    Check shards are complete and consistent, and return their manifest
+
+    The returned manifest is the one a run scoring all alleles at once
+    would make. ValueError is raised on missing, overlapping, or
+    inconsistent shards.
+    """
+    if not manifests:
+        raise ValueError("Found no shards to merge.")
+    merged = {k: v for k, v in manifests[0].items() if k not in _SHARD_KEYS}
+    for m in manifests[1:]:
+        base = {k: v for k, v in m.items() if k not in _SHARD_KEYS}
+        stale = _stale_keys(merged, base)
+        if stale:
+            raise ValueError(
+                f"Shards are scored differently in: {', '.join(stale)}."
+            )
+    ns = {m["shard"][1] for m in manifests}
+    if len(ns) > 1:
+        raise ValueError(f"Shards are split in different # of shards: {ns}.")
+    n = ns.pop()
+    indices = [m["shard"][0] for m in manifests]
+    missing = sorted(set(range(1, n + 1)) - set(indices))
+    if missing or len(indices) != n:
+        raise ValueError(
+            f"Expected {n} distinct shards, missing shards: {missing}."
+        )
+    alleles = [a for m in manifests for a in m["shard_alleles"]]
+    n_alleles = merged["n_alleles"]
+    if len(set(alleles)) != len(alleles) or len(alleles) != n_alleles:
+        raise ValueError(
+            f"Shards cover {len(set(alleles))} distinct alleles out of "
+            f"{len(alleles)}, expected {n_alleles}."
+        )
+    return merged
+
+
+@dataclass
+class ScoreCache:
+    """
+    Score table cached in Parquet format alongside a JSON manifest
+
+    The manifest is written after the score table, and therefore a
+    missing manifest means the cache is incomplete.
+    """
+
+    fspath: Path
+    manifest_fspath: Path = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.manifest_fspath = self.fspath.with_suffix(".manifest.json")
+
+    def is_valid(self, manifest: dict[str, Any]) -> bool:
+        """Check if cached scores are computed as described by manifest"""
+        cached = self.read_manifest()
+        if cached is None:
+            return False
+        stale = _stale_keys(manifest, cached)
+        if stale:
+            logger.info(
+                f"Cached scores {self.fspath} are stale due to changes "
+                f"in: {', '.join(stale)}."
+            )
+            return False
+        return True
+
+    def read_manifest(self) -> Optional[dict[str, Any]]:
+        """Read manifest of cached scores, or None when incomplete"""
+        if not self.fspath.exists() or not self.manifest_fspath.exists():
+            return None
+        manifest: dict[str, Any] = json.loads(
+            self.manifest_fspath.read_text()
+        )
+        return manifest
+
+    def write(
+        self, scores: pl.DataFrame | pl.LazyFrame, manifest: dict[str, Any]
+    ) -> None:
+        """
+        Write score table, and then its manifest
+
+        Lazy score tables are streamed to the file without being collected.
+        """
+        self.manifest_fspath.unlink(missing_ok=True)
+        tmp_fspath = self.fspath.with_suffix(".parquet.tmp")
+        if isinstance(scores, pl.LazyFrame):
+            scores.sink_parquet(tmp_fspath, compression="zstd")
+        else:
+            scores.write_parquet(tmp_fspath, compression="zstd")
+        tmp_fspath.replace(self.fspath)
+        self.manifest_fspath.write_text(json.dumps(manifest, indent=2))
+
+    def scan(self) -> pl.LazyFrame:
+        """Lazily scan the cached score table"""
+        return pl.scan_parquet(self.fspath)
+
+    def fragments(self) -> FragmentStore:
+        """Store checkpointing per-allele scores while the cache is built"""
+        return FragmentStore(self.fspath.with_suffix(".parts"))
+
+    def clear(self) -> None:
+        self.manifest_fspath.unlink(missing_ok=True)
+        self.fspath.unlink(missing_ok=True)
+        self.fragments().clear()
+
+
+@dataclass
+class FragmentStore:
+    """
+    Scores checkpointed per allele, one Parquet fragment each
+
+    A fragment is written before its allele is appended to the completion
+    log, so an allele in the log always has a complete fragment. Fragments
+    are only valid for the manifest the store is opened with.
+    """
+
+    dirpath: Path
+    manifest_fspath: Path = field(init=False)
+    log_fspath: Path = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.manifest_fspath = self.dirpath / "manifest.json"
+        self.log_fspath = self.dirpath / "completed.jsonl"
+
+    def open(self, manifest: dict[str, Any]) -> set[str]:
+        """Open store for given manifest, and return alleles completed"""
+        if self.manifest_fspath.exists():
+            cached = json.loads(self.manifest_fspath.read_text())
+            if cached == manifest:
+                return self.completed()
+            logger.info(f"Discard stale checkpoints in {self.dirpath}.")
+        self.clear()
+        self.dirpath.mkdir(parents=True)
+        self.manifest_fspath.write_text(json.dumps(manifest, indent=2))
+        return set()
+
+    def completed(self) -> set[str]:
+        """Alleles in the completion log"""
+        if not self.log_fspath.exists():
+            return set()
+        alleles: set[str] = set()
+        for line in self.log_fspath.read_text().splitlines():
+            try:
+                alleles.add(json.loads(line)["allele"])
+            except (json.JSONDecodeError, KeyError):
+                # line partially written when interrupted
+                continue
+        return alleles
+
+    def _fragment(self, allele: str) -> Path:
+        return self.dirpath / f"{allele}.parquet"
+
+    def add(self, allele: str, scores: Optional[pl.DataFrame]) -> None:
+        """
+        Write fragment of an allele, and then mark it as completed
+
+        Alleles without scores are marked as completed without a fragment.
+        """
+        n = 0
+        if scores is not None:
+            fspath = self._fragment(allele)
+            tmp_fspath = fspath.with_suffix(".parquet.tmp")
+            scores.write_parquet(tmp_fspath)
+            tmp_fspath.replace(fspath)
+            n = scores.shape[0]
+        with self.log_fspath.open("a") as fh:
+            fh.write(json.dumps({"allele": allele, "n": n}) + "\n")
+
+    def scan(self, alleles: Sequence[str]) -> Optional[pl.LazyFrame]:
+        """
+        Lazily combine fragments of given alleles in the given order
+
+        None is returned when none of the alleles has a fragment.
+        """
+        fspaths = [self._fragment(a) for a in alleles]
+        fspaths = [f for f in fspaths if f.exists()]
+        if not fspaths:
+            return None
+        return pl.scan_parquet(fspaths)
+
+    def clear(self) -> None:
+        if self.dirpath.exists():
+            shutil.rmtree(self.dirpath)
@@ -1,49 +1,453 @@
 import argparse
+import sys
+from pathlib import Path
 
-from tinyscibio import parse_path
+from ._version import version as __version__
+from .executor import BACKENDS
 
 
-def parse_cmd() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser()
+def parse_path(value: str) -> Path:
+    # tinyscibio pulls in polars and pysam, so only import it once a path
+    # is given, e.g. not for --help or --version
+    from tinyscibio import parse_path
+
+    return parse_path(value)
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse shard given as i/N, with 1 <= i <= N"""
+    try:
+        i, n = (int(v) for v in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"shard must be given as i/N, got {value!r}"
+        ) from None
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(
+            f"shard index must be between 1 and {n}, got {i}"
+        )
+    return i, n
+
+
+def parse_positive_int(value: str) -> int:
+    """Parse an integer greater than 0"""
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected an integer, got {value!r}"
+        ) from None
+    if n <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive, got {n}")
+    return n
+
+
+def parse_fraction(value: str) -> float:
+    """Parse a fraction in (0, 1]"""
+    try:
+        f = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected a number, got {value!r}"
+        ) from None
+    if not 0 < f <= 1:
+        raise argparse.ArgumentTypeError(
+            f"must be greater than 0 and at most 1, got {f}"
+        )
+    return f
+
+
+def _add_freq_arg(
+    parser: argparse.ArgumentParser, required: bool = True
+) -> None:
     parser.add_argument(
-        "--bam",
+        "--freq",
         metavar="FILE",
         type=parse_path,
-        required=True,
-        help="specify path to BAM file",
+        required=required,
+        help="specify path to HLA frequency file.",
     )
+
+
+def _add_chunk_size_arg(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
-        "--freq",
+        "--chunk_size",
+        metavar="INT",
+        type=parse_positive_int,
+        help=(
+            "specify max # of score rows scanned or laid out at once when "
+            "typing, to bound memory (all rows)."
+        ),
+    )
+
+
+def _add_top_pairs_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--top_pairs",
+        metavar="INT",
+        type=int,
+        default=0,
+        help=(
+            "specify to also search this # of top pairs of alleles per "
+            "gene by pair scores (0)."
+        ),
+    )
+
+
+def _add_nproc_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--nproc",
+        metavar="INT",
+        type=int,
+        default=8,
+        help="specify # processes to use (8).",
+    )
+
+
+def _add_backend_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="process",
+        help=(
+            "specify to run workers as spawned processes, or as threads "
+            "sharing BAM files and results in memory (process)."
+        ),
+    )
+
+
+def _add_run_args(parser: argparse.ArgumentParser) -> None:
+    _add_nproc_arg(parser)
+    _add_backend_arg(parser)
+    parser.add_argument(
+        "--memo_size",
+        metavar="INT",
+        type=int,
+        help=(
+            "specify max # of alignment scores memoized per worker (0). "
+            "0 disables the memo."
+        ),
+    )
+    parser.add_argument(
+        "--scan",
+        action="store_true",
+        help="specify to score alleles in a single pass over the BAM.",
+    )
+    _add_chunk_size_arg(parser)
+    _add_top_pairs_arg(parser)
+    parser.add_argument(
+        "--keep_alignments",
+        action="store_true",
+        help=(
+            "specify to cache unfiltered per-alignment scores, "
+            "reusable with any --min_ecnt."
+        ),
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true", help="specify to overwrite scores."
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="specify to enter debug mode."
+    )
+
+
+# required to type a single BAM file, i.e. without a command
+SINGLE_REQUIRED: tuple[str, ...] = ("bam", "freq", "outdir")
+# only supported typing a single BAM file with a single --min_ecnt
+SINGLE_ONLY: tuple[str, ...] = ("prescreen", "max_pairs", "metrics")
+
+
+def parse_cmd() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="mhctyper",
+        description=(
+            "Type HLA alleles of a single BAM file, or run one of the "
+            "commands."
+        ),
+    )
+    parser.add_argument(
+        "--version", action="version", version=f"%(prog)s {__version__}"
+    )
+    # not required when running a command, checked by mhctyper_main
+    parser.add_argument(
+        "--bam",
         metavar="FILE",
         type=parse_path,
-        required=True,
-        help="specify path to HLA frequency file.",
+        help="specify path to BAM file (required).",
     )
+    _add_freq_arg(parser, required=False)
     parser.add_argument(
         "--outdir",
         metavar="DIR",
         type=parse_path,
-        required=True,
-        help="specify path to output folder.",
+        help="specify path to output folder (required).",
     )
     parser.add_argument(
         "--min_ecnt",
         metavar="INT",
         type=int,
-        default=999,
-        help="specify minimum # of mm events (999).",
+        # one value per flag, so that values do not run into a command
+        nargs=1,
+        action="extend",
+        help=(
+            "specify minimum # of mm events (999). Given several times, "
+            "types once per value from a single walk of the BAM."
+        ),
     )
     parser.add_argument(
-        "--nproc",
+        "--shard",
+        metavar="i/N",
+        type=parse_shard,
+        help=(
+            "specify to score first alleles of the i-th of N shards only. "
+            "Shards are combined and typed with mhctyper merge."
+        ),
+    )
+    parser.add_argument(
+        "--prescreen",
+        metavar="INT",
+        type=parse_positive_int,
+        help=(
+            "specify to prescreen alleles on a fraction of read pairs, and "
+            "fully score alleles of this # of top 2-field groups per gene."
+        ),
+    )
+    parser.add_argument(
+        "--prescreen_fraction",
+        metavar="FLOAT",
+        type=parse_fraction,
+        help="specify fraction of read pairs to prescreen alleles on (0.1).",
+    )
+    parser.add_argument(
+        "--max_pairs",
+        metavar="INT",
+        type=parse_positive_int,
+        help=(
+            "specify to cap # of read pairs scored per allele, sampling "
+            "the same fraction of read pairs of all alleles of a gene."
+        ),
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help=(
+            "specify to write wall time, CPU time, and peak RSS per stage, "
+            "and alignment counts per allele to {SM}.metrics.json."
+        ),
+    )
+    _add_run_args(parser)
+
+    commands = parser.add_subparsers(dest="command", title="commands")
+    _add_batch_args(
+        commands.add_parser(
+            "batch", help="type several BAM files on one pool of workers."
+        )
+    )
+    _add_merge_args(
+        commands.add_parser(
+            "merge", help="merge shards scored with --shard, and type them."
+        )
+    )
+    return parser
+
+
+def _add_batch_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--manifest",
+        metavar="FILE",
+        type=parse_path,
+        required=True,
+        help=(
+            "specify path to tab-separated manifest with columns bam and "
+            "outdir, one sample per row."
+        ),
+    )
+    _add_freq_arg(parser)
+    # also given before the command, as --min_ecnt of a single BAM file
+    parser.add_argument(
+        "--min_ecnt",
         metavar="INT",
         type=int,
-        default=8,
-        help="specify # processes to use (8).",
+        nargs=1,
+        action="extend",
+        default=argparse.SUPPRESS,
+        help="specify minimum # of mm events (999).",
     )
+    _add_run_args(parser)
+
+
+def _add_merge_args(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
-        "--overwrite", action="store_true", help="specify to overwrite scores."
+        "--bam",
+        metavar="FILE",
+        type=parse_path,
+        required=True,
+        help="specify path to BAM file the shards are scored from.",
+    )
+    parser.add_argument(
+        "--outdir",
+        metavar="DIR",
+        type=parse_path,
+        required=True,
+        help="specify path to output folder with the shards.",
     )
+    _add_nproc_arg(parser)
+    _add_backend_arg(parser)
+    _add_chunk_size_arg(parser)
+    _add_top_pairs_arg(parser)
     parser.add_argument(
         "--debug", action="store_true", help="specify to enter debug mode."
     )
-    return parser
+
+
+def _fill_defaults(args: argparse.Namespace) -> None:
+    """Fill in defaults defined by the API, once it is imported"""
+    from .likelihood import MEMO_SIZE
+    from .prescreen import PRESCREEN_FRACTION
+
+    if args.memo_size is None:
+        args.memo_size = MEMO_SIZE
+    if getattr(args, "prescreen_fraction", 0) is None:
+        args.prescreen_fraction = PRESCREEN_FRACTION
+
+
+def _batch_main(args: argparse.Namespace) -> None:
+    from .logger import logger
+    from .mhctyper import read_batch_manifest, run_mhctyper_batch
+
+    samples = read_batch_manifest(args.manifest)
+    results = run_mhctyper_batch(
+        samples,
+        freq=args.freq,
+        logdir=args.manifest.parent,
+        min_ecnt=args.min_ecnt[0],
+        nproc=args.nproc,
+        debug=args.debug,
+        overwrite=args.overwrite,
+        scan=args.scan,
+        keep_alignments=args.keep_alignments,
+        memo_size=args.memo_size,
+        chunk_size=args.chunk_size,
+        top_pairs=args.top_pairs,
+        backend=args.backend,
+    )
+    if len(results) < len(samples):
+        logger.error(
+            f"Failed to type {len(samples) - len(results)} of "
+            f"{len(samples)} BAM files."
+        )
+        sys.exit(1)
+
+
+def _merge_main(args: argparse.Namespace) -> None:
+    from .mhctyper import merge_shards
+
+    _, _ = merge_shards(
+        bam=args.bam,
+        outdir=args.outdir,
+        debug=args.debug,
+        chunk_size=args.chunk_size,
+        top_pairs=args.top_pairs,
+        nproc=args.nproc,
+        backend=args.backend,
+    )
+
+
+# CLI main, importing the API only once arguments are parsed
+def mhctyper_main() -> None:
+    parser = parse_cmd()
+    args = parser.parse_args()
+    # values of --min_ecnt extend a list, so its default is set here
+    if args.min_ecnt is None:
+        args.min_ecnt = [999]
+    single_only = [
+        f"--{a}" for a in SINGLE_ONLY if getattr(args, a) not in (None, False)
+    ]
+    if single_only and (
+        args.command is not None
+        or len(args.min_ecnt) > 1
+        or args.shard is not None
+    ):
+        parser.error(
+            f"{', '.join(single_only)} take a single --min_ecnt, and no "
+            "--shard or command."
+        )
+    if args.command == "merge":
+        _merge_main(args)
+        return
+    _fill_defaults(args)
+    if args.command == "batch":
+        if len(args.min_ecnt) > 1:
+            parser.error("batch takes a single --min_ecnt.")
+        _batch_main(args)
+        return
+
+    missing = [a for a in SINGLE_REQUIRED if getattr(args, a) is None]
+    if missing:
+        parser.error(
+            "the following arguments are required: "
+            + ", ".join(f"--{a}" for a in missing)
+        )
+
+    from .mhctyper import run_mhctyper, run_mhctyper_shard, run_mhctyper_sweep
+    from .prescreen import Prescreen
+
+    prescreen = None
+    if args.prescreen is not None:
+        prescreen = Prescreen(args.prescreen, args.prescreen_fraction)
+
+    if args.shard is not None:
+        if len(args.min_ecnt) > 1 or args.keep_alignments:
+            parser.error(
+                "--shard takes a single --min_ecnt, and no --keep_alignments."
+            )
+        _ = run_mhctyper_shard(
+            bam=args.bam,
+            freq=args.freq,
+            outdir=args.outdir,
+            min_ecnt=args.min_ecnt[0],
+            shard=args.shard,
+            nproc=args.nproc,
+            debug=args.debug,
+            overwrite=args.overwrite,
+            scan=args.scan,
+            memo_size=args.memo_size,
+            backend=args.backend,
+        )
+        return
+
+    if len(args.min_ecnt) > 1:
+        _ = run_mhctyper_sweep(
+            bam=args.bam,
+            freq=args.freq,
+            outdir=args.outdir,
+            min_ecnts=args.min_ecnt,
+            nproc=args.nproc,
+            debug=args.debug,
+            overwrite=args.overwrite,
+            scan=args.scan,
+            memo_size=args.memo_size,
+            chunk_size=args.chunk_size,
+            top_pairs=args.top_pairs,
+            backend=args.backend,
+        )
+        return
+
+    _, _ = run_mhctyper(
+        bam=args.bam,
+        freq=args.freq,
+        outdir=args.outdir,
+        min_ecnt=args.min_ecnt[0],
+        nproc=args.nproc,
+        debug=args.debug,
+        overwrite=args.overwrite,
+        scan=args.scan,
+        keep_alignments=args.keep_alignments,
+        memo_size=args.memo_size,
+        chunk_size=args.chunk_size,
+        top_pairs=args.top_pairs,
+        prescreen=prescreen,
+        max_pairs=args.max_pairs,
+        metrics=args.metrics,
+        backend=args.backend,
+    )
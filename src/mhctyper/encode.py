@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from typing import Optional
+
+import polars as pl
+
+# seed of hashes standing in for read names
+QNAME_SEED: int = 0
+
+
+def iter_chunks(
+    scores: pl.LazyFrame, chunk_size: Optional[int] = None
+) -> Iterator[pl.LazyFrame]:
+    """Slice lazily scanned scores into chunks of at most chunk_size rows"""
+    if chunk_size is None:
+        yield scores
+        return
+    n = scores.select(pl.len()).collect().item()
+    for offset in range(0, max(n, 1), chunk_size):
+        yield scores.slice(offset, chunk_size)
+
+
+@dataclass
+class ScoreEncoding:
+    """
+    Compact encoding of alleles, genes, and read names in score tables
+
+    Alleles and genes are cast to enums of their sorted names, so that they
+    are grouped and indexed by integers while sorting the same as strings.
+    Read names are hashed into a UInt64 qid used as read key instead, and
+    only carried as payload for output. 64-bit hashes of a few millions of
+    read names are practically collision-free, and a collision, merging
+    two reads into one, is accepted in exchange for not building a
+    dictionary of read names, which takes 20x longer than hashing them.
+    """
+
+    alleles: list[str]
+    genes: list[str]
+    allele_dtype: pl.Enum = field(init=False)
+    gene_dtype: pl.Enum = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.allele_dtype = pl.Enum(sorted(self.alleles))
+        self.gene_dtype = pl.Enum(sorted(self.genes))
+
+    @classmethod
+    def from_scores(
+        cls, scores: pl.LazyFrame, chunk_size: Optional[int] = None
+    ) -> ScoreEncoding:
+        """Make encoding of alleles and genes found in a score table"""
+        alleles: set[str] = set()
+        genes: set[str] = set()
+        for chunk in iter_chunks(scores, chunk_size):
+            names = chunk.select(
+                pl.col("allele").unique().implode(),
+                pl.col("gene").unique().implode(),
+            ).collect()
+            alleles.update(names["allele"].explode().drop_nulls())
+            genes.update(names["gene"].explode().drop_nulls())
+        return cls(alleles=list(alleles), genes=list(genes))
+
+    def encode(self, scores: pl.LazyFrame) -> pl.LazyFrame:
+        """Encode alleles and genes, and add hashes of read names"""
+        return scores.with_columns(
+            pl.col("allele").cast(self.allele_dtype),
+            pl.col("gene").cast(self.gene_dtype),
+            pl.col("qnames").hash(seed=QNAME_SEED).alias("qid"),
+        )
+
@@ -0,0 +1,31 @@
+from collections.abc import Callable, Sequence
+from multiprocessing import get_context
+from multiprocessing.pool import Pool, ThreadPool
+from typing import Any, Optional
+
+# backends pools of workers can run on
+BACKENDS: tuple[str, ...] = ("process", "thread")
+
+
+def make_pool(
+    backend: str,
+    processes: int,
+    initializer: Optional[Callable[..., object]] = None,
+    initargs: Sequence[Any] = (),
+) -> Pool:
+    """
+    Make a pool of spawned worker processes, or of threads of this process
+
+    Both pools have the API of multiprocessing.pool.Pool. Worker processes
+    start an interpreter each, and pickle tasks and results. Threads share
+    the memory of this process instead, and run in parallel as long as
+    polars, numpy, and htslib release the GIL.
+
+    Raises:
+        ValueError: when backend is not one of BACKENDS.
+    """
+    if backend == "process":
+        return get_context("spawn").Pool(processes, initializer, initargs)
+    if backend == "thread":
+        return ThreadPool(processes, initializer, initargs)
+    raise ValueError(f"Given {backend=} is not one of {BACKENDS}.")
@@ -1,6 +1,10 @@
 import re
 import warnings
+from collections.abc import Sequence
 from dataclasses import dataclass, field, fields
+from functools import cached_property
+
+import polars as pl
 
 __VALID_LOCI: list[str] = [
     "A",
@@ -101,6 +105,21 @@ class HLAllelePattern:
             if isinstance(v, str):
                 setattr(self, f.name, f"(?P<{f.name}>{v.strip()})")
 
+    @property
+    def pattern(self) -> str:
+        """Pattern of HLA allele string up to the given resolution"""
+        return f"{self.prefix}?{self.locus}{self.sep}{self.digit_fields}"
+
+    @cached_property
+    def compiled(self) -> re.Pattern[str]:
+        """Compiled pattern, searched for in HLA allele strings"""
+        return re.compile(self.pattern)
+
+    @cached_property
+    def compiled_full(self) -> re.Pattern[str]:
+        """Compiled pattern matching a complete HLA allele string"""
+        return re.compile(f"^{self.pattern}$")
+
 
 @dataclass
 class HLAllele:
@@ -131,10 +150,7 @@ def _check_if_allele_empty(allele: str) -> None:
 
 def reduce_resolution(allele: str, ap: HLAllelePattern) -> str:
     """Reduce resolution of input HLA allele"""
-    pattern = f"{ap.prefix}?{ap.locus}{ap.sep}{ap.digit_fields}"
-
-    pattern_c = re.compile(pattern)
-    m = pattern_c.search(allele)
+    m = ap.compiled.search(allele)
     if m is None:
         raise ValueError("Failed to decompose the given allele")
 
@@ -149,10 +165,7 @@ def decompose(allele: str, ap: HLAllelePattern) -> HLAllele:
     """Decompose given HLA allele string"""
     _check_if_allele_empty(allele)
 
-    pattern = f"^{ap.prefix}?{ap.locus}{ap.sep}{ap.digit_fields}$"
-
-    pattern_c = re.compile(pattern)
-    m = pattern_c.search(allele)
+    m = ap.compiled_full.search(allele)
     # quit when no match found
     if m is None:
         raise ValueError("Failed to decompose the given allele")
@@ -170,3 +183,54 @@ def decompose(allele: str, ap: HLAllelePattern) -> HLAllele:
         digit_field=m.group("digit_fields"),
         sep=m.group("sep"),
     )
+
+
+def reduce_resolutions(
+    alleles: Sequence[str] | pl.Series, ap: HLAllelePattern
+) -> pl.Series:
+    """
+    Reduce resolution of HLA alleles in bulk
+
+    Alleles are reduced as by reduce_resolution, with native regex
+    matching, and without warnings for alleles already at the resolution.
+    ValueError is raised if any allele fails to match.
+    """
+    alleles = pl.Series("allele", alleles, dtype=pl.String)
+    reduced = alleles.str.extract(ap.pattern, 0)
+    if reduced.null_count() > 0:
+        raise ValueError(
+            "Failed to decompose the given alleles: "
+            f"{alleles.filter(reduced.is_null()).head(5).to_list()}"
+        )
+    return reduced
+
+
+def decompose_alleles(
+    alleles: Sequence[str] | pl.Series, ap: HLAllelePattern
+) -> pl.DataFrame:
+    """
+    Decompose HLA allele strings in bulk
+
+    Alleles are split as by decompose, with native regex matching, into
+    columns allele, prefix, locus, digit_fields, and sep. ValueError is
+    raised if any allele fails to match, or has an invalid locus.
+    """
+    alleles = pl.Series("allele", alleles, dtype=pl.String)
+    parts = (
+        alleles.str.extract_groups(f"^{ap.pattern}$")
+        .struct.unnest()
+        .select(
+            pl.col("prefix").fill_null(""), "locus", "digit_fields", "sep"
+        )
+    )
+    df = pl.DataFrame([alleles]).hstack(parts)
+    failed = df.filter(
+        pl.col("locus").is_null()
+        | ~pl.col("locus").str.to_uppercase().is_in(__VALID_LOCI)
+    )
+    if not failed.is_empty():
+        raise ValueError(
+            "Failed to decompose the given alleles: "
+            f"{failed['allele'].head(5).to_list()}"
+        )
+    return df
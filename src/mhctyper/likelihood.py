@@ -0,0 +1,263 @@
+import math
+from dataclasses import dataclass, replace
+from typing import TypeVar
+
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+
+# scaling factor applied to per-base probabilities before taking log
+# (inherited from polysolver)
+SCALE: float = math.exp(23)
+
+# default max # of alignment scores memoized per worker, off as scoring
+# alignments in bulk is faster than looking them up
+MEMO_SIZE: int = 0
+
+
+def _build_log_prob_tables(
+    scale: float = SCALE,
+) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """
+    Build log-probability lookup tables indexed by Phred base quality
+
+    Error probabilities are computed with the same scalar arithmetic the
+    per-read scoring used, so table look-ups reproduce its values exactly.
+    Phred 0 gives log(0) = -inf for a match, as it did before.
+    """
+    err = np.array([10 ** (-k / 10) for k in range(256)], dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        match = np.log(np.multiply(1 - err, scale))
+        mismatch = np.log(np.multiply(err / 3, scale))
+    return match, mismatch
+
+
+MATCH_LOG_PROBS, MISMATCH_LOG_PROBS = _build_log_prob_tables()
+
+
+@dataclass
+class Alignments:
+    """
+    Alignments with base qualities and mismatches laid out flat
+
+    table has a row per alignment, locating its base qualities in bqs by
+    bq_offset and bq_len, and the read positions of its mismatched bases
+    in mm_pos by mm_offset and mm_len. md_len is the # of read bases its
+    MD string covers. Rows of table can be filtered and reordered as is,
+    as the flat arrays are only indexed through them.
+    """
+
+    table: pl.DataFrame
+    bqs: npt.NDArray[np.uint8]
+    mm_pos: npt.NDArray[np.int64]
+
+    def __len__(self) -> int:
+        return self.table.height
+
+    def with_table(self, table: pl.DataFrame) -> "Alignments":
+        """Alignments of the given rows, e.g. filtered, of table"""
+        return replace(self, table=table)
+
+    def column(self, name: str) -> npt.NDArray[np.int64]:
+        """Offsets or lengths of the given column of table"""
+        return self.table[name].to_numpy().astype(np.int64, copy=False)
+
+
+def offsets(lens: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+    """Offsets of runs of the given lengths laid out back to back"""
+    return np.cumsum(lens) - lens
+
+
+_T = TypeVar("_T", bound=np.generic)
+
+
+def _gather_runs(
+    flat: npt.NDArray[_T],
+    starts: npt.NDArray[np.int64],
+    lens: npt.NDArray[np.int64],
+) -> npt.NDArray[_T]:
+    """Gather runs of flat at starts, of the given lengths, back to back"""
+    shift = np.repeat(starts - offsets(lens), lens)
+    return flat[np.arange(shift.size) + shift]
+
+
+def score_alignments(alns: Alignments) -> pl.Series:
+    """
+    Score log likelihood of a batch of alignments
+
+    Scores are computed on flat per-base arrays using pre-computed
+    log-probability tables, without any per-alignment Python call.
+    Bases are paired with qualities from the beginning of the read, and
+    only bases covered by both MD and base qualities are scored.
+
+    Returns:
+        Log likelihood score per alignment.
+    """
+    n = len(alns)
+    if n == 0:
+        return pl.Series("scores", [], dtype=pl.Float64)
+
+    # bases beyond the end of base qualities are not scored
+    covered = np.minimum(alns.column("md_len"), alns.column("bq_len"))
+    quals = _gather_runs(alns.bqs, alns.column("bq_offset"), covered)
+
+    mm_lens = alns.column("mm_len")
+    mm_aln = np.repeat(np.arange(n), mm_lens)
+    pos = _gather_runs(alns.mm_pos, alns.column("mm_offset"), mm_lens)
+    scored = pos < covered[mm_aln]
+    mask = np.zeros(quals.size, dtype=np.bool_)
+    mask[offsets(covered)[mm_aln[scored]] + pos[scored]] = True
+
+    log_probs = np.where(
+        mask, MISMATCH_LOG_PROBS[quals], MATCH_LOG_PROBS[quals]
+    )
+    aln = np.repeat(np.arange(n), covered)
+    scores = np.bincount(aln, weights=log_probs, minlength=n)
+    return pl.Series("scores", scores, dtype=pl.Float64)
+
+
+# odd multipliers of the polynomial hash of runs of base qualities or
+# mismatch positions, and of # of bases MD strings cover
+_HASH_BASE = np.uint64(0x9E3779B97F4A7C15)
+_HASH_LEN = np.uint64(0xC2B2AE3D27D4EB4F)
+_HASH_MD_LEN = np.uint64(0x94D049BB133111EB)
+
+
+def _hash_runs(
+    flat: npt.NDArray[np.integer], lens: npt.NDArray[np.int64]
+) -> npt.NDArray[np.uint64]:
+    """Polynomial hash (mod 2^64) of runs of flat of the given lengths"""
+    n = lens.size
+    hashes = np.zeros(n, dtype=np.uint64)
+    if flat.size == 0:
+        return hashes ^ (lens.astype(np.uint64) * _HASH_LEN)
+    starts = offsets(lens)
+    # integer overflow wraps around, which is what the hash relies on
+    powers = np.cumprod(np.full(int(lens.max()), _HASH_BASE))
+    pos = np.arange(flat.size) - np.repeat(starts, lens)
+    terms = (flat.astype(np.uint64) + np.uint64(1)) * powers[pos]
+    nonempty = lens > 0
+    hashes[nonempty] = np.add.reduceat(terms, starts[nonempty])
+    return hashes ^ (lens.astype(np.uint64) * _HASH_LEN)
+
+
+def alignment_signatures(
+    alns: Alignments,
+) -> tuple[npt.NDArray[np.uint64], npt.NDArray[np.uint64]]:
+    """
+    Signature of alignments made of hashes of base qualities and MD
+
+    MD strings are hashed by the positions of their mismatched bases and
+    the # of bases they cover. Alignments with the same signature have the
+    same likelihood score.
+    """
+    bq_lens = alns.column("bq_len")
+    bq_keys = _hash_runs(
+        _gather_runs(alns.bqs, alns.column("bq_offset"), bq_lens), bq_lens
+    )
+    mm_lens = alns.column("mm_len")
+    mm_keys = _hash_runs(
+        _gather_runs(alns.mm_pos, alns.column("mm_offset"), mm_lens), mm_lens
+    )
+    md_lens = alns.column("md_len").astype(np.uint64)
+    return bq_keys, mm_keys ^ (md_lens * _HASH_MD_LEN)
+
+
+# odd multiplier mixing base quality and MD hashes into one memo key
+_MEMO_KEY_MIX = np.uint64(0xFF51AFD7ED558CCD)
+
+
+def _memo_keys(
+    bq_keys: npt.NDArray[np.uint64], md_keys: npt.NDArray[np.uint64]
+) -> npt.NDArray[np.uint64]:
+    # integer overflow wraps around, which is what the mix relies on
+    return (bq_keys * _MEMO_KEY_MIX) ^ md_keys
+
+
+class ScoreMemo:
+    """
+    Bounded memo of alignment scores keyed by alignment signature
+
+    A read aligned to closely related alleles usually has the same base
+    qualities and MD string on many of them, so its score is computed once
+    and looked up afterwards. Signatures of base qualities and MD are mixed
+    into one key, so that a read memoized with different MDs on different
+    alleles is looked up with each of them. Look-ups are vectorized with
+    binary search on sorted keys. Once more than max_size scores are
+    memoized, the least recently used ones are evicted down to 3/4 of
+    max_size.
+    """
+
+    def __init__(self, max_size: int = 1_000_000):
+        if max_size <= 0:
+            raise ValueError(f"Given {max_size=} must be positive number.")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._clock = np.uint64(0)
+        self._keys = np.array([], dtype=np.uint64)
+        self._scores = np.array([], dtype=np.float64)
+        self._last_used = np.array([], dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return self._keys.size
+
+    def _lookup(
+        self, keys: npt.NDArray[np.uint64]
+    ) -> tuple[npt.NDArray[np.intp], npt.NDArray[np.bool_]]:
+        idx = np.searchsorted(self._keys, keys)
+        found = idx < self._keys.size
+        found[found] = self._keys[idx[found]] == keys[found]
+        return idx, found
+
+    def _insert(
+        self, keys: npt.NDArray[np.uint64], scores: npt.NDArray[np.float64]
+    ) -> None:
+        keys, first = np.unique(keys, return_index=True)
+        scores = scores[first]
+        idx, exists = self._lookup(keys)
+        new = ~exists
+        idx = idx[new]
+        self._keys = np.insert(self._keys, idx, keys[new])
+        self._scores = np.insert(self._scores, idx, scores[new])
+        self._last_used = np.insert(self._last_used, idx, self._clock)
+        if self._keys.size > self.max_size:
+            self._evict()
+
+    def _evict(self) -> None:
+        keep = np.sort(
+            np.argsort(self._last_used, kind="stable")[
+                -(self.max_size * 3 // 4) :
+            ]
+        )
+        self._keys = self._keys[keep]
+        self._scores = self._scores[keep]
+        self._last_used = self._last_used[keep]
+
+    def score(self, alns: Alignments) -> pl.Series:
+        """Score alignments, computing only those not memoized yet"""
+        n = len(alns)
+        if n == 0:
+            return score_alignments(alns)
+        self._clock += np.uint64(1)
+        keys = _memo_keys(*alignment_signatures(alns))
+        scores = np.empty(n, dtype=np.float64)
+
+        idx, found = self._lookup(keys)
+        scores[found] = self._scores[idx[found]]
+        self._last_used[idx[found]] = self._clock
+
+        missing = np.flatnonzero(~found)
+        if missing.size > 0:
+            # score each distinct signature once
+            _, first, inverse = np.unique(
+                keys[missing], return_index=True, return_inverse=True
+            )
+            rows = alns.table[missing[first]]
+            computed = score_alignments(alns.with_table(rows)).to_numpy()
+            scores[missing] = computed[inverse.reshape(-1)]
+            self._insert(keys[missing[first]], computed)
+
+        self.hits += int(found.sum())
+        self.misses += int(missing.size)
+        return pl.Series("scores", scores, dtype=pl.Float64)
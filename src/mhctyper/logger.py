@@ -1,18 +1,53 @@
 from __future__ import annotations
 
 import logging
-from typing import TYPE_CHECKING, cast
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing import get_context
+from typing import TYPE_CHECKING, Any, cast
 
 if TYPE_CHECKING:
+    from multiprocessing import Queue
     from typing import Optional
 
     from tinyscibio import _PathLike
 
 
+# task being run by each thread
+_tasks = threading.local()
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Prefix records with the process and the task they are logged in
+
+    With threads, records are prefixed with the thread instead, and records
+    of the main thread are left as they are.
+    """
+
+    def __init__(self, threads: bool = False) -> None:
+        super().__init__()
+        self.threads = threads
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.threads and record.threadName == "MainThread":
+            return True
+        prefix = record.threadName if self.threads else record.processName
+        task: Optional[str] = getattr(_tasks, "name", None)
+        if task is not None:
+            prefix = f"{prefix} {task}"
+        record.msg = f"[{prefix}] {record.getMessage()}"
+        record.args = None
+        return True
+
+
 class Logger(logging.Logger):
     def __init__(self, name: str):
         super().__init__(name)
         self._configured = False
+        self._context = _ContextFilter()
 
     def initialize(
         self, debug: bool = False, f: Optional[_PathLike] = None
@@ -45,6 +80,55 @@ class Logger(logging.Logger):
 
         self._configured = True
 
+    @contextmanager
+    def listen(self) -> Iterator[Queue[Any]]:
+        """
+        Handle records sent by worker processes on a queue
+
+        Records are handled by the handlers of this logger in the order
+        they come in, so that workers share the console and debug log of
+        the parent process. Records left on the queue are handled on exit.
+        """
+        queue: Queue[Any] = get_context("spawn").Queue()
+        listener = QueueListener(
+            queue, *self.handlers, respect_handler_level=True
+        )
+        listener.start()
+        try:
+            yield queue
+        finally:
+            listener.stop()
+
+    @contextmanager
+    def tag_threads(self) -> Iterator[None]:
+        """Tag records of worker threads, logged by this logger directly"""
+        context = _ContextFilter(threads=True)
+        self.addFilter(context)
+        try:
+            yield
+        finally:
+            self.removeFilter(context)
+
+    def initialize_worker(
+        self, queue: Queue[Any], debug: bool = False
+    ) -> None:
+        """Send records of a worker process to the listener of its parent"""
+        self.setLevel(logging.DEBUG if debug else logging.INFO)
+        self.handlers.clear()
+        handler = QueueHandler(queue)
+        handler.addFilter(self._context)
+        self.addHandler(handler)
+        self._configured = True
+
+    @contextmanager
+    def task(self, name: str) -> Iterator[None]:
+        """Tag records of workers with the task being run"""
+        _tasks.name = name
+        try:
+            yield
+        finally:
+            _tasks.name = None
+
 
 logging.setLoggerClass(Logger)
 # logging.getLogger returns Logger type
@@ -0,0 +1,377 @@
+import heapq
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from functools import cached_property, partial
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+import polars as pl
+
+from .encode import ScoreEncoding, iter_chunks
+from .executor import make_pool
+
+
+@dataclass
+class GeneMatrix:
+    """
+    Sparse read x allele matrix of first-allele scores of one gene
+
+    Scores are kept in CSR layout: scores of the i-th read are
+    data[indptr[i]:indptr[i + 1]], at columns indices[...] of the alleles
+    it aligns to. Reads are keyed by their qid, and columns are sorted by
+    allele name, so that the first of tied alleles is the least one.
+    """
+
+    gene: str
+    reads: pl.Series
+    alleles: pl.Series
+    indptr: npt.NDArray[np.int64]
+    indices: npt.NDArray[np.int64]
+    data: npt.NDArray[np.float64]
+
+    @classmethod
+    def from_chunks(
+        cls, gene: str, chunks: Iterable[pl.DataFrame]
+    ) -> Optional["GeneMatrix"]:
+        """
+        Build matrix from chunks of encoded scores with qid, qnames, and allele
+
+        Of every chunk, only scores, their qids and allele codes, and one name
+        per read are kept. Returns None if no chunk has any score.
+        """
+        qid_parts, code_parts, data_parts, names = [], [], [], []
+        dtype = None
+        for chunk in chunks:
+            if chunk.is_empty():
+                continue
+            # alleles are enum-encoded, so that codes are ranks of their names
+            dtype = chunk["allele"].dtype
+            qid_parts.append(chunk["qid"].to_numpy())
+            code_parts.append(chunk["allele"].to_physical().to_numpy())
+            data_parts.append(chunk["scores"].to_numpy().astype(np.float64))
+            names.append(chunk.select("qid", "qnames").unique("qid"))
+        if dtype is None:
+            return None
+        qids = np.concatenate(qid_parts)
+        # group scores by read, in no particular order of alleles
+        order = np.argsort(qids)
+        qids = qids[order]
+        codes = np.concatenate(code_parts)[order]
+        starts = np.flatnonzero(np.diff(qids, prepend=~qids[:1]) != 0)
+        present = np.bincount(codes) > 0
+        return cls(
+            gene=gene,
+            # rows are in order of qid, as are unique qids once sorted
+            reads=pl.concat(names).unique("qid").sort("qid")["qnames"],
+            alleles=pl.Series(np.flatnonzero(present), dtype=pl.UInt32)
+            .cast(dtype)
+            .cast(pl.String),
+            indptr=np.append(starts, qids.size).astype(np.int64),
+            indices=(np.cumsum(present) - 1)[codes].astype(np.int64),
+            data=np.concatenate(data_parts)[order],
+        )
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.indptr.size - 1, self.alleles.len()
+
+    @cached_property
+    def rows(self) -> npt.NDArray[np.int64]:
+        """Read (row) index of every stored score"""
+        n_reads = self.shape[0]
+        return np.repeat(np.arange(n_reads), np.diff(self.indptr))
+
+    def totals(
+        self, weights: Optional[npt.NDArray[np.float64]] = None
+    ) -> npt.NDArray[np.float64]:
+        """Sum up scores, or the given per-score weights, per allele"""
+        return np.bincount(
+            self.indices,
+            weights=self.data if weights is None else weights,
+            minlength=self.shape[1],
+        )
+
+    def column(
+        self, j: int
+    ) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.bool_]]:
+        """Get dense scores of allele j per read, and reads aligned to it"""
+        hit = self.indices == j
+        rows = self.rows[hit]
+        scores = np.zeros(self.shape[0], dtype=np.float64)
+        aligned = np.zeros(self.shape[0], dtype=np.bool_)
+        scores[rows] = self.data[hit]
+        aligned[rows] = True
+        return scores, aligned
+
+    def condition_on(self, j: int) -> "SecondScores":
+        """
+        Score second allele conditioned on allele j as the first one
+
+        Scores of reads also aligned to allele j are scaled by
+        score / (score + score of allele j).
+        """
+        scores, aligned = self.column(j)
+        rows = self.rows
+        right = scores[rows]
+        factor = self.data / (self.data + right)
+        return SecondScores(
+            matrix=self,
+            first=j,
+            scores=self.data * factor,
+            scores_right=right,
+            factor=factor,
+            aligned=aligned[rows],
+        )
+
+    def pair_row(
+        self, j: int, totals: npt.NDArray[np.float64]
+    ) -> npt.NDArray[np.float64]:
+        """Score pairs of allele j with every allele, given allele totals"""
+        right = self.column(j)[0][self.rows]
+        right += self.data
+        second = self.totals(np.divide(np.square(self.data), right, out=right))
+        row: npt.NDArray[np.float64] = totals[j] + second
+        return row
+
+    def pair_scores(self) -> npt.NDArray[np.float64]:
+        """
+        Score every ordered pair of alleles of the gene
+
+        Entry (a, b) is the total score of allele a plus the total score of
+        allele b conditioned on a, i.e. what typing would give if a was
+        picked as the first allele. Per read, this comes down to
+        (x^2 + xy + y^2) / (x + y) for scores x and y of a and b, so that
+        the matrix is symmetric.
+        """
+        totals = self.totals()
+        return np.stack(
+            [self.pair_row(j, totals) for j in range(self.shape[1])]
+        )
+
+    def pair_bounds(self) -> npt.NDArray[np.float64]:
+        """
+        Bound scores of pairs of each allele with any allele from above
+
+        Scores of a read on the other allele are at most its max score M
+        on any allele, and a pair scores y^2 / (x + y) <= M^2 / (x + M) on
+        top of allele score x. Bounds only hold for non-negative scores.
+        """
+        totals = self.totals()
+        read_max = np.maximum.reduceat(self.data, self.indptr[:-1])
+        m = read_max[self.rows]
+        gain = self.totals(m * m / (self.data + m) - m)
+        bounds: npt.NDArray[np.float64] = np.minimum(
+            totals + read_max.sum() + gain, totals + totals.max()
+        )
+        return bounds
+
+    def top_pairs(self, n: int) -> tuple[list[tuple[int, int, float]], int]:
+        """
+        Search n pairs of alleles with the highest pair scores
+
+        Alleles are visited by descending bound, and pairs of a visited
+        allele with all alleles not visited yet are scored at once. The
+        search stops as soon as the bound of the next allele falls below
+        the n-th best pair found, so that only alleles likely in a top
+        pair are scored. With negative scores, all pairs are scored. Of
+        tied pairs, the least ones by columns, i.e. by names, win.
+
+        Returns:
+            A tuple of pairs of columns (a <= b) and their scores, best
+            first, and the # of alleles visited.
+        """
+        n_alleles = self.shape[1]
+        totals = self.totals()
+        bounds = self.pair_bounds()
+        if (self.data < 0).any():
+            bounds[:] = np.inf
+        # heap of (score, -a, -b), so that the worst pair, and of tied
+        # pairs the one with the greatest columns, is the first to go
+        best: list[tuple[float, int, int]] = []
+        visited = np.zeros(n_alleles, dtype=np.bool_)
+        n_visited = 0
+        for a in np.argsort(-bounds, kind="stable"):
+            if len(best) == n and bounds[a] < best[0][0]:
+                break
+            row = self.pair_row(int(a), totals)
+            others = np.flatnonzero(~visited)
+            visited[a] = True
+            n_visited += 1
+            if others.size > n:
+                others = _top_columns(others, row[others], n)
+            for b in others:
+                pair = (float(row[b]), -int(min(a, b)), -int(max(a, b)))
+                if len(best) < n:
+                    heapq.heappush(best, pair)
+                elif pair > best[0]:
+                    heapq.heapreplace(best, pair)
+        pairs = sorted(best, reverse=True)
+        return [(-a, -b, score) for score, a, b in pairs], n_visited
+
+
+def _top_columns(
+    columns: npt.NDArray[np.intp], values: npt.NDArray[np.float64], n: int
+) -> npt.NDArray[np.intp]:
+    """Pick n columns with the highest values, the least ones on ties"""
+    nth = -np.partition(-values, n - 1)[n - 1]
+    above = columns[values > nth]
+    tied = columns[values == nth][: n - above.size]
+    return np.concatenate([above, tied])
+
+
+@dataclass
+class SecondScores:
+    """Scores of a gene matrix conditioned on its first allele"""
+
+    matrix: GeneMatrix
+    first: int
+    scores: npt.NDArray[np.float64]
+    scores_right: npt.NDArray[np.float64]
+    factor: npt.NDArray[np.float64]
+    aligned: npt.NDArray[np.bool_]
+
+    def totals(self) -> npt.NDArray[np.float64]:
+        return self.matrix.totals(self.scores)
+
+    def frames(
+        self, tot_scores: float, chunk_size: Optional[int] = None
+    ) -> Iterator[pl.DataFrame]:
+        """
+        Lay out scores as second-allele score table, chunk by chunk
+
+        Columns are those of first-allele scores, plus scores_right,
+        allele_right, and tot_scores of the first allele, the latter two
+        null for reads not aligned to it, and the factor scores are scaled
+        by.
+        """
+        m = self.matrix
+        n = m.data.size
+        step = chunk_size or max(n, 1)
+        rows = m.rows
+        first = m.alleles[self.first]
+        for start in range(0, max(n, 1), step):
+            part = slice(start, start + step)
+            aligned = pl.Series(self.aligned[part])
+            yield pl.DataFrame(
+                {
+                    "qnames": m.reads.gather(rows[part]),
+                    "scores": self.scores[part],
+                    "allele": m.alleles.gather(m.indices[part]),
+                    "gene": pl.repeat(m.gene, aligned.len(), eager=True),
+                    "scores_right": self.scores_right[part],
+                    "allele_right": pl.select(
+                        pl.when(aligned).then(pl.lit(first))
+                    ).to_series(),
+                    "tot_scores": pl.select(
+                        pl.when(aligned).then(pl.lit(tot_scores))
+                    ).to_series(),
+                    "factor": self.factor[part],
+                }
+            )
+
+
+def pick_allele(totals: npt.NDArray[np.float64]) -> tuple[int, float]:
+    """
+    Pick allele with the max total score, rounded to 4 decimal places
+
+    Of tied alleles, the least one by name, i.e. the first column, wins.
+
+    Returns:
+        A tuple of the column of the allele picked and its rounded score.
+    """
+    rounded = pl.Series(totals, dtype=pl.Float64).round(4).to_numpy()
+    j = int(np.argmax(rounded))
+    return j, float(rounded[j])
+
+
+def gene_matrix(
+    scores: pl.LazyFrame,
+    encoding: ScoreEncoding,
+    gene: str,
+    chunk_size: Optional[int] = None,
+) -> Optional[GeneMatrix]:
+    """
+    Build matrix of scores of the gene, or None if it has no score
+
+    Scores are scanned at most chunk_size rows at a time when given, so
+    that only the matrix, with one name per read, is held as a whole.
+    """
+    chunks = (
+        # filter before encoding to push the predicate down to the scan
+        encoding.encode(chunk.filter(pl.col("gene") == gene))
+        .select("qid", "qnames", "allele", "scores")
+        .collect()
+        for chunk in iter_chunks(scores, chunk_size)
+    )
+    return GeneMatrix.from_chunks(gene, chunks)
+
+
+def gene_matrices(
+    scores: pl.LazyFrame,
+    encoding: ScoreEncoding,
+    chunk_size: Optional[int] = None,
+) -> Iterator[GeneMatrix]:
+    """Build matrices of scores one gene at a time"""
+    for gene in encoding.gene_dtype.categories:
+        matrix = gene_matrix(scores, encoding, gene, chunk_size)
+        if matrix is not None:
+            yield matrix
+
+
+def _top_pairs_of_gene(
+    gene: str,
+    scores: pl.LazyFrame,
+    encoding: ScoreEncoding,
+    n: int,
+    chunk_size: Optional[int] = None,
+) -> Optional[pl.DataFrame]:
+    matrix = gene_matrix(scores, encoding, gene, chunk_size)
+    if matrix is None:
+        return None
+    pairs, _ = matrix.top_pairs(n)
+    return pl.DataFrame(
+        [
+            (matrix.alleles[a], matrix.alleles[b], gene, score, rank)
+            for rank, (a, b, score) in enumerate(pairs, start=1)
+        ],
+        schema={
+            "allele_1": pl.String,
+            "allele_2": pl.String,
+            "gene": pl.String,
+            "tot_scores": pl.Float64,
+            "rank": pl.Int64,
+        },
+        orient="row",
+    ).with_columns(pl.col("tot_scores").round(4))
+
+
+def top_pairs_by_gene(
+    scores: pl.LazyFrame,
+    encoding: ScoreEncoding,
+    n: int,
+    nproc: int = 1,
+    backend: str = "process",
+    chunk_size: Optional[int] = None,
+) -> pl.DataFrame:
+    """
+    Search top n pairs of alleles per gene by pair scores
+
+    Genes are searched in parallel on nproc processes or threads, as given
+    by backend, each building the matrix of its gene from the score table
+    on its own, at most chunk_size rows at a time when given.
+    """
+    genes = encoding.gene_dtype.categories.to_list()
+    task = partial(
+        _top_pairs_of_gene,
+        scores=scores,
+        encoding=encoding,
+        n=n,
+        chunk_size=chunk_size,
+    )
+    if nproc > 1 and len(genes) > 1:
+        with make_pool(backend, min(nproc, len(genes))) as pool:
+            tables = pool.map(task, genes)
+    else:
+        tables = [task(gene) for gene in genes]
+    return pl.concat([t for t in tables if t is not None])
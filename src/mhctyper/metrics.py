@@ -0,0 +1,115 @@
+import json
+import resource
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+from .logger import logger
+
+
+def _cpu_s() -> float:
+    """CPU time of this process and its children waited for"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (
+        own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    )
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+@dataclass
+class Metrics:
+    """
+    Performance metrics of a run, per stage, allele, and gene
+
+    Stages record wall time, CPU time, including that of worker processes
+    once they exit, and peak RSS of this process and of its largest child
+    so far. Stages may nest, e.g. genes typed while alleles are scored.
+    """
+
+    stages: list[dict[str, Any]] = field(default_factory=list)
+    alleles: list[dict[str, Any]] = field(default_factory=list)
+    genes: list[dict[str, Any]] = field(default_factory=list)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        wall, cpu = time.perf_counter(), _cpu_s()
+        try:
+            yield
+        finally:
+            self.stages.append(
+                {
+                    "stage": name,
+                    "wall_s": round(time.perf_counter() - wall, 4),
+                    "cpu_s": round(_cpu_s() - cpu, 4),
+                    "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+                    "children_peak_rss_mb": _peak_rss_mb(
+                        resource.RUSAGE_CHILDREN
+                    ),
+                }
+            )
+
+    def write(self, fspath: Path) -> None:
+        fspath.write_text(json.dumps(asdict(self), indent=2))
+        logger.info(f"Write performance metrics to {fspath}.")
+
+
+# metrics of the current run, only collected when set
+_metrics: Optional[Metrics] = None
+
+
+@contextmanager
+def collect_metrics(enabled: bool = True) -> Iterator[Optional[Metrics]]:
+    """Collect metrics of the run within, if enabled"""
+    global _metrics
+    if not enabled:
+        yield None
+        return
+    _metrics = Metrics()
+    try:
+        yield _metrics
+    finally:
+        _metrics = None
+
+
+def collecting() -> bool:
+    """Check if metrics of the current run are being collected"""
+    return _metrics is not None
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Record metrics of a stage, when collecting them"""
+    if _metrics is None:
+        yield
+        return
+    with _metrics.stage(name):
+        yield
+
+
+def record_allele(allele: str, elapsed: float, counts: dict[str, int]) -> None:
+    """Record time spent scoring an allele and its alignment counts"""
+    if _metrics is not None:
+        _metrics.alleles.append(
+            {"allele": allele, "elapsed_s": round(elapsed, 4), **counts}
+        )
+
+
+def record_gene(gene: str, n_reads: int, n_alleles: int, wall: float) -> None:
+    """Record time spent typing a gene and the size of its matrix"""
+    if _metrics is not None:
+        _metrics.genes.append(
+            {
+                "gene": gene,
+                "reads": n_reads,
+                "alleles": n_alleles,
+                "wall_s": round(wall, 4),
+            }
+        )
@@ -2,14 +2,36 @@
 
 from __future__ import annotations
 
+import sys
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from dataclasses import asdict, dataclass
 from pathlib import Path
+from typing import Any, Optional
 
 import polars as pl
 from tinyscibio import BAMetadata, make_dir
 
-from .cli import parse_cmd
+from .cache import (
+    ScoreCache,
+    bam_identity,
+    make_manifest,
+    make_shard_manifest,
+    merge_shard_manifests,
+)
+from .encode import ScoreEncoding
+from .likelihood import MEMO_SIZE
 from .logger import logger
-from .score_alleles import get_winners, score_a_one, score_a_two
+from .matrix import top_pairs_by_gene
+from .metrics import collect_metrics, stage
+from .pipeline import GeneTracker, GeneTyper
+from .prescreen import Prescreen, allele_groups, prescreen_alleles
+from .schedule import gene_fractions, index_read_counts, shard_alleles
+from .score_alleles import (
+    SCORE_SCHEMA,
+    AlleleScores,
+    apply_min_ecnt,
+    score_a_one_by_sample,
+)
 from .utils import (
     collect_alleles_to_type,
     load_allele_pop_freq,
@@ -17,17 +39,7 @@ from .utils import (
 )
 
 
-def run_mhctyper(
-    bam: Path,
-    freq: Path,
-    outdir: Path,
-    min_ecnt: int,
-    nproc: int,
-    debug: bool = False,
-    overwrite: bool = False,
-) -> tuple[pl.DataFrame, Path]:
-    make_dir(outdir, exist_ok=True, parents=True)
-
+def _initialize_logger(outdir: Path, debug: bool) -> None:
     # set up logger accordingly
     if debug:
         debug_log_fspath = outdir / f"{__name__}.debug.log"
@@ -37,77 +49,749 @@ def run_mhctyper(
     else:
         logger.initialize(debug)
 
-    logger.info(f"Start HLA typing from given BAM file: {bam}")
 
+def _load_kept_alleles(freq: Path) -> list[str]:
     allele_pop_freq = load_allele_pop_freq(freq_fspath=freq)
+    return allele_pop_freq["Allele"].to_list()
 
+
+def _load_alleles_to_type(
+    bam: Path, kept: list[str]
+) -> tuple[list[str], str]:
     bam_metadata = BAMetadata(str(bam))
     # collect all alleles to type from BAM header
-    alleles_to_type = collect_alleles_to_type(
-        bam_metadata, kept=allele_pop_freq["Allele"].to_list()
-    )
+    alleles_to_type = collect_alleles_to_type(bam_metadata, kept=kept)
 
     rg_sm = load_rg_sm_from_bam(bam_metadata)
+    return alleles_to_type, rg_sm
 
-    out_a1 = outdir / f"{rg_sm}.a1.tsv"
+
+@dataclass
+class Sample:
+    """Inputs and outputs of typing HLA alleles from one BAM file"""
+
+    bam: Path
+    outdir: Path
+    rg_sm: str
+    alleles_to_type: list[str]
+    # mapped reads per allele, read once from the BAM index
+    read_counts: dict[str, int]
+    a1_cache: ScoreCache
+    a1_manifest: dict[str, Any]
+    out_a2: Path
+    hla_res: Path
+
+
+def _prepare_sample(
+    bam: Path,
+    outdir: Path,
+    kept: list[str],
+    min_ecnt: int,
+    keep_alignments: bool,
+    overwrite: bool,
+    prescreen: Optional[Prescreen] = None,
+    max_pairs: Optional[int] = None,
+) -> Sample:
+    make_dir(outdir, exist_ok=True, parents=True)
+    alleles_to_type, rg_sm = _load_alleles_to_type(bam, kept)
+
+    # unfiltered per-alignment scores are cached separately, and
+    # are valid for any min_ecnt
+    a1_cache = ScoreCache(
+        outdir / f"{rg_sm}.a1.alignments.parquet"
+        if keep_alignments
+        else outdir / f"{rg_sm}.a1.parquet"
+    )
     out_a2 = outdir / f"{rg_sm}.a2.tsv"
     hla_res = outdir / f"{rg_sm}.hlatyping.res.tsv"
     if overwrite:
         logger.info("Overwrite specified. Delete results previously computed.")
-        out_a1.unlink(missing_ok=True)
+        a1_cache.clear()
         out_a2.unlink(missing_ok=True)
         hla_res.unlink(missing_ok=True)
 
-    a1_scores = pl.DataFrame()
-    if not out_a1.exists():
-        a1_scores = score_a_one(
-            alleles_to_score=alleles_to_type,
-            bam=bam,
+    a1_manifest = make_manifest(
+        bam=bam,
+        min_ecnt=None if keep_alignments else min_ecnt,
+        alleles=alleles_to_type,
+        prescreen=asdict(prescreen) if prescreen is not None else None,
+        max_pairs=max_pairs,
+    )
+    return Sample(
+        bam=bam,
+        outdir=outdir,
+        rg_sm=rg_sm,
+        alleles_to_type=alleles_to_type,
+        read_counts=index_read_counts(bam),
+        a1_cache=a1_cache,
+        a1_manifest=a1_manifest,
+        out_a2=out_a2,
+        hla_res=hla_res,
+    )
+
+
+def _score_a1_checkpointed(
+    jobs: Sequence[tuple[Path, list[str], ScoreCache, dict[str, Any]]],
+    min_ecnt: int,
+    nproc: int,
+    debug: bool,
+    scan: bool,
+    keep_alignments: bool,
+    memo_size: int,
+    fractions: Optional[Mapping[str, float]] = None,
+    on_checkpoint: Optional[Callable[[int, str], None]] = None,
+    backend: str = "process",
+    read_counts: Optional[Sequence[Mapping[str, int]]] = None,
+) -> Iterator[tuple[int, Optional[pl.LazyFrame]]]:
+    """
+    Score first alleles, checkpointing scores of every allele
+
+    jobs are BAM files, alleles to score, and the score cache with its
+    manifest. Scores of each allele are written to the fragments of its
+    cache as soon as they come in, and alleles already in the fragments,
+    from a run interrupted under the same manifest, are not scored again.
+    Once all alleles of a job are scored, fragments are streamed in allele
+    order into the cache, and the job index is yielded with a scan of the
+    cache, or None if no allele is scored. on_checkpoint, when given, is
+    called with the job index and allele once an allele is checkpointed,
+    including alleles resumed from the fragments. read_counts of each job,
+    when given, spare reading the BAM index again.
+    """
+    stores = [a1_cache.fragments() for _, _, a1_cache, _ in jobs]
+    samples: list[tuple[Path, list[str]]] = []
+    for (bam, alleles, _, manifest), store in zip(jobs, stores):
+        completed = store.open(manifest)
+        if completed:
+            logger.info(
+                f"Resume from {len(completed)} alleles checkpointed in "
+                f"{store.dirpath}."
+            )
+        samples.append((bam, [a for a in alleles if a not in completed]))
+    if on_checkpoint is not None:
+        for i, store in enumerate(stores):
+            for allele in sorted(store.completed()):
+                on_checkpoint(i, allele)
+
+    def _checkpoint(i: int, res: AlleleScores) -> None:
+        stores[i].add(res.allele, res.scores)
+        if on_checkpoint is not None:
+            on_checkpoint(i, res.allele)
+
+    for i, _ in score_a_one_by_sample(
+        samples,
+        min_ecnt=min_ecnt,
+        nproc=nproc,
+        debug=debug,
+        scan=scan,
+        keep_alignments=keep_alignments,
+        memo_size=memo_size,
+        on_scored=_checkpoint,
+        fractions=fractions,
+        backend=backend,
+        read_counts=read_counts,
+    ):
+        _, alleles, a1_cache, manifest = jobs[i]
+        scores = stores[i].scan(alleles)
+        if scores is not None:
+            a1_cache.write(scores, manifest)
+        stores[i].clear()
+        yield i, a1_cache.scan() if scores is not None else None
+
+
+def _load_or_score_a1(
+    a1_cache: ScoreCache,
+    a1_manifest: dict[str, Any],
+    alleles_to_type: list[str],
+    bam: Path,
+    min_ecnt: int,
+    nproc: int,
+    debug: bool,
+    scan: bool,
+    keep_alignments: bool,
+    memo_size: int,
+    prescreen: Optional[Prescreen] = None,
+    fractions: Optional[Mapping[str, float]] = None,
+    on_gene_scored: Optional[Callable[[pl.LazyFrame], None]] = None,
+    backend: str = "process",
+    read_counts: Optional[Mapping[str, int]] = None,
+) -> pl.LazyFrame:
+    """
+    Load scores of first alleles from cache, or score them
+
+    When on_gene_scored is given, it is called with the scores of a gene
+    as soon as all alleles of the gene are scored, while other genes are
+    still being scored. read_counts are # of mapped reads per allele, read
+    from the BAM index when not given.
+    """
+    if a1_cache.is_valid(a1_manifest):
+        logger.info("Found scores of first alleles previously computed.")
+        return a1_cache.scan()
+
+    if read_counts is None:
+        read_counts = index_read_counts(bam)
+    if prescreen is not None:
+        with stage("prescreen"):
+            alleles_to_type = prescreen_alleles(
+                bam,
+                alleles_to_type,
+                prescreen,
+                min_ecnt=min_ecnt,
+                nproc=nproc,
+                debug=debug,
+                scan=scan,
+                memo_size=memo_size,
+                fractions=fractions,
+                backend=backend,
+                read_counts=read_counts,
+            )
+
+    on_checkpoint = None
+    if on_gene_scored is not None:
+        on_checkpoint = _gene_checkpoints(
+            a1_cache, read_counts, alleles_to_type, on_gene_scored
+        )
+    logger.info("Score first allele.")
+    with stage("score_a1"):
+        [(_, a1_scores)] = list(
+            _score_a1_checkpointed(
+                [(bam, alleles_to_type, a1_cache, a1_manifest)],
+                min_ecnt=min_ecnt,
+                nproc=nproc,
+                debug=debug,
+                scan=scan,
+                keep_alignments=keep_alignments,
+                memo_size=memo_size,
+                fractions=fractions,
+                on_checkpoint=on_checkpoint,
+                backend=backend,
+                read_counts=[read_counts],
+            )
+        )
+    if a1_scores is None:
+        logger.error("Failed to score for any first alleles.")
+        sys.exit(1)
+    return a1_scores
+
+
+def _gene_checkpoints(
+    a1_cache: ScoreCache,
+    counts: Mapping[str, int],
+    alleles: list[str],
+    on_gene_scored: Callable[[pl.LazyFrame], None],
+) -> Callable[[int, str], None]:
+    """Make callback passing checkpointed scores of complete genes on"""
+    # alleles without any mapped read are skipped by scoring
+    tracker = GeneTracker.from_alleles(
+        [a for a in alleles if counts.get(a, 0) > 0]
+    )
+    store = a1_cache.fragments()
+
+    def _on_checkpoint(_: int, allele: str) -> None:
+        gene = tracker.complete(allele)
+        if gene is None:
+            return
+        scores = store.scan(tracker.alleles[gene])
+        if scores is not None:
+            on_gene_scored(scores)
+
+    return _on_checkpoint
+
+
+def _pair_fractions(
+    counts: Mapping[str, int], alleles: list[str], max_pairs: int
+) -> tuple[dict[str, float], dict[str, float]]:
+    """Get fractions of read pairs to score per allele and per gene"""
+    genes = dict(allele_groups(alleles).select("allele", "gene").iter_rows())
+    by_gene = gene_fractions(genes, counts, max_pairs)
+    for gene, fraction in sorted(by_gene.items()):
+        if fraction < 1.0:
+            logger.info(f"Score {gene} on {fraction:.2%} of read pairs.")
+    return {a: by_gene[g] for a, g in genes.items()}, by_gene
+
+
+def _is_empty(scores: pl.LazyFrame) -> bool:
+    return bool(scores.select(pl.len()).collect().item() == 0)
+
+
+def type_alleles(
+    a1_scores: pl.LazyFrame,
+    rg_sm: str,
+    out_a2: Path,
+    hla_res: Path,
+    chunk_size: Optional[int] = None,
+    top_pairs: int = 0,
+    nproc: int = 1,
+    fractions: Optional[Mapping[str, float]] = None,
+    backend: str = "process",
+) -> pl.DataFrame:
+    """
+    Type both alleles per gene from scores of the first allele
+
+    Scores are typed one gene at a time on a sparse read x allele matrix,
+    and scores of the second allele are written to out_a2 at most
+    chunk_size rows at a time when given. With top_pairs, the top pairs of
+    alleles per gene by pair scores are also searched on nproc processes
+    or threads, as given by backend, and written next to hla_res as
+    {SM}.hlatyping.pairs.tsv. fractions of read pairs scored per gene,
+    when given, are recorded in hla_res.
+    """
+    if _is_empty(a1_scores):
+        logger.error("Failed to score for any first alleles.")
+        sys.exit(1)
+
+    with out_a2.open("w") as a2_fh, hla_res.open("w") as res_fh:
+        typer = GeneTyper(rg_sm, a2_fh, res_fh, chunk_size, fractions)
+        typer.type_genes(a1_scores)
+    hla_res_df = typer.result(hla_res)
+
+    if top_pairs > 0:
+        _write_top_pairs(
+            a1_scores, rg_sm, hla_res, top_pairs, nproc, chunk_size, backend
+        )
+    return hla_res_df
+
+
+def _write_top_pairs(
+    a1_scores: pl.LazyFrame,
+    rg_sm: str,
+    hla_res: Path,
+    top_pairs: int,
+    nproc: int,
+    chunk_size: Optional[int] = None,
+    backend: str = "process",
+) -> None:
+    logger.info(f"Search top {top_pairs} pairs of alleles per gene.")
+    encoding = ScoreEncoding.from_scores(a1_scores, chunk_size)
+    pairs_df = top_pairs_by_gene(
+        a1_scores,
+        encoding,
+        n=top_pairs,
+        nproc=nproc,
+        backend=backend,
+        chunk_size=chunk_size,
+    ).with_columns(sample=pl.lit(rg_sm))
+    out_pairs = hla_res.with_name(
+        hla_res.name.removesuffix(".res.tsv") + ".pairs.tsv"
+    )
+    logger.info(f"Top pairs of alleles: {pairs_df}")
+    pairs_df.write_csv(out_pairs, separator="\t")
+
+
+def run_mhctyper(
+    bam: Path,
+    freq: Path,
+    outdir: Path,
+    min_ecnt: int,
+    nproc: int,
+    debug: bool = False,
+    overwrite: bool = False,
+    scan: bool = False,
+    keep_alignments: bool = False,
+    memo_size: int = MEMO_SIZE,
+    chunk_size: Optional[int] = None,
+    top_pairs: int = 0,
+    prescreen: Optional[Prescreen] = None,
+    max_pairs: Optional[int] = None,
+    metrics: bool = False,
+    backend: str = "process",
+) -> tuple[pl.DataFrame, Path]:
+    make_dir(outdir, exist_ok=True, parents=True)
+    _initialize_logger(outdir, debug)
+
+    with collect_metrics(metrics) as run_metrics, stage("run"):
+        logger.info(f"Start HLA typing from given BAM file: {bam}")
+        with stage("load_freq"):
+            kept = _load_kept_alleles(freq)
+        with stage("collect_alleles"):
+            sample = _prepare_sample(
+                bam,
+                outdir,
+                kept=kept,
+                min_ecnt=min_ecnt,
+                keep_alignments=keep_alignments,
+                overwrite=overwrite,
+                prescreen=prescreen,
+                max_pairs=max_pairs,
+            )
+        allele_fractions, fractions = None, None
+        if max_pairs is not None:
+            allele_fractions, fractions = _pair_fractions(
+                sample.read_counts, sample.alleles_to_type, max_pairs
+            )
+
+        def _filter(scores: pl.LazyFrame) -> pl.LazyFrame:
+            if keep_alignments:
+                return apply_min_ecnt(scores, min_ecnt)
+            return scores
+
+        # genes are typed as soon as all their alleles are scored, while
+        # alleles of other genes are still being scored
+        with (
+            sample.out_a2.open("w") as a2_fh,
+            sample.hla_res.open("w") as res_fh,
+        ):
+            typer = GeneTyper(
+                sample.rg_sm, a2_fh, res_fh, chunk_size, fractions
+            )
+            a1_scores = _filter(
+                _load_or_score_a1(
+                    sample.a1_cache,
+                    sample.a1_manifest,
+                    sample.alleles_to_type,
+                    bam=bam,
+                    min_ecnt=min_ecnt,
+                    nproc=nproc,
+                    debug=debug,
+                    scan=scan,
+                    keep_alignments=keep_alignments,
+                    memo_size=memo_size,
+                    prescreen=prescreen,
+                    fractions=allele_fractions,
+                    on_gene_scored=lambda scores: typer.type_genes(
+                        _filter(scores)
+                    ),
+                    backend=backend,
+                    read_counts=sample.read_counts,
+                )
+            )
+            # genes not typed yet, e.g. with scores loaded from cache
+            with stage("type"):
+                typer.type_genes(a1_scores)
+        if not typer.typed:
+            logger.error("Failed to score for any first alleles.")
+            sys.exit(1)
+        with stage("write_results"):
+            hla_res_df = typer.result(sample.hla_res)
+
+        if top_pairs > 0:
+            with stage("top_pairs"):
+                _write_top_pairs(
+                    a1_scores,
+                    sample.rg_sm,
+                    sample.hla_res,
+                    top_pairs,
+                    nproc,
+                    chunk_size,
+                    backend,
+                )
+    if run_metrics is not None:
+        run_metrics.write(sample.outdir / f"{sample.rg_sm}.metrics.json")
+    return (hla_res_df, sample.hla_res)
+
+
+def read_batch_manifest(manifest: Path) -> list[tuple[Path, Path]]:
+    """Read pairs of BAM file and output folder from a batch manifest"""
+    df = pl.read_csv(manifest, separator="\t")
+    missing = {"bam", "outdir"} - set(df.columns)
+    if missing:
+        logger.error(
+            f"Manifest {manifest} misses columns: "
+            f"{', '.join(sorted(missing))}."
+        )
+        sys.exit(1)
+    return [
+        (Path(bam), Path(outdir))
+        for bam, outdir in df.select("bam", "outdir").iter_rows()
+    ]
+
+
+def run_mhctyper_batch(
+    samples: Sequence[tuple[Path, Path]],
+    freq: Path,
+    logdir: Path,
+    min_ecnt: int,
+    nproc: int,
+    debug: bool = False,
+    overwrite: bool = False,
+    scan: bool = False,
+    keep_alignments: bool = False,
+    memo_size: int = MEMO_SIZE,
+    chunk_size: Optional[int] = None,
+    top_pairs: int = 0,
+    backend: str = "process",
+) -> list[tuple[pl.DataFrame, Path]]:
+    """
+    Type HLA alleles of several BAM files on one pool of workers
+
+    samples are pairs of BAM file and output folder, and each sample writes
+    the same outputs as run_mhctyper. The frequency file is loaded once,
+    first alleles of all samples are scored on the same pool, and a sample
+    is typed as soon as its first alleles are scored. Samples failing to
+    score are logged and left out of the returned results.
+    """
+    make_dir(logdir, exist_ok=True, parents=True)
+    _initialize_logger(logdir, debug)
+
+    logger.info(f"Start HLA typing of {len(samples)} BAM files.")
+
+    kept = _load_kept_alleles(freq)
+    prepared = [
+        _prepare_sample(
+            bam,
+            outdir,
+            kept=kept,
             min_ecnt=min_ecnt,
+            keep_alignments=keep_alignments,
+            overwrite=overwrite,
+        )
+        for bam, outdir in samples
+    ]
+
+    def _type_sample(
+        sample: Sample, a1_scores: Optional[pl.LazyFrame]
+    ) -> Optional[tuple[pl.DataFrame, Path]]:
+        if a1_scores is not None and keep_alignments:
+            a1_scores = apply_min_ecnt(a1_scores, min_ecnt)
+        if a1_scores is None or _is_empty(a1_scores):
+            logger.error(f"Failed to score any first alleles: {sample.bam}")
+            return None
+        logger.info(f"Type HLA alleles from BAM file: {sample.bam}")
+        hla_res_df = type_alleles(
+            a1_scores,
+            sample.rg_sm,
+            sample.out_a2,
+            sample.hla_res,
+            chunk_size=chunk_size,
+            top_pairs=top_pairs,
             nproc=nproc,
-            debug=debug,
+            backend=backend,
         )
-        a1_scores.write_csv(out_a1, separator="\t")
-    else:
-        logger.info("Found scores of first alleles previously computed.")
-        a1_scores = pl.read_csv(out_a1, separator="\t")
+        return (hla_res_df, sample.hla_res)
 
-    logger.info("Get winner for the first typed allele.")
-    a1_winners = get_winners(allele_scores=a1_scores)
-    winner_scores = a1_scores.join(
-        a1_winners, on=["gene", "allele"], how="inner"
+    results: list[Optional[tuple[pl.DataFrame, Path]]] = [None] * len(
+        prepared
     )
+    to_score: list[int] = []
+    for i, sample in enumerate(prepared):
+        if sample.a1_cache.is_valid(sample.a1_manifest):
+            logger.info(f"Found scores of first alleles for {sample.bam}.")
+            results[i] = _type_sample(sample, sample.a1_cache.scan())
+        else:
+            to_score.append(i)
 
-    a2_scores = score_a_two(
-        a1_scores=a1_scores,
-        a1_winners=winner_scores,
+    for j, scores in _score_a1_checkpointed(
+        [
+            (s.bam, s.alleles_to_type, s.a1_cache, s.a1_manifest)
+            for s in (prepared[i] for i in to_score)
+        ],
+        min_ecnt=min_ecnt,
         nproc=nproc,
+        debug=debug,
+        scan=scan,
+        keep_alignments=keep_alignments,
+        memo_size=memo_size,
+        backend=backend,
+        read_counts=[prepared[i].read_counts for i in to_score],
+    ):
+        results[to_score[j]] = _type_sample(prepared[to_score[j]], scores)
+    return [r for r in results if r is not None]
+
+
+def run_mhctyper_sweep(
+    bam: Path,
+    freq: Path,
+    outdir: Path,
+    min_ecnts: Sequence[int],
+    nproc: int,
+    debug: bool = False,
+    overwrite: bool = False,
+    scan: bool = False,
+    memo_size: int = MEMO_SIZE,
+    chunk_size: Optional[int] = None,
+    top_pairs: int = 0,
+    backend: str = "process",
+) -> list[tuple[pl.DataFrame, Path]]:
+    """
+    Type HLA alleles once per min_ecnt from a single walk of the BAM
+
+    Unfiltered per-alignment scores of the first allele are computed (or
+    loaded from cache) once, and each min_ecnt is then applied as a filter.
+    Outputs are written per min_ecnt as {SM}.min_ecnt_{N}.*.tsv.
+    """
+    make_dir(outdir, exist_ok=True, parents=True)
+    _initialize_logger(outdir, debug)
+
+    logger.info(f"Start HLA typing from given BAM file: {bam}")
+
+    alleles_to_type, rg_sm = _load_alleles_to_type(
+        bam, _load_kept_alleles(freq)
     )
-    a2_scores.write_csv(out_a2, separator="\t")
-    logger.info("Get winner for the second typed allele.")
-    a2_winners = get_winners(allele_scores=a2_scores)
-
-    logger.info("Combine winnes for both first and second alleles.")
-    hla_res_df = pl.concat([a1_winners, a2_winners])
-    hla_res_df = hla_res_df.with_columns(sample=pl.lit(rg_sm)).sort(
-        by="allele"
+
+    min_ecnts = list(dict.fromkeys(min_ecnts))
+    a1_cache = ScoreCache(outdir / f"{rg_sm}.a1.alignments.parquet")
+    outputs = {
+        min_ecnt: (
+            outdir / f"{rg_sm}.min_ecnt_{min_ecnt}.a2.tsv",
+            outdir / f"{rg_sm}.min_ecnt_{min_ecnt}.hlatyping.res.tsv",
+        )
+        for min_ecnt in min_ecnts
+    }
+    if overwrite:
+        logger.info("Overwrite specified. Delete results previously computed.")
+        a1_cache.clear()
+        for out_a2, hla_res in outputs.values():
+            out_a2.unlink(missing_ok=True)
+            hla_res.unlink(missing_ok=True)
+
+    a1_manifest = make_manifest(
+        bam=bam, min_ecnt=None, alleles=alleles_to_type
     )
-    logger.info(f"Final HLA typing result: {hla_res_df}")
-    hla_res_df.write_csv(hla_res, separator="\t")
-    return (hla_res_df, hla_res)
+    aln_scores = _load_or_score_a1(
+        a1_cache,
+        a1_manifest,
+        alleles_to_type,
+        bam=bam,
+        min_ecnt=max(min_ecnts),
+        nproc=nproc,
+        debug=debug,
+        scan=scan,
+        keep_alignments=True,
+        memo_size=memo_size,
+        backend=backend,
+    )
+
+    results: list[tuple[pl.DataFrame, Path]] = []
+    for min_ecnt, (out_a2, hla_res) in outputs.items():
+        logger.info(f"Type HLA alleles with {min_ecnt=}.")
+        a1_scores = apply_min_ecnt(aln_scores, min_ecnt)
+        hla_res_df = type_alleles(
+            a1_scores,
+            rg_sm,
+            out_a2,
+            hla_res,
+            chunk_size=chunk_size,
+            top_pairs=top_pairs,
+            nproc=nproc,
+            backend=backend,
+        )
+        results.append((hla_res_df, hla_res))
+    return results
+
+
+def run_mhctyper_shard(
+    bam: Path,
+    freq: Path,
+    outdir: Path,
+    min_ecnt: int,
+    shard: tuple[int, int],
+    nproc: int,
+    debug: bool = False,
+    overwrite: bool = False,
+    scan: bool = False,
+    memo_size: int = MEMO_SIZE,
+    backend: str = "process",
+) -> Path:
+    """
+    Score first alleles of the i-th of N shards of alleles to type
+
+    Alleles are split into N shards of similar read counts in the BAM
+    index, the same way for every shard. Scores are written to
+    {SM}.a1.shard_{i}_of_{N}.parquet, and are typed together with the other
+    shards by merge_shards.
+    """
+    make_dir(outdir, exist_ok=True, parents=True)
+    _initialize_logger(outdir, debug)
+
+    i, n = shard
+    logger.info(f"Start scoring shard {i}/{n} from given BAM file: {bam}")
+
+    sample = _prepare_sample(
+        bam,
+        outdir,
+        kept=_load_kept_alleles(freq),
+        min_ecnt=min_ecnt,
+        keep_alignments=False,
+        overwrite=False,
+    )
+    shards = shard_alleles(sample.alleles_to_type, sample.read_counts, n)
+    alleles = shards[i - 1]
+    logger.info(f"Shard {i}/{n} has {len(alleles)} alleles to score.")
+
+    shard_cache = ScoreCache(
+        outdir / f"{sample.rg_sm}.a1.shard_{i}_of_{n}.parquet"
+    )
+    if overwrite:
+        logger.info("Overwrite specified. Delete results previously computed.")
+        shard_cache.clear()
+    shard_manifest = make_shard_manifest(sample.a1_manifest, shard, alleles)
+    if shard_cache.is_valid(shard_manifest):
+        logger.info(f"Found scores of shard {i}/{n} previously computed.")
+        return shard_cache.fspath
+
+    [(_, scores)] = list(
+        _score_a1_checkpointed(
+            [(bam, alleles, shard_cache, shard_manifest)],
+            min_ecnt=min_ecnt,
+            nproc=nproc,
+            debug=debug,
+            scan=scan,
+            keep_alignments=False,
+            memo_size=memo_size,
+            backend=backend,
+            read_counts=[sample.read_counts],
+        )
+    )
+    if scores is None:
+        # shards are complete even without any scores
+        shard_cache.write(pl.DataFrame(schema=SCORE_SCHEMA), shard_manifest)
+    logger.info(f"Scores of shard {i}/{n} written to {shard_cache.fspath}.")
+    return shard_cache.fspath
+
+
+def merge_shards(
+    bam: Path,
+    outdir: Path,
+    debug: bool = False,
+    chunk_size: Optional[int] = None,
+    top_pairs: int = 0,
+    nproc: int = 1,
+    backend: str = "process",
+) -> tuple[pl.DataFrame, Path]:
+    """
+    Merge shards of first-allele scores, and type HLA alleles from them
+
+    All N shards scored by run_mhctyper_shard must be found in outdir.
+    Merged scores are cached as {SM}.a1.parquet, exactly as if all alleles
+    were scored at once, and typing writes the same outputs as run_mhctyper.
+    """
+    _initialize_logger(outdir, debug)
 
+    rg_sm = load_rg_sm_from_bam(BAMetadata(str(bam)))
+    shard_caches = [
+        ScoreCache(fspath)
+        for fspath in sorted(outdir.glob(f"{rg_sm}.a1.shard_*_of_*.parquet"))
+    ]
+    logger.info(f"Merge {len(shard_caches)} shards found in {outdir}.")
+    try:
+        manifests = []
+        for shard_cache in shard_caches:
+            manifest = shard_cache.read_manifest()
+            if manifest is None:
+                raise ValueError(f"Shard {shard_cache.fspath} is incomplete.")
+            manifests.append(manifest)
+        a1_manifest = merge_shard_manifests(manifests)
+        if a1_manifest["bam"] != bam_identity(bam):
+            raise ValueError(f"BAM file {bam} changed since shards scored.")
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
 
-# CLI main
-def mhctyper_main() -> None:
-    parser = parse_cmd()
-    args = parser.parse_args()
+    a1_cache = ScoreCache(outdir / f"{rg_sm}.a1.parquet")
+    a1_cache.write(
+        pl.scan_parquet([c.fspath for c in shard_caches]), a1_manifest
+    )
+    a1_scores = a1_cache.scan()
 
-    _, _ = run_mhctyper(
-        bam=args.bam,
-        freq=args.freq,
-        outdir=args.outdir,
-        min_ecnt=args.min_ecnt,
-        nproc=args.nproc,
-        debug=args.debug,
-        overwrite=args.overwrite,
+    out_a2 = outdir / f"{rg_sm}.a2.tsv"
+    hla_res = outdir / f"{rg_sm}.hlatyping.res.tsv"
+    hla_res_df = type_alleles(
+        a1_scores,
+        rg_sm,
+        out_a2,
+        hla_res,
+        chunk_size=chunk_size,
+        top_pairs=top_pairs,
+        nproc=nproc,
+        backend=backend,
     )
+    return (hla_res_df, hla_res)
@@ -0,0 +1,130 @@
+import time
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, TextIO
+
+import polars as pl
+
+from .encode import ScoreEncoding
+from .logger import logger
+from .matrix import GeneMatrix, gene_matrix, pick_allele
+from .metrics import record_gene
+from .prescreen import allele_groups
+
+
+@dataclass
+class GeneTracker:
+    """Track alleles left to score per gene"""
+
+    genes: dict[str, str]
+    alleles: dict[str, list[str]]
+    pending: dict[str, set[str]]
+
+    @classmethod
+    def from_alleles(cls, alleles: Sequence[str]) -> "GeneTracker":
+        genes = dict(
+            allele_groups(alleles).select("allele", "gene").iter_rows()
+        )
+        by_gene: dict[str, list[str]] = {}
+        for allele in alleles:
+            by_gene.setdefault(genes[allele], []).append(allele)
+        return cls(
+            genes=genes,
+            alleles=by_gene,
+            pending={g: set(a) for g, a in by_gene.items()},
+        )
+
+    def complete(self, allele: str) -> Optional[str]:
+        """Mark allele as scored, and return its gene if it is the last"""
+        gene = self.genes.get(allele)
+        if gene is None or gene not in self.pending:
+            return None
+        self.pending[gene].discard(allele)
+        if self.pending[gene]:
+            return None
+        del self.pending[gene]
+        return gene
+
+
+@dataclass
+class GeneTyper:
+    """
+    Type both alleles per gene, one gene at a time, streaming results
+
+    Genes can be typed in any order, e.g. as soon as all their alleles are
+    scored. Scores of a gene are scanned into its matrix, and scores of
+    its second allele appended to a2_fh, at most chunk_size rows at a time
+    when given, and its typed alleles to res_fh. fractions of read pairs
+    scored per gene, when given, are recorded along with typed alleles.
+    """
+
+    rg_sm: str
+    a2_fh: TextIO
+    res_fh: TextIO
+    chunk_size: Optional[int] = None
+    fractions: Optional[Mapping[str, float]] = None
+    typed: set[str] = field(default_factory=set)
+    winners: list[tuple[str, str, float]] = field(default_factory=list)
+
+    def _frame(self, winners: list[tuple[str, str, float]]) -> pl.DataFrame:
+        df = pl.DataFrame(
+            winners, schema=["allele", "gene", "tot_scores"], orient="row"
+        ).with_columns(sample=pl.lit(self.rg_sm))
+        if self.fractions is not None:
+            df = df.with_columns(
+                fraction=pl.col("gene").replace_strict(
+                    self.fractions, default=1.0, return_dtype=pl.Float64
+                )
+            )
+        return df
+
+    def type_matrix(self, matrix: GeneMatrix) -> None:
+        """Type both alleles of the gene of a score matrix"""
+        start = time.perf_counter()
+        n_reads, n_alleles = matrix.shape
+        logger.info(
+            f"Type {matrix.gene} on {n_reads} reads x {n_alleles} alleles."
+        )
+        a1, a1_tot = pick_allele(matrix.totals())
+        a2_scores = matrix.condition_on(a1)
+        a2, a2_tot = pick_allele(a2_scores.totals())
+        for chunk in a2_scores.frames(a1_tot, self.chunk_size):
+            chunk.write_csv(
+                self.a2_fh,
+                separator="\t",
+                include_header=self.a2_fh.tell() == 0,
+            )
+        winners = [
+            (matrix.alleles[a1], matrix.gene, a1_tot),
+            (matrix.alleles[a2], matrix.gene, a2_tot),
+        ]
+        self._frame(winners).write_csv(
+            self.res_fh,
+            separator="\t",
+            include_header=self.res_fh.tell() == 0,
+        )
+        self.res_fh.flush()
+        self.winners.extend(winners)
+        self.typed.add(matrix.gene)
+        record_gene(
+            matrix.gene, n_reads, n_alleles, time.perf_counter() - start
+        )
+
+    def type_genes(self, scores: pl.LazyFrame) -> None:
+        """Type genes of first-allele scores not typed yet"""
+        # scores are filtered by gene chunk by chunk, which only bounds
+        # memory with chunks sliced off the scan before filtering
+        encoding = ScoreEncoding.from_scores(scores, self.chunk_size)
+        for gene in sorted(set(encoding.genes) - self.typed):
+            matrix = gene_matrix(scores, encoding, gene, self.chunk_size)
+            if matrix is not None:
+                self.type_matrix(matrix)
+
+    def result(self, hla_res: Path) -> pl.DataFrame:
+        """Write typed alleles of all genes to hla_res, sorted by allele"""
+        logger.info("Combine winnes for both first and second alleles.")
+        hla_res_df = self._frame(self.winners).sort(by="allele")
+        logger.info(f"Final HLA typing result: {hla_res_df}")
+        hla_res_df.write_csv(hla_res, separator="\t")
+        return hla_res_df
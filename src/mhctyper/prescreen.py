@@ -0,0 +1,117 @@
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import polars as pl
+
+from .hla_allele import HLAllelePattern, decompose_alleles, reduce_resolutions
+from .logger import logger
+from .score_alleles import score_a_one_by_sample
+
+# default fraction of read pairs alleles are prescreened on
+PRESCREEN_FRACTION: float = 0.1
+
+
+@dataclass
+class Prescreen:
+    """
+    Settings of prescreening alleles before scoring them in full
+
+    Alleles are first scored on a fraction of read pairs, and only alleles
+    of the top_k 2-field allele groups per gene are scored in full.
+    """
+
+    top_k: int
+    fraction: float = PRESCREEN_FRACTION
+
+
+def allele_groups(alleles: Sequence[str]) -> pl.DataFrame:
+    """Get gene and 2-field allele group of alleles"""
+    parts = decompose_alleles(alleles, HLAllelePattern())
+    return parts.select(
+        "allele",
+        gene=pl.concat_str("prefix", "locus"),
+        group=reduce_resolutions(alleles, HLAllelePattern(resolution=2)),
+    )
+
+
+def select_top_groups(
+    groups: pl.DataFrame, scores: pl.DataFrame, top_k: int
+) -> list[str]:
+    """
+    Select alleles of the top_k allele groups per gene by proxy scores
+
+    Groups rank by the highest total score of their alleles, with ties
+    broken by group name. All alleles of genes without any proxy score are
+    kept, as they cannot be ranked.
+    """
+    group_scores = (
+        groups.join(scores.select("allele", "scores"), on="allele")
+        .group_by("gene", "group", "allele")
+        .agg(pl.col("scores").sum())
+        .group_by("gene", "group")
+        .agg(pl.col("scores").max())
+    )
+    top = (
+        group_scores.sort(["scores", "group"], descending=[True, False])
+        .group_by("gene", maintain_order=True)
+        .head(top_k)
+    )
+    kept = groups.filter(
+        pl.col("group").is_in(top["group"])
+        | ~pl.col("gene").is_in(group_scores["gene"])
+    )
+    return kept["allele"].to_list()
+
+
+def prescreen_alleles(
+    bam: Path,
+    alleles: list[str],
+    prescreen: Prescreen,
+    min_ecnt: int,
+    nproc: int,
+    debug: bool,
+    scan: bool,
+    memo_size: int,
+    fractions: Optional[Mapping[str, float]] = None,
+    backend: str = "process",
+    read_counts: Optional[Mapping[str, int]] = None,
+) -> list[str]:
+    """
+    Prescreen alleles on a fraction of read pairs, keeping top groups
+
+    Alleles capped to smaller fractions of read pairs are prescreened on
+    the latter. read_counts are # of mapped reads per allele, read from
+    the BAM index when not given.
+    """
+    fractions = fractions or {}
+    logger.info(
+        f"Prescreen {len(alleles)} alleles on {prescreen.fraction:.0%} of "
+        "read pairs."
+    )
+    [(_, scores)] = list(
+        score_a_one_by_sample(
+            [(bam, alleles)],
+            min_ecnt=min_ecnt,
+            nproc=nproc,
+            debug=debug,
+            scan=scan,
+            memo_size=memo_size,
+            fractions={
+                a: min(prescreen.fraction, fractions.get(a, 1.0))
+                for a in alleles
+            },
+            backend=backend,
+            read_counts=None if read_counts is None else [read_counts],
+        )
+    )
+    if scores is None:
+        logger.info("No allele scored in prescreen. Score all alleles.")
+        return alleles
+    kept = select_top_groups(allele_groups(alleles), scores, prescreen.top_k)
+    logger.info(
+        f"Keep {len(kept)} alleles of the top {prescreen.top_k} allele "
+        "groups per gene."
+    )
+    return kept
@@ -0,0 +1,109 @@
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+
+import pysam
+
+# # of small tasks per process the scheduler aims for, so that the largest
+# tasks run first and small ones fill in the gaps at the end
+_TASKS_PER_PROC: int = 4
+
+
+def index_read_counts(bam: Path) -> dict[str, int]:
+    """Get # of mapped reads per contig from the BAM index"""
+    with pysam.AlignmentFile(str(bam), "rb") as bamf:
+        return {s.contig: s.mapped for s in bamf.get_index_statistics()}
+
+
+def schedule_alleles(
+    alleles: Sequence[str], counts: Mapping[str, int], nproc: int
+) -> list[list[str]]:
+    """
+    Group alleles into tasks ordered by descending expected cost
+
+    Alleles are sorted by their # of mapped reads, and consecutive alleles
+    are batched into one task until the task reaches a target cost of
+    1/(nproc * 4) of the total. Heavily covered alleles therefore get a task
+    of their own and are dispatched first, while the many small ones share
+    tasks and cost fewer round-trips to workers.
+    """
+    ranked = sorted(alleles, key=lambda a: counts.get(a, 0), reverse=True)
+    total = sum(counts.get(a, 0) for a in ranked)
+    target = max(1, total // (max(1, nproc) * _TASKS_PER_PROC))
+    tasks: list[list[str]] = []
+    task: list[str] = []
+    cost = 0
+    for allele in ranked:
+        task.append(allele)
+        cost += counts.get(allele, 0)
+        if cost >= target:
+            tasks.append(task)
+            task, cost = [], 0
+    if task:
+        tasks.append(task)
+    return tasks
+
+
+def balance_blocks(
+    alleles: Sequence[str], counts: Mapping[str, int], n: int
+) -> list[list[str]]:
+    """
+    Split alleles into at most n contiguous blocks of similar cost
+
+    Unlike schedule_alleles, the order of alleles is kept, so that each
+    block can be read from front to back.
+    """
+    n = max(1, min(n, len(alleles)))
+    total = sum(counts.get(a, 0) for a in alleles)
+    blocks: list[list[str]] = [[] for _ in range(n)]
+    cum = 0
+    for allele in alleles:
+        # place allele by the cumulative cost at its midpoint
+        cost = counts.get(allele, 0)
+        i = min(n - 1, int((cum + cost / 2) * n / total)) if total else 0
+        blocks[i].append(allele)
+        cum += cost
+    return [b for b in blocks if b]
+
+
+def shard_alleles(
+    alleles: Sequence[str], counts: Mapping[str, int], n: int
+) -> list[list[str]]:
+    """
+    Split alleles into n disjoint shards of similar cost
+
+    Alleles are assigned from the most to the least covered, each to the
+    shard with the lowest cost so far, with ties broken by allele and shard
+    index, so the split only depends on alleles and counts. Alleles keep
+    their given order within a shard.
+    """
+    ranked = sorted(alleles, key=lambda a: (-counts.get(a, 0), a))
+    costs = [0] * n
+    assigned: dict[str, int] = {}
+    for allele in ranked:
+        i = min(range(n), key=lambda j: (costs[j], j))
+        assigned[allele] = i
+        costs[i] += counts.get(allele, 0)
+    shards: list[list[str]] = [[] for _ in range(n)]
+    for allele in alleles:
+        shards[assigned[allele]].append(allele)
+    return shards
+
+
+def gene_fractions(
+    genes: Mapping[str, str], counts: Mapping[str, int], max_pairs: int
+) -> dict[str, float]:
+    """
+    Get fraction of read pairs to sample per gene to cap its read pairs
+
+    genes maps alleles to their genes. Read pairs of a gene are estimated
+    by its allele with the most mapped reads, so that each allele of the
+    gene is scored on about max_pairs read pairs at most, and all alleles
+    of a gene are sampled alike.
+    """
+    pairs: dict[str, float] = {}
+    for allele, gene in genes.items():
+        pairs[gene] = max(pairs.get(gene, 0), counts.get(allele, 0) / 2)
+    return {
+        gene: min(1.0, max_pairs / n) if n > 0 else 1.0
+        for gene, n in pairs.items()
+    }
@@ -1,87 +1,94 @@
-import logging
-import math
 import sys
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass
 from functools import partial
-from multiprocessing import get_context
+from multiprocessing.pool import Pool
 from pathlib import Path
-from typing import Optional, cast
+from typing import TYPE_CHECKING, Any, Optional
 
-import numpy as np
 import polars as pl
-from tinyscibio import BAMetadata, walk_bam
-from tqdm import tqdm
 
-from .hla_allele import HLAllelePattern, decompose
+from .bam import read_alignments
+from .executor import make_pool
+from .likelihood import Alignments, ScoreMemo, score_alignments
 from .logger import logger
+from .metrics import collecting, record_allele
+from .schedule import balance_blocks, index_read_counts, schedule_alleles
+from .worker import shared_worker_state, worker_state
 
+if TYPE_CHECKING:
+    from multiprocessing import Queue
 
-def score_log_liklihood(
-    row: dict[str, list[int] | list[str]], scale: float = math.exp(23)
-) -> float:
-    score: float = 0.0
-    start, end = 0, 0
-    base_qs = cast(list[int], row["bqs"])
-    md = cast(list[str], row["mds"])
-    for i in range(len(md)):
-        if md[i].startswith("^"):
-            continue
-        block = np.array([])
-        if md[i].isalpha():
-            # mismatches
-            end = start + len(md[i])
-            block = np.array([10 ** (-k / 10) / 3 for k in base_qs[start:end]])
-        else:
-            # matches
-            end = start + int(md[i])
-            block = np.array([1 - 10 ** (-k / 10) for k in base_qs[start:end]])
-        score += np.sum(np.log(np.multiply(block, scale)))
-        start = end
-    return score
+# schema of per-read score tables
+SCORE_SCHEMA: dict[str, pl.DataType] = {
+    "qnames": pl.String(),
+    "scores": pl.Float64(),
+    "allele": pl.String(),
+    "gene": pl.String(),
+}
 
+# memo of alignment scores shared by all alleles scored in a thread, as
+# memos are not safe to update from several threads at once
+_local = threading.local()
 
-def score_per_allele(
-    allele: str,
-    bam_fspath: Path,
-    min_ecnt: int,
-    log_fspath: Optional[str] = None,
-) -> pl.DataFrame | None:
-    debug = True if log_fspath is not None else False
-    logger.initialize(debug, log_fspath)
 
-    ap = HLAllelePattern()
-    hla_allele = decompose(allele, ap)
-    logger.debug(f"{hla_allele=}")
-    hla_gene = f"{hla_allele.prefix}{hla_allele.locus}"
-    logger.debug(f"{hla_gene=}")
+def configure_score_memo(max_size: int) -> None:
+    """Set up memo of alignment scores, or disable it with max_size 0"""
+    memo: Optional[ScoreMemo] = getattr(_local, "score_memo", None)
+    if max_size <= 0:
+        _local.score_memo = None
+    elif memo is None or memo.max_size != max_size:
+        _local.score_memo = ScoreMemo(max_size)
 
-    bametadata = BAMetadata(str(bam_fspath))
-    df = walk_bam(
-        str(bam_fspath),
-        allele,
-        exclude=3584,
-        return_ecnt=True,
-        return_bq=True,
-        return_md=True,
-        return_qname=True,
-    )
-    # walk_bam returns rname as id
-    # convert it back to rname
-    df = df.with_columns(
-        pl.col("rnames").replace_strict(bametadata.idx2seqname()),
+
+def _score(alns: Alignments) -> pl.Series:
+    memo: Optional[ScoreMemo] = getattr(_local, "score_memo", None)
+    if memo is None:
+        return score_alignments(alns)
+    hits, misses = memo.hits, memo.misses
+    scores = memo.score(alns)
+    logger.debug(
+        f"Score memo: {memo.hits - hits} hits and "
+        f"{memo.misses - misses} misses "
+        f"({memo.hits} hits, {memo.misses} misses, and "
+        f"{len(memo)} scores memoized so far)."
     )
-    logger.debug(f"walk_bam returns {df.shape[0]} alignments.")
+    return scores
+
+
+def filter_alignments(
+    df: pl.DataFrame, min_ecnt: int, counts: Optional[dict[str, int]] = None
+) -> pl.DataFrame:
+    """
+    Keep paired, proper alignments without indels and excessive mms
+
+    When counts is given, # of alignments kept by each filter, applied one
+    after another, are added to it.
+    """
+    logger.debug(f"Read {df.shape[0]} alignments.")
     logger.debug(
-        f"walk_bam return {df.filter(~ pl.col('propers')).shape[0]} "
+        f"Read {df.filter(~ pl.col('propers')).shape[0]} "
         "non-proper alignments."
     )
     logger.debug(
-        f"walk_bam return {df.filter(pl.col('indel_ecnt') > 0).shape[0]} "
+        f"Read {df.filter(pl.col('indel_ecnt') > 0).shape[0]} "
         "alignments with indels."
     )
     logger.debug(
-        f"walk_bam return {df.filter(pl.col('mm_ecnt') > min_ecnt).shape[0]} "
+        f"Read {df.filter(pl.col('mm_ecnt') > min_ecnt).shape[0]} "
         "alignments with mms more than allowed min_ecnt."
     )
+    if counts is not None:
+        proper = df["propers"]
+        no_indel = proper & (df["indel_ecnt"] == 0)
+        good = no_indel & (df["mm_ecnt"] <= min_ecnt)
+        counts["proper"] = int(proper.sum())
+        counts["no_indel"] = int(no_indel.sum())
+        counts["min_ecnt"] = int(good.sum())
     df = df.filter(
         (pl.col("indel_ecnt") == 0)
         & (pl.col("mm_ecnt") <= min_ecnt)  # good aln
@@ -101,25 +108,17 @@ def score_per_allele(
         .drop("n")
     )
     logger.debug(f"{df.shape[0]} alignments left after filtering for paired.")
-    if df.shape[0] == 0:
-        logger.debug("no alignments left for scoring after filtering. Return")
-        return None
-    # we convert dtype of bqs and mds column to get ready for score likelihood
-    df = df.with_columns(
-        pl.col("bqs").map_elements(
-            lambda x: x.tolist(),
-            return_dtype=pl.List(pl.UInt8),
-        ),
-        pl.col("mds").map_elements(
-            lambda x: x, return_dtype=pl.List(pl.String)
-        ),
-    )
+    if counts is not None:
+        counts["paired"] = df.shape[0]
+    return df
+
+
+def score_pairs(
+    alns: Alignments, allele: str, hla_gene: str
+) -> pl.DataFrame:
+    """Score alignments and sum up the scores per aligned pair"""
     # score the likelihood given bqs and mds
-    df = df.with_columns(
-        pl.struct(["bqs", "mds"])
-        .map_elements(score_log_liklihood, return_dtype=pl.Float64)
-        .alias("scores"),
-    )
+    df = alns.table.with_columns(_score(alns))
     # Sum up the score per aligned pair
     df = df.group_by("qnames").agg(pl.col("scores").sum())
     logger.debug(f"After score and sum per pair: {df}")
@@ -127,137 +126,336 @@ def score_per_allele(
     return df
 
 
-def score_a_one(
-    alleles_to_score: list[str],
-    bam: Path,
-    min_ecnt: int,
-    nproc: int = 8,
-    debug: bool = False,
+def score_alignment_rows(
+    alns: Alignments, allele: str, hla_gene: str
 ) -> pl.DataFrame:
-    # gets the file handler
-    log_fspath = None
-    if debug:
-        log_fh = next(
-            iter(
-                [
-                    h
-                    for h in logger.handlers
-                    if isinstance(h, logging.FileHandler)
-                ]
-            )
+    """
+    Score alignments without filtering them
+
+    Columns needed by filter_alignments are kept along with the scores,
+    so that any min_ecnt can be applied afterwards with apply_min_ecnt.
+    """
+    df = alns.table.with_columns(_score(alns))
+    return df.select(
+        "qnames", "scores", "mm_ecnt", "indel_ecnt", "propers"
+    ).with_columns(allele=pl.lit(allele), gene=pl.lit(hla_gene))
+
+
+def apply_min_ecnt(
+    aln_scores: pl.DataFrame | pl.LazyFrame, min_ecnt: int
+) -> pl.LazyFrame:
+    """
+    Filter per-alignment scores by min_ecnt and sum them up per pair
+
+    This gives the same score table as scoring with the given min_ecnt
+    in the first place.
+    """
+    return (
+        aln_scores.lazy()
+        .filter(
+            (pl.col("indel_ecnt") == 0)
+            & (pl.col("mm_ecnt") <= min_ecnt)
+            & (pl.col("propers"))
         )
-        log_fspath = log_fh.baseFilename
-        # set nproc to 1 when in debug mode
-        logger.debug("Debug mode: setting nproc to 1.")
-        nproc = 1
-    try:
-        logger.info("Score first allele.")
-        score_tables: list[pl.DataFrame] = []
-        logger.debug(f"# alleles to score: {len(alleles_to_score)}.")
-        with get_context("spawn").Pool(processes=nproc) as pool:
-            task_iterator = tqdm(
-                pool.imap_unordered(
-                    partial(
-                        score_per_allele,
-                        bam_fspath=bam,
-                        min_ecnt=min_ecnt,
-                        log_fspath=log_fspath,  # pass to child proc
-                    ),
-                    alleles_to_score,
-                ),
-                total=len(alleles_to_score),
-                desc="Score first allele: ",
-                ncols=100,  # define width
+        # pairing is checked after the filters above, as filter_alignments
+        # order is kept so that slices of the result are stable
+        .group_by(["allele", "gene", "qnames"], maintain_order=True)
+        .agg(pl.col("scores").sum(), pl.len().alias("n"))
+        .filter(pl.col("n") == 2)
+        .select("qnames", "scores", "allele", "gene")
+    )
+
+
+def init_worker(
+    log_queue: "Queue[Any]", debug: bool = False, memo_size: int = 0
+) -> None:
+    """Set up logger, score memo, and state once per worker process"""
+    logger.initialize_worker(log_queue, debug)
+    configure_score_memo(memo_size)
+    worker_state()
+
+
+@contextmanager
+def _worker_pool(
+    backend: str, nproc: int, debug: bool, memo_size: int
+) -> Iterator[Pool]:
+    """Pool of worker processes or threads set up to score alleles"""
+    if backend == "thread":
+        # threads log to the handlers of this process, and share its state
+        with (
+            logger.tag_threads(),
+            shared_worker_state(),
+            make_pool(
+                backend, nproc, configure_score_memo, (memo_size,)
+            ) as pool,
+        ):
+            yield pool
+        return
+    with (
+        # workers send their records to be logged by this process
+        logger.listen() as log_queue,
+        make_pool(
+            backend,
+            nproc,
+            initializer=init_worker,
+            initargs=(log_queue, debug, memo_size),  # pass to child proc
+        ) as pool,
+    ):
+        yield pool
+
+
+def score_per_allele(
+    allele: str,
+    bam_fspath: Path,
+    min_ecnt: int,
+    keep_alignments: bool = False,
+    fraction: float = 1.0,
+    counts: Optional[dict[str, int]] = None,
+) -> pl.DataFrame | None:
+    """
+    Score read pairs aligned to an allele
+
+    When counts is given, # of alignments read, and kept by each filter,
+    are added to it.
+    """
+    state = worker_state()
+    hla_gene = state.hla_gene(allele)
+    logger.debug(f"{hla_gene=}")
+
+    alns = read_alignments(state.bam(bam_fspath), allele, fraction=fraction)
+    if counts is not None:
+        counts["read"] = len(alns)
+    if not keep_alignments:
+        alns = alns.with_table(filter_alignments(alns.table, min_ecnt, counts))
+    if len(alns) == 0:
+        logger.debug("no alignments left for scoring after filtering. Return")
+        return None
+    if keep_alignments:
+        return score_alignment_rows(alns, allele, hla_gene)
+    return score_pairs(alns, allele, hla_gene)
+
+
+@dataclass
+class AlleleScores:
+    """
+    Scores of an allele and the time spent computing them
+
+    counts are # of alignments read, and kept by each filter, when counted.
+    """
+
+    allele: str
+    scores: Optional[pl.DataFrame]
+    elapsed: float
+    counts: Optional[dict[str, int]] = None
+
+
+def score_alleles_in_batch(
+    alleles: list[str],
+    bam_fspath: Path,
+    min_ecnt: int,
+    keep_alignments: bool = False,
+    fractions: Optional[Mapping[str, float]] = None,
+    count: bool = False,
+) -> list[AlleleScores]:
+    """
+    Score a batch of alleles one after another with score_per_allele
+
+    fractions of read pairs to score are given per allele, and alleles not
+    in fractions are scored on all read pairs. With count, alignments read
+    and kept by each filter are counted per allele.
+    """
+    fractions = fractions or {}
+    results: list[AlleleScores] = []
+    for allele in alleles:
+        start = time.perf_counter()
+        counts: Optional[dict[str, int]] = {} if count else None
+        with logger.task(allele):
+            res = score_per_allele(
+                allele,
+                bam_fspath=bam_fspath,
+                min_ecnt=min_ecnt,
+                keep_alignments=keep_alignments,
+                fraction=fractions.get(allele, 1.0),
+                counts=counts,
             )
-            for res in task_iterator:
-                if res is None:
-                    continue
-                # display allele being processed
-                task_iterator.set_postfix(
-                    {"allele": f"{res['allele'].unique().item()}"}
-                )
-                score_tables.append(res)
-        if not score_tables:
-            raise ValueError("Failed to score for any first alleles.")
-        scores = pl.concat([s for s in score_tables])
-        logger.info(f"Alleles scored: {len(score_tables)}.")
-    except ValueError as e:
-        logger.error(e)
-        sys.exit(1)
-    return scores
+        results.append(
+            AlleleScores(allele, res, time.perf_counter() - start, counts)
+        )
+    return results
 
 
-def score_second_by_gene(
-    gene: str, a1_scores: pl.DataFrame, a1_winners: pl.DataFrame
-) -> pl.DataFrame:
-    a1_winners = a1_winners.filter(pl.col("gene") == gene)
-    a1_scores = a1_scores.filter(pl.col("gene") == gene)
-    score_table = a1_scores.join(a1_winners, on=["qnames", "gene"], how="left")
-    score_table = score_table.with_columns(
-        pl.col("scores_right").fill_null(0.0)
+def _score_task(
+    task: tuple[int, Path, list[str]],
+    min_ecnt: int,
+    keep_alignments: bool,
+    fractions: Optional[Mapping[str, float]],
+    count: bool,
+) -> tuple[int, list[AlleleScores]]:
+    i, bam, alleles = task
+    return i, score_alleles_in_batch(
+        alleles, bam, min_ecnt, keep_alignments, fractions, count
     )
-    score_table = score_table.with_columns(
-        factor=pl.col("scores") / (pl.col("scores") + pl.col("scores_right"))
+
+
+def _plan_tasks(
+    alleles_to_score: list[str],
+    counts: Mapping[str, int],
+    nproc: int,
+    scan: bool,
+) -> list[list[str]]:
+    logger.debug(f"# alleles to score: {len(alleles_to_score)}.")
+    # alleles without any mapped read have nothing to score
+    alleles = [a for a in alleles_to_score if counts.get(a, 0) > 0]
+    logger.info(
+        f"Skip {len(alleles_to_score) - len(alleles)} alleles "
+        "without mapped reads."
     )
-    score_table = score_table.with_columns(
-        scores=pl.col("scores") * pl.col("factor")
+    if scan:
+        # each worker reads a contiguous block of alleles front to back
+        tasks = balance_blocks(alleles, counts, nproc)
+        logger.debug(f"Scan BAM in {len(tasks)} blocks of alleles.")
+    else:
+        # largest alleles first, small ones batched together
+        tasks = schedule_alleles(alleles, counts, nproc)
+        logger.debug(f"Score alleles in {len(tasks)} tasks.")
+    return tasks
+
+
+def _report_timings(timings: list[AlleleScores], n_slowest: int = 5) -> None:
+    for t in timings:
+        logger.debug(f"Scored allele {t.allele} in {t.elapsed:.3f}s.")
+    slowest = sorted(timings, key=lambda t: t.elapsed, reverse=True)
+    logger.info(
+        "Slowest alleles: "
+        + ", ".join(
+            f"{t.allele} ({t.elapsed:.2f}s)" for t in slowest[:n_slowest]
+        )
+        + "."
     )
-    return score_table
 
 
-def score_a_two(
-    a1_scores: pl.DataFrame,
-    a1_winners: pl.DataFrame,
+def score_a_one_by_sample(
+    samples: Sequence[tuple[Path, list[str]]],
+    min_ecnt: int,
+    nproc: int = 8,
+    debug: bool = False,
+    scan: bool = False,
+    keep_alignments: bool = False,
+    memo_size: int = 0,
+    on_scored: Optional[Callable[[int, AlleleScores], None]] = None,
+    fractions: Optional[Mapping[str, float]] = None,
+    backend: str = "process",
+    read_counts: Optional[Sequence[Mapping[str, int]]] = None,
+) -> Iterator[tuple[int, Optional[pl.DataFrame]]]:
+    """
+    Score first allele of several BAM files on one pool of processes
+
+    samples are pairs of BAM file and alleles to score. Tasks of all samples
+    are queued on the same pool, sample after sample, and the score table of
+    a sample is yielded with its index as soon as all its alleles are
+    scored, or None if no allele is scored.
+
+    When on_scored is given, it is called with the sample index and scores
+    of every allele as they come in, and score tables are left to it: None
+    is yielded instead. With fractions, alleles are only scored on the
+    given fraction of read pairs, sampled by their names. Alleles are
+    scored on worker processes or threads, as given by backend. read_counts
+    are # of mapped reads per allele of each sample, as given by
+    index_read_counts, which is called when they are not given.
+    """
+    tasks: list[tuple[int, Path, list[str]]] = []
+    pending: dict[int, int] = {}
+    for i, (bam, alleles_to_score) in enumerate(samples):
+        logger.info(f"Score first allele from BAM file: {bam}.")
+        counts = (
+            index_read_counts(bam) if read_counts is None else read_counts[i]
+        )
+        sample_tasks = _plan_tasks(alleles_to_score, counts, nproc, scan)
+        tasks.extend((i, bam, t) for t in sample_tasks)
+        pending[i] = len(sample_tasks)
+        if not sample_tasks:
+            yield i, None
+    if not tasks:
+        return
+    # only the parent process reports progress, so workers skip tqdm
+    from tqdm import tqdm
+
+    score_tables: dict[int, list[pl.DataFrame]] = defaultdict(list)
+    timings: dict[int, list[AlleleScores]] = defaultdict(list)
+    start = time.perf_counter()
+    with (
+        _worker_pool(backend, nproc, debug, memo_size) as pool,
+        tqdm(
+            total=sum(len(t) for _, _, t in tasks),
+            desc="Score first allele: ",
+            ncols=100,  # define width
+        ) as pbar,
+    ):
+        for i, results in pool.imap_unordered(
+            partial(
+                _score_task,
+                min_ecnt=min_ecnt,
+                keep_alignments=keep_alignments,
+                fractions=fractions,
+                # workers only count alignments for metrics of the run
+                count=collecting(),
+            ),
+            tasks,
+        ):
+            for res in results:
+                timings[i].append(res)
+                record_allele(res.allele, res.elapsed, res.counts or {})
+                if on_scored is not None:
+                    on_scored(i, res)
+                elif res.scores is not None:
+                    score_tables[i].append(res.scores)
+            # display allele being processed
+            pbar.set_postfix({"allele": results[-1].allele})
+            pbar.update(len(results))
+            pending[i] -= 1
+            if pending[i] > 0:
+                continue
+            tables = score_tables.pop(i, [])
+            n_scored = sum(t.scores is not None for t in timings[i])
+            logger.info(
+                f"Alleles scored for {samples[i][0]}: {n_scored} in "
+                f"{time.perf_counter() - start:.2f}s."
+            )
+            _report_timings(timings.pop(i))
+            yield i, pl.concat(tables) if tables else None
+        # let workers exit on their own to close their BAM files
+        pool.close()
+        pool.join()
+
+
+def score_a_one(
+    alleles_to_score: list[str],
+    bam: Path,
+    min_ecnt: int,
     nproc: int = 8,
+    debug: bool = False,
+    scan: bool = False,
+    keep_alignments: bool = False,
+    memo_size: int = 0,
+    backend: str = "process",
 ) -> pl.DataFrame:
-    logger.info("Score second allele.")
     try:
-        score_tables: list[pl.DataFrame] = []
-        genes = a1_winners["gene"].unique().to_list()
-        nproc = min(nproc, len(genes))
-        with get_context("spawn").Pool(processes=nproc) as pool:
-            gene_iterator = tqdm(
-                pool.imap_unordered(
-                    partial(
-                        score_second_by_gene,
-                        a1_scores=a1_scores,
-                        a1_winners=a1_winners,
-                    ),
-                    genes,
-                ),
-                total=len(genes),
-                desc="Score second allele: ",
-                ncols=100,
+        logger.info("Score first allele.")
+        [(_, scores)] = list(
+            score_a_one_by_sample(
+                [(bam, alleles_to_score)],
+                min_ecnt=min_ecnt,
+                nproc=nproc,
+                debug=debug,
+                scan=scan,
+                keep_alignments=keep_alignments,
+                memo_size=memo_size,
+                backend=backend,
             )
-            for res in gene_iterator:
-                if res is None:
-                    continue
-                score_tables.append(res)
-        if not score_tables:
-            raise ValueError("Failed to score for any second alleles.")
-        a2_scores = pl.concat(score_tables)
-        return a2_scores
+        )
+        if scores is None:
+            raise ValueError("Failed to score for any first alleles.")
     except ValueError as e:
         logger.error(e)
         sys.exit(1)
-
-
-def get_winners(allele_scores: pl.DataFrame) -> pl.DataFrame:
-    # round scores to 4 decimal places to avoid precision
-    # problem when getting alleles whose scores equal to max scores
-    tot_scores = allele_scores.group_by(["allele", "gene"]).agg(
-        pl.col("scores").sum().round(4)
-    )
-    winners = tot_scores.filter(
-        pl.col("scores") == pl.col("scores").max().over("gene")
-    )
-    logger.debug("winner alleles who have the max score per locus.")
-    if winners.shape[0] > 3:
-        logger.debug("there are ties in scores for certain gene groups.")
-    logger.debug(winners)
-    # when there is a tie in scores for each gene group,
-    # select allele with least string value lexicographically
-    # e.g. hla_a_26_01_24 and hla_a_26_01_01 (latter selected)
-    winners = winners.sort(by=["allele"]).unique(subset="gene", keep="first")
-    winners = winners.rename({"scores": "tot_scores"})
-    return winners
+    return scores
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import sys
-import warnings
 from collections.abc import Sequence
 from typing import TYPE_CHECKING
 
@@ -9,7 +8,7 @@ import polars as pl
 import polars.selectors as cs
 from tinyscibio import BAMetadata
 
-from .hla_allele import HLAllelePattern, reduce_resolution
+from .hla_allele import HLAllelePattern, reduce_resolutions
 from .logger import logger
 
 if TYPE_CHECKING:
@@ -73,17 +72,10 @@ def collect_alleles_to_type(
     try:
         ap = HLAllelePattern(resolution=2)
         alleles_df = pl.DataFrame({"Allele": bam_metadata.seqnames()})
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            if kept is not None:
-                alleles_df = alleles_df.with_columns(
-                    pl.col("Allele")
-                    .map_elements(
-                        lambda c: reduce_resolution(c, ap),
-                        return_dtype=pl.String,
-                    )
-                    .alias("D4")
-                ).filter(pl.col("D4").is_in(kept))
+        if kept is not None:
+            alleles_df = alleles_df.filter(
+                reduce_resolutions(alleles_df["Allele"], ap).is_in(kept)
+            )
         alleles = alleles_df["Allele"].to_list()
         if not alleles:
             raise ValueError("Failed to collect any alleles for typing")
@@ -0,0 +1,110 @@
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Optional
+
+import pysam
+
+from .hla_allele import HLAllelePattern, decompose
+from .logger import logger
+
+
+@dataclass
+class WorkerState:
+    """
+    State kept by a process across the tasks it runs
+
+    BAM files are opened on first use, and stay open until the state is
+    closed, which happens when a worker process exits. At most
+    max_open_bams are kept open, closing the least recently used first.
+
+    With threads, the state is shared by worker threads, and each thread
+    keeps BAM files of its own: a thread opens every BAM file, with its
+    header and index, only once, and fetches alignments without moving
+    file positions of other threads.
+    """
+
+    ap: HLAllelePattern = field(default_factory=HLAllelePattern)
+    max_open_bams: int = 16
+    _local: threading.local = field(
+        default_factory=threading.local, repr=False
+    )
+    # BAM files opened by every thread, closed with the state
+    _opened: list[dict[Path, pysam.AlignmentFile]] = field(
+        default_factory=list, repr=False
+    )
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def bams(self) -> dict[Path, pysam.AlignmentFile]:
+        """BAM files opened by the current thread"""
+        bams: Optional[dict[Path, pysam.AlignmentFile]] = getattr(
+            self._local, "bams", None
+        )
+        if bams is None:
+            bams = self._local.bams = {}
+            with self._lock:
+                self._opened.append(bams)
+        return bams
+
+    def bam(self, fspath: Path) -> pysam.AlignmentFile:
+        """Get handle of BAM file, opening it on first use"""
+        bams = self.bams
+        bamf = bams.pop(fspath, None)
+        if bamf is None:
+            if len(bams) >= self.max_open_bams:
+                lru = next(iter(bams))
+                logger.debug(f"Close {lru} in worker.")
+                bams.pop(lru).close()
+            logger.debug(f"Open {fspath} in worker.")
+            bamf = pysam.AlignmentFile(str(fspath), "rb")
+        # dict keeps the most recently used BAM file last
+        bams[fspath] = bamf
+        return bamf
+
+    def hla_gene(self, allele: str) -> str:
+        hla_allele = decompose(allele, self.ap)
+        logger.debug(f"{hla_allele=}")
+        return f"{hla_allele.prefix}{hla_allele.locus}"
+
+    def close(self) -> None:
+        with self._lock:
+            for bams in self._opened:
+                for bamf in bams.values():
+                    bamf.close()
+                bams.clear()
+
+
+_worker_state: Optional[WorkerState] = None
+
+
+def worker_state() -> WorkerState:
+    """Get state of the current process, setting it up on first use"""
+    global _worker_state
+    if _worker_state is None:
+        _worker_state = WorkerState()
+        # run when a pool worker exits after pool.close() and pool.join()
+        Finalize(None, close_worker_state, exitpriority=10)
+    return _worker_state
+
+
+def close_worker_state() -> None:
+    global _worker_state
+    if _worker_state is not None:
+        _worker_state.close()
+        _worker_state = None
+
+
+@contextmanager
+def shared_worker_state() -> Iterator[WorkerState]:
+    """Set up state of this process shared by threads, closed on exit"""
+    global _worker_state
+    close_worker_state()
+    _worker_state = WorkerState()
+    try:
+        yield _worker_state
+    finally:
+        close_worker_state()
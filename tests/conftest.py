@@ -0,0 +1,52 @@
+import pysam
+import pytest
+
+# rid, start, qname, flag, cigar, md
+RECORDS = [
+    (0, 0, "r1", 99, "10M", "10"),
+    (0, 5, "r2", 97, "10M", "3A6"),
+    (0, 20, "r1", 147, "10M", "4^AC6"),
+    (0, 30, "r3", 99 | 1024, "10M", "10"),
+    (1, 0, "r1", 99, "4M1I5M", "9"),
+    (1, 10, "r1", 147, "10M", "0C0T8"),
+]
+CONTIGS = ("hla_a_01_01_01", "hla_a_02_01_01")
+
+
+def write_bam(bam, records=RECORDS, sm="test", contigs=CONTIGS):
+    """Write a tiny coordinate-sorted and indexed BAM"""
+    header = {
+        "HD": {"VN": "1.6", "SO": "coordinate"},
+        "SQ": [{"SN": contig, "LN": 200} for contig in contigs],
+        "RG": [{"ID": sm, "SM": sm}],
+    }
+    with pysam.AlignmentFile(str(bam), "wb", header=header) as out:
+        for rid, start, qname, flag, cigar, md in records:
+            a = pysam.AlignedSegment(out.header)
+            a.query_name = qname
+            a.query_sequence = "A" * 10
+            a.flag = flag
+            a.reference_id = rid
+            a.reference_start = start
+            a.cigarstring = cigar
+            a.query_qualities = pysam.qualitystring_to_array("I" * 10)
+            a.set_tag("MD", md)
+            out.write(a)
+    pysam.index(str(bam))
+    return bam
+
+
+@pytest.fixture(scope="session")
+def bam_fspath(tmp_path_factory):
+    return write_bam(tmp_path_factory.mktemp("bam") / "test.bam")
+
+
+@pytest.fixture(scope="session")
+def freq_fspath(tmp_path_factory):
+    """Population frequencies of the alleles of bam_fspath"""
+    freq = tmp_path_factory.mktemp("freq") / "HLA_FREQ.txt"
+    freq.write_text(
+        "Allele\tCaucasian\tBlack\nhla_a_01_01\t0.5\t0.1\n"
+        "hla_a_02_01\t0.2\t0.0\nhla_b_07_02\t0.1\t0.1\n"
+    )
+    return freq
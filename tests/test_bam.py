@@ -0,0 +1,101 @@
+import polars as pl
+import pysam
+import pytest
+from tinyscibio import parse_md, walk_bam
+
+from mhctyper.bam import (
+    flat_alignments,
+    parse_mds,
+    read_alignments,
+    sampled_qname,
+)
+
+
+def mismatches(md: list[str]) -> tuple[list[int], int]:
+    """Read positions of mismatched bases, and # of bases of MD tokens"""
+    pos, n = [], 0
+    for token in md:
+        if token.isdigit():
+            n += int(token)
+        elif not token.startswith("^"):
+            pos.append(n)
+            n += 1
+    return pos, n
+
+
+@pytest.mark.parametrize("contig", ["hla_a_01_01_01", "hla_a_02_01_01"])
+def test_read_alignments_agree_with_walk_bam(bam_fspath, contig):
+    with pysam.AlignmentFile(str(bam_fspath), "rb") as bamf:
+        alns = read_alignments(bamf, contig)
+    df = alns.table
+    expect = walk_bam(
+        str(bam_fspath),
+        contig,
+        exclude=3584,
+        return_ecnt=True,
+        return_bq=True,
+        return_md=True,
+        return_qname=True,
+    )
+    assert df["qnames"].to_list() == expect["qnames"].to_list()
+    for col in ["propers", "mm_ecnt", "indel_ecnt"]:
+        assert df[col].to_list() == expect[col].to_list()
+    bqs = [
+        alns.bqs[o : o + n].tolist()
+        for o, n in zip(df["bq_offset"], df["bq_len"])
+    ]
+    assert bqs == [x.tolist() for x in expect["bqs"]]
+    mms = [
+        (alns.mm_pos[o : o + n].tolist(), md_len)
+        for o, n, md_len in zip(df["mm_offset"], df["mm_len"], df["md_len"])
+    ]
+    assert mms == [mismatches(list(x)) for x in expect["mds"]]
+
+
+def test_sampled_qname():
+    qnames = [f"SRR702076.{i}" for i in range(10000)]
+    kept = {f: {q for q in qnames if sampled_qname(q, f)} for f in (0.1, 0.5)}
+    assert abs(len(kept[0.1]) - 1000) < 100
+    assert abs(len(kept[0.5]) - 5000) < 250
+    assert kept[0.1] <= kept[0.5]
+    assert all(sampled_qname(q, 1.0) for q in qnames)
+    assert not any(sampled_qname(q, 0.0) for q in qnames)
+
+
+def test_read_alignments_sampled(bam_fspath):
+    with pysam.AlignmentFile(str(bam_fspath), "rb") as bamf:
+        full = read_alignments(bamf, "hla_a_01_01_01").table
+        for fraction in (0.0, 0.5, 1.0):
+            alns = read_alignments(bamf, "hla_a_01_01_01", fraction=fraction)
+            assert alns.table["qnames"].to_list() == [
+                q for q in full["qnames"] if sampled_qname(q, fraction)
+            ]
+
+
+def test_parse_mds():
+    mds = ["100", "10A0^GT5", "0C0T0^A", "3^ACG0T12G", "7A"]
+    mm_pos, mm_lens, md_lens = parse_mds(pl.Series(mds + [None]))
+    expect = [mismatches(parse_md(md)) for md in mds] + [([], 0)]
+    assert mm_pos.tolist() == [p for pos, _ in expect for p in pos]
+    assert mm_lens.tolist() == [len(pos) for pos, _ in expect]
+    assert md_lens.tolist() == [n for _, n in expect]
+    for md in ["10AA90", "A10", ""]:
+        with pytest.raises(ValueError, match="Invalid MD"):
+            parse_mds(pl.Series([md]))
+
+
+def test_flat_alignments():
+    bqs = [bytes([30, 31, 32]), b"", bytes([5, 6])]
+    mds = pl.Series(["1A1", None, "0T1"])
+    alns = flat_alignments(bqs, mds, pl.DataFrame({"qnames": ["a", "b", "c"]}))
+    assert alns.bqs.tolist() == [30, 31, 32, 5, 6]
+    assert alns.mm_pos.tolist() == [1, 0]
+    assert alns.table.to_dicts()[2] == {
+        "qnames": "c",
+        "bq_offset": 3,
+        "bq_len": 2,
+        "mm_offset": 1,
+        "mm_len": 1,
+        "md_len": 2,
+    }
+    assert len(alns.with_table(alns.table[1:])) == 2
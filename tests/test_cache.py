@@ -0,0 +1,107 @@
+import polars as pl
+import pytest
+
+from mhctyper.cache import (
+    FragmentStore,
+    ScoreCache,
+    make_shard_manifest,
+    merge_shard_manifests,
+)
+
+
+@pytest.fixture
+def scores():
+    return pl.DataFrame(
+        {
+            "qnames": ["r1", "r2"],
+            "scores": [4500.0, 4400.5],
+            "allele": ["hla_a_01_01_01", "hla_a_01_01_01"],
+            "gene": ["hla_a", "hla_a"],
+        }
+    )
+
+
+@pytest.fixture
+def manifest():
+    return {
+        "mhctyper_version": "0.0.0",
+        "bam": {"size": 1, "mtime_ns": 1, "header_digest": "x"},
+        "min_ecnt": 999,
+        "n_alleles": 1,
+        "alleles_digest": "y",
+    }
+
+
+def test_score_cache_roundtrip(tmp_path, scores, manifest):
+    cache = ScoreCache(tmp_path / "test.a1.parquet")
+    assert cache.manifest_fspath == tmp_path / "test.a1.manifest.json"
+    assert not cache.is_valid(manifest)
+    cache.write(scores, manifest)
+    assert cache.is_valid(manifest)
+    assert cache.scan().collect().equals(scores)
+    cache.write(scores.lazy(), manifest)
+    assert cache.scan().collect().equals(scores)
+
+
+@pytest.mark.parametrize(
+    "key, value",
+    [
+        ("min_ecnt", 1),
+        ("alleles_digest", "z"),
+        ("mhctyper_version", "0.0.1"),
+        ("bam", {"size": 2, "mtime_ns": 1, "header_digest": "x"}),
+    ],
+)
+def test_score_cache_invalidated(tmp_path, scores, manifest, key, value):
+    cache = ScoreCache(tmp_path / "test.a1.parquet")
+    cache.write(scores, manifest)
+    assert not cache.is_valid({**manifest, key: value})
+
+
+def test_score_cache_without_manifest_is_invalid(tmp_path, scores, manifest):
+    cache = ScoreCache(tmp_path / "test.a1.parquet")
+    cache.write(scores, manifest)
+    cache.manifest_fspath.unlink()
+    assert not cache.is_valid(manifest)
+    cache.clear()
+    assert not cache.fspath.exists()
+
+
+def test_merge_shard_manifests(manifest):
+    manifest = {**manifest, "n_alleles": 3}
+    shards = [
+        make_shard_manifest(manifest, (1, 2), ["a", "c"]),
+        make_shard_manifest(manifest, (2, 2), ["b"]),
+    ]
+    assert merge_shard_manifests(shards) == manifest
+    with pytest.raises(ValueError, match="missing shards: \\[2\\]"):
+        merge_shard_manifests(shards[:1])
+    with pytest.raises(ValueError, match="min_ecnt"):
+        merge_shard_manifests([shards[0], {**shards[1], "min_ecnt": 1}])
+    with pytest.raises(ValueError, match="distinct alleles"):
+        merge_shard_manifests(
+            [shards[0], make_shard_manifest(manifest, (2, 2), ["a"])]
+        )
+    with pytest.raises(ValueError, match="no shards"):
+        merge_shard_manifests([])
+
+
+def test_fragment_store_resume(tmp_path, scores, manifest):
+    store = ScoreCache(tmp_path / "test.a1.parquet").fragments()
+    assert store.dirpath == tmp_path / "test.a1.parts"
+    assert store.open(manifest) == set()
+    store.add("hla_a_01_01_01", scores)
+    store.add("hla_a_02_01_01", None)
+    # a line partially written when interrupted
+    with store.log_fspath.open("a") as fh:
+        fh.write('{"allele": "hla_a_03')
+    # a new store, as opened by the resumed run
+    store = FragmentStore(store.dirpath)
+    assert store.open(manifest) == {"hla_a_01_01_01", "hla_a_02_01_01"}
+    got = store.scan(["hla_a_02_01_01", "hla_a_01_01_01"])
+    assert got is not None and got.collect().equals(scores)
+    assert store.scan(["hla_a_02_01_01"]) is None
+    # checkpoints of a different manifest are discarded
+    assert store.open({**manifest, "min_ecnt": 1}) == set()
+    store.clear()
+    assert not store.dirpath.exists()
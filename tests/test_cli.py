@@ -0,0 +1,105 @@
+import argparse
+import subprocess
+import sys
+
+import pytest
+
+import mhctyper
+from mhctyper.cli import (
+    mhctyper_main,
+    parse_cmd,
+    parse_fraction,
+    parse_positive_int,
+)
+
+
+def test_import_is_lazy():
+    # a fresh process, as tests import polars themselves
+    code = (
+        "import sys, mhctyper; "
+        "print(*sorted("
+        "{'polars', 'pysam', 'tinyscibio'} & set(sys.modules)))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )
+    assert out.stdout.strip() == ""
+    assert callable(mhctyper.run_mhctyper)
+
+
+def test_version():
+    out = subprocess.run(
+        [sys.executable, "-m", "mhctyper", "--version"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert out.stdout.strip() == f"mhctyper {mhctyper.__version__}"
+
+
+def test_parse_positive_int():
+    assert parse_positive_int("3") == 3
+    for value in ["0", "-2", "1.5"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_positive_int(value)
+
+
+def test_parse_fraction():
+    assert parse_fraction("1") == 1.0
+    assert parse_fraction("0.25") == 0.25
+    for value in ["0", "1.5", "-0.1", "nan", "half"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_fraction(value)
+
+
+def test_commands():
+    parser = parse_cmd()
+    assert "{batch,merge}" in parser.format_help()
+
+    args = parser.parse_args(["merge", "--bam", "x.bam", "--outdir", "out"])
+    assert args.command == "merge"
+    assert args.bam.name == "x.bam"
+    assert parser.parse_args(["--min_ecnt", "5"]).command is None
+    args = parser.parse_args(
+        ["--min_ecnt", "1", "batch", "--manifest", "m", "--freq", "f"]
+    )
+    assert args.command == "batch" and args.min_ecnt == [1]
+    args = parser.parse_args(["batch", "--manifest", "m", "--freq", "f"])
+    assert args.min_ecnt is None
+    with pytest.raises(SystemExit):
+        parser.parse_args(["merge", "--bam", "x.bam"])
+    with pytest.raises(SystemExit):
+        parser.parse_args(["bach"])
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["--chunk_size", "0"],
+        ["--chunk_size", "-5"],
+        ["--prescreen", "0"],
+        ["merge", "--bam", "x.bam", "--outdir", "out", "--chunk_size", "0"],
+    ],
+)
+def test_rejects_non_positive_ints(argv):
+    with pytest.raises(SystemExit):
+        parse_cmd().parse_args(argv)
+
+
+@pytest.mark.parametrize("flag", [["--metrics"], ["--prescreen", "3"]])
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["--shard", "1/2"],
+        ["--min_ecnt", "1", "--min_ecnt", "2"],
+        ["batch", "--manifest", "m.tsv", "--freq", "f.txt"],
+        ["merge", "--bam", "x.bam", "--outdir", "out"],
+    ],
+)
+def test_single_only_flags(monkeypatch, capsys, flag, argv):
+    args = ["--bam", "x.bam", "--freq", "f.txt", "--outdir", "out"]
+    monkeypatch.setattr(sys, "argv", ["mhctyper", *args, *flag, *argv])
+    with pytest.raises(SystemExit) as e:
+        mhctyper_main()
+    assert e.value.code == 2
+    assert f"{flag[0]} take a single --min_ecnt" in capsys.readouterr().err
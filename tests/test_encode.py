@@ -0,0 +1,28 @@
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from mhctyper.encode import ScoreEncoding
+
+
+def test_encode():
+    scores = pl.DataFrame(
+        {
+            "qnames": ["r1", "r2", "r1"],
+            "scores": [1.0, 2.0, 3.0],
+            "allele": ["hla_b_07_02", "hla_a_02_01", "hla_a_01_01"],
+            "gene": ["hla_b", "hla_a", "hla_a"],
+        }
+    )
+    encoding = ScoreEncoding.from_scores(scores.lazy(), chunk_size=2)
+    assert encoding.allele_dtype.categories.to_list() == sorted(
+        scores["allele"]
+    )
+    encoded = encoding.encode(scores.lazy()).collect()
+    assert encoded["allele"].dtype == encoding.allele_dtype
+    assert encoded["qid"][0] == encoded["qid"][2] != encoded["qid"][1]
+    # enums sort the same as strings
+    assert encoded.sort("allele")["scores"].to_list() == [3.0, 2.0, 1.0]
+    decoded = encoded.drop("qid").with_columns(
+        pl.col("allele", "gene").cast(pl.String)
+    )
+    assert_frame_equal(decoded, scores)
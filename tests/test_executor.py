@@ -0,0 +1,14 @@
+import pytest
+
+from mhctyper.executor import BACKENDS, make_pool
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_make_pool(backend):
+    with make_pool(backend, 2) as pool:
+        assert pool.map(abs, [-1, 2, -3]) == [1, 2, 3]
+
+
+def test_make_pool_unknown_backend():
+    with pytest.raises(ValueError, match="backend"):
+        make_pool("fork", 2)
@@ -4,7 +4,9 @@ from mhctyper.hla_allele import (
     HLAllele,
     HLAllelePattern,
     decompose,
+    decompose_alleles,
     reduce_resolution,
+    reduce_resolutions,
 )
 
 
@@ -214,3 +216,39 @@ def test_hlallele_str():
         )
         == "hla_DRB1_01_01_01:02n"
     )
+
+
+_ALLELES = [
+    "A*01:01:01",
+    "HLA-c*01:03",
+    "HLA-B*04:16N",
+    "hla-c*02:376n",
+    "hla_c_07",
+    "hla_dqb1_01_01_01",
+    "hla_drb1*11_01_01:347N",
+]
+
+
+@pytest.mark.parametrize("nth_field", [1, 2, 3, 4])
+def test_reduce_resolutions(nth_field, recwarn):
+    ap = HLAllelePattern(resolution=nth_field)
+    reduced = reduce_resolutions(_ALLELES, ap)
+    assert len(recwarn) == 0
+    with pytest.warns(RuntimeWarning):
+        assert reduced.to_list() == [
+            reduce_resolution(a, ap) for a in _ALLELES
+        ]
+    with pytest.raises(ValueError):
+        reduce_resolutions(["QQQ", *_ALLELES], ap)
+
+
+def test_decompose_alleles(hla_allele_default_pattern):
+    ap = hla_allele_default_pattern
+    df = decompose_alleles(_ALLELES, ap)
+    assert [
+        HLAllele(prefix, locus, digit_field, sep)
+        for _, prefix, locus, digit_field, sep in df.iter_rows()
+    ] == [decompose(a, ap) for a in _ALLELES]
+    for bad in ("QQQ*01:01:01", "hla_drq1_01_01_01", "hla_a"):
+        with pytest.raises(ValueError):
+            decompose_alleles([*_ALLELES, bad], ap)
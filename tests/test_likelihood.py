@@ -0,0 +1,168 @@
+import math
+import random
+
+import numpy as np
+import polars as pl
+import pytest
+
+from mhctyper.bam import flat_alignments
+from mhctyper.likelihood import (
+    MATCH_LOG_PROBS,
+    MISMATCH_LOG_PROBS,
+    Alignments,
+    ScoreMemo,
+    alignment_signatures,
+    score_alignments,
+)
+
+
+def md_string(md: list[str]) -> str:
+    """MD string of MD tokens, adding up matched bases of adjacent tokens"""
+    out: list[str] = []
+    for token in md:
+        if token.isdigit() and out and out[-1].isdigit():
+            token = str(int(out.pop()) + int(token))
+        out.append(token)
+    return "".join(out)
+
+
+def alignments(bqs: list[list[int]], mds: list[list[str]]) -> Alignments:
+    """Alignments of base qualities and MD tokens"""
+    return flat_alignments(
+        [bytes(bq) for bq in bqs],
+        pl.Series([md_string(md) for md in mds], dtype=pl.String),
+    )
+
+
+def gather(alns: Alignments, rows: list[int]) -> Alignments:
+    return alns.with_table(alns.table[rows])
+
+
+def per_read_score(
+    base_qs: list[int], md: list[str], scale: float = math.exp(23)
+) -> float:
+    """Per-read scoring the table-driven engine replaces"""
+    score = 0.0
+    start, end = 0, 0
+    for i in range(len(md)):
+        if md[i].startswith("^"):
+            continue
+        if md[i].isalpha():
+            end = start + len(md[i])
+            block = np.array([10 ** (-k / 10) / 3 for k in base_qs[start:end]])
+        else:
+            end = start + int(md[i])
+            block = np.array([1 - 10 ** (-k / 10) for k in base_qs[start:end]])
+        score += np.sum(np.log(np.multiply(block, scale)))
+        start = end
+    return float(score)
+
+
+def random_md(rng: random.Random, length: int) -> list[str]:
+    md: list[str] = []
+    left = length
+    while left > 0:
+        run = rng.randint(0, min(left, 30))
+        md.append(str(run))
+        left -= run
+        if left > 0:
+            md.append(rng.choice("ACGT"))
+            left -= 1
+        if rng.random() < 0.05:
+            md.append(str(0))
+            md.append("^" + "".join(rng.choices("ACGT", k=2)))
+    if md[-1].isalpha() or md[-1].startswith("^"):
+        md.append("0")
+    return md
+
+
+def test_log_prob_tables():
+    for k in (1, 2, 10, 30, 40, 60, 93, 255):
+        assert MATCH_LOG_PROBS[k] == np.log(
+            np.multiply(1 - 10 ** (-k / 10), math.exp(23))
+        )
+        assert MISMATCH_LOG_PROBS[k] == np.log(
+            np.multiply(10 ** (-k / 10) / 3, math.exp(23))
+        )
+    assert MATCH_LOG_PROBS[0] == -np.inf
+
+
+def test_score_alignments_match_per_read_scores():
+    rng = random.Random(23)
+    bqs, mds = [], []
+    for _ in range(500):
+        length = rng.randint(30, 150)
+        bqs.append([rng.randint(1, 60) for _ in range(length)])
+        # shorter MD mimics soft-clipped bases at the end of reads
+        mds.append(random_md(rng, length - rng.choice([0, 0, 5])))
+    scores = score_alignments(alignments(bqs, mds))
+    expect = [per_read_score(bq, md) for bq, md in zip(bqs, mds)]
+    assert scores.name == "scores"
+    assert np.allclose(scores.to_numpy(), expect, rtol=0, atol=1e-9)
+
+
+def test_score_alignments_md_longer_than_bqs():
+    scores = score_alignments(alignments([[30, 30], []], [["5"], ["3"]]))
+    assert scores.to_list() == [2 * MATCH_LOG_PROBS[30], 0.0]
+
+
+def test_score_alignments_empty_and_mismatched_inputs():
+    assert score_alignments(alignments([], [])).len() == 0
+    with pytest.raises(ValueError):
+        flat_alignments([bytes([30])], pl.Series([], dtype=pl.String))
+
+
+@pytest.fixture
+def random_alignments():
+    rng = random.Random(11)
+    bqs = [[rng.randint(2, 40) for _ in range(50)] for _ in range(100)]
+    mds = [rng.choice([["50"], ["20", "A", "29"]]) for _ in range(100)]
+    return alignments(bqs, mds)
+
+
+def test_alignment_signatures():
+    alns = alignments(
+        [[30, 20], [30, 20], [20, 30], [30, 20], [30, 20]],
+        [["2"], ["2"], ["2"], ["1", "A", "0"], ["1", "C", "0"]],
+    )
+    bq_keys, md_keys = alignment_signatures(alns)
+    assert bq_keys[0] == bq_keys[1] == bq_keys[3]
+    assert bq_keys[0] != bq_keys[2]
+    assert md_keys[0] == md_keys[1] == md_keys[2]
+    assert md_keys[0] != md_keys[3]
+    # mismatched bases score the same whatever the reference base
+    assert md_keys[3] == md_keys[4]
+
+
+def test_score_memo(random_alignments):
+    alns = random_alignments
+    expect = score_alignments(alns).to_numpy()
+    memo = ScoreMemo(max_size=1000)
+    assert np.array_equal(memo.score(alns).to_numpy(), expect)
+    assert (memo.hits, memo.misses, len(memo)) == (0, 100, 100)
+    # every alignment is memoized, in any order
+    got = memo.score(gather(alns, list(reversed(range(100)))))
+    assert np.array_equal(got.to_numpy(), expect[::-1])
+    assert (memo.hits, memo.misses) == (100, 100)
+
+
+def test_score_memo_bounded(random_alignments):
+    alns = random_alignments
+    memo = ScoreMemo(max_size=40)
+    for i in range(0, 100, 20):
+        memo.score(gather(alns, list(range(i, i + 20))))
+        assert len(memo) <= 40
+    # most recently scored alignments are kept
+    memo.score(gather(alns, list(range(80, 100))))
+    assert memo.hits == 20
+    with pytest.raises(ValueError):
+        ScoreMemo(max_size=0)
+
+
+def test_score_memo_keeps_mds_of_a_read():
+    # the same read aligned with 2 MDs to alternating alleles
+    alns = alignments([list(range(2, 22))] * 6, [["20"], ["3", "A", "16"]] * 3)
+    memo = ScoreMemo(max_size=1000)
+    for i in range(3):
+        memo.score(gather(alns, [2 * i, 2 * i + 1]))
+    assert (memo.hits, memo.misses, len(memo)) == (4, 2, 2)
@@ -0,0 +1,45 @@
+import logging
+import threading
+
+from mhctyper.logger import Logger
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_worker_records_are_listened():
+    parent, worker = Logger("parent"), Logger("worker")
+    records = _Records()
+    parent.addHandler(records)
+    with parent.listen() as queue:
+        worker.initialize_worker(queue, debug=True)
+        with worker.task("hla_a_01_01_01"):
+            worker.debug("scored")
+        worker.info("done")
+    assert records.messages == [
+        "[MainProcess hla_a_01_01_01] scored",
+        "[MainProcess] done",
+    ]
+
+
+def test_worker_thread_records_are_tagged():
+    log = Logger("threads")
+    records = _Records()
+    log.addHandler(records)
+
+    def work():
+        with log.task("hla_a_01_01_01"):
+            log.info("scored")
+
+    with log.tag_threads():
+        thread = threading.Thread(target=work, name="worker-1")
+        thread.start()
+        thread.join()
+        log.info("done")
+    assert records.messages == ["[worker-1 hla_a_01_01_01] scored", "done"]
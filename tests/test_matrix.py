@@ -0,0 +1,190 @@
+import random
+
+import numpy as np
+import polars as pl
+import pytest
+
+from mhctyper.encode import ScoreEncoding
+from mhctyper.matrix import gene_matrices, pick_allele
+
+
+def _get_winners(a1_scores: pl.DataFrame) -> pl.DataFrame:
+    """Reference of first-allele typing by joins: max total, least name"""
+    tot_scores = a1_scores.group_by("allele", "gene").agg(
+        pl.col("scores").sum().round(4).alias("tot_scores")
+    )
+    return (
+        tot_scores.filter(
+            pl.col("tot_scores") == pl.col("tot_scores").max().over("gene")
+        )
+        .sort("allele")
+        .unique(subset="gene", keep="first")
+    )
+
+
+def _score_a_two(
+    a1_scores: pl.DataFrame, winner_scores: pl.DataFrame
+) -> pl.DataFrame:
+    """Reference of second-allele scores by a join on read and gene"""
+    genes = winner_scores.select(pl.col("gene").unique())
+    return (
+        a1_scores.join(genes, on="gene", how="semi")
+        .join(winner_scores, on=["qnames", "gene"], how="left")
+        .with_columns(pl.col("scores_right").fill_null(0.0))
+        .with_columns(
+            factor=pl.col("scores")
+            / (pl.col("scores") + pl.col("scores_right"))
+        )
+        .with_columns(scores=pl.col("scores") * pl.col("factor"))
+    )
+
+
+@pytest.fixture(scope="module")
+def a1_scores():
+    """First-allele scores of reads aligned to random alleles of 2 genes"""
+    rng = random.Random(5)
+    rows = []
+    for gene in ("hla_a", "hla_b"):
+        alleles = [f"{gene}_{i:02d}" for i in range(8)]
+        for i in range(60):
+            for allele in rng.sample(alleles, rng.randint(1, 8)):
+                rows.append((f"{gene}.r{i}", rng.uniform(90, 100), allele))
+    return pl.DataFrame(
+        rows, schema=["qnames", "scores", "allele"], orient="row"
+    ).with_columns(gene=pl.col("allele").str.head(5))
+
+
+@pytest.fixture(scope="module")
+def matrices(a1_scores):
+    lf = a1_scores.lazy()
+    return list(gene_matrices(lf, ScoreEncoding.from_scores(lf)))
+
+
+def test_gene_matrices(a1_scores, matrices):
+    assert [m.gene for m in matrices] == ["hla_a", "hla_b"]
+    for m in matrices:
+        rows = a1_scores.filter(pl.col("gene") == m.gene)
+        assert m.shape == (rows["qnames"].n_unique(), 8)
+        assert m.alleles.to_list() == sorted(rows["allele"].unique())
+        got = pl.DataFrame(
+            {
+                "qnames": m.reads.gather(m.rows),
+                "allele": m.alleles.gather(m.indices),
+                "scores": m.data,
+            }
+        )
+        assert got.sort("qnames", "allele").equals(
+            rows.select(got.columns).sort("qnames", "allele")
+        )
+
+
+def test_gene_matrices_in_chunks(a1_scores, matrices):
+    lf = a1_scores.lazy()
+    encoding = ScoreEncoding.from_scores(lf)
+    chunked = list(gene_matrices(lf, encoding, chunk_size=70))
+    assert len(chunked) == len(matrices)
+    for m, expect in zip(chunked, matrices):
+        assert m.reads.equals(expect.reads)
+        assert m.alleles.equals(expect.alleles)
+        assert np.array_equal(m.indptr, expect.indptr)
+        assert np.allclose(m.totals(), expect.totals())
+        assert np.allclose(m.pair_scores(), expect.pair_scores())
+
+
+def test_matrix_typing_matches_joins(a1_scores, matrices):
+    a1_winners = _get_winners(a1_scores)
+    winner_scores = a1_scores.join(a1_winners, on=["gene", "allele"]).select(
+        "qnames", "gene", "scores", "allele", "tot_scores"
+    )
+    a2_scores = _score_a_two(a1_scores, winner_scores).sort("qnames", "allele")
+    for m in matrices:
+        a1, a1_tot = pick_allele(m.totals())
+        expect = a1_winners.filter(pl.col("gene") == m.gene)
+        assert (m.alleles[a1], a1_tot) == (
+            expect["allele"].item(),
+            expect["tot_scores"].item(),
+        )
+        second = m.condition_on(a1)
+        got = pl.concat(second.frames(a1_tot, chunk_size=50))
+        assert got.columns == a2_scores.columns
+        expect_a2 = a2_scores.filter(pl.col("gene") == m.gene)
+        got = got.sort("qnames", "allele")
+        for c in ("qnames", "allele", "allele_right", "tot_scores"):
+            assert got[c].equals(expect_a2[c])
+        assert np.allclose(got["scores"], expect_a2["scores"])
+        totals = dict(zip(m.alleles, second.totals()))
+        expect_totals = expect_a2.group_by("allele").agg(
+            pl.col("scores").sum()
+        )
+        for allele, tot in expect_totals.iter_rows():
+            assert totals[allele] == pytest.approx(tot)
+
+
+def test_pair_scores(matrices):
+    m = matrices[0]
+    pairs = m.pair_scores()
+    totals = m.totals()
+    for a in (0, 3):
+        second = m.condition_on(a).totals()
+        assert np.allclose(pairs[a], totals[a] + second)
+    # an allele paired with itself halves its second score
+    assert np.allclose(np.diag(pairs), 1.5 * totals)
+
+
+def test_pick_allele_ties():
+    assert pick_allele(np.array([1.0, 3.00001, 3.0, 2.0])) == (1, 3.0)
+
+
+def _best_pairs(pairs: np.ndarray, n: int) -> list[tuple[int, int]]:
+    a, b = np.triu_indices(pairs.shape[0])
+    best = np.argsort(-pairs[a, b], kind="stable")[:n]
+    return [(int(a[k]), int(b[k])) for k in best]
+
+
+@pytest.mark.parametrize("n", [1, 3, 10])
+def test_top_pairs_match_exhaustive_search(matrices, n):
+    for m in matrices:
+        pairs = m.pair_scores()
+        assert np.all(m.pair_bounds() >= pairs.max(axis=1) - 1e-9)
+        got, n_visited = m.top_pairs(n)
+        assert [(a, b) for a, b, _ in got] == _best_pairs(pairs, n)
+        best_a, best_b, _ = zip(*got)
+        assert np.allclose([s for _, _, s in got], pairs[best_a, best_b])
+        assert 1 <= n_visited <= m.shape[1]
+
+
+def test_top_pairs_prune_weak_alleles():
+    rng = random.Random(3)
+    rows = []
+    for i in range(200):
+        for j in range(30):
+            # reads mostly support the first 2 alleles
+            if j < 2 or rng.random() < 0.2:
+                score = rng.uniform(90, 100) - (0 if j < 2 else 20)
+                rows.append((f"r{i}", score, f"hla_a_{j:02d}", "hla_a"))
+    lf = pl.DataFrame(
+        rows, schema=["qnames", "scores", "allele", "gene"], orient="row"
+    ).lazy()
+    [m] = gene_matrices(lf, ScoreEncoding.from_scores(lf))
+    got, n_visited = m.top_pairs(2)
+    assert [(a, b) for a, b, _ in got] == _best_pairs(m.pair_scores(), 2)
+    assert n_visited < m.shape[1]
+
+
+def test_top_pairs_ties():
+    # alleles 1 and 3 are the same as 0 and 2, so all pairs of
+    # {0, 1} x {2, 3} tie, and so do pairs within either of them
+    rows = []
+    for i in range(20):
+        for j, score in enumerate([99.0, 99.0, 95.0, 95.0]):
+            rows.append((f"r{i}", score - (i % 3), f"hla_a_{j}", "hla_a"))
+    lf = pl.DataFrame(
+        rows, schema=["qnames", "scores", "allele", "gene"], orient="row"
+    ).lazy()
+    [m] = gene_matrices(lf, ScoreEncoding.from_scores(lf))
+    pairs = m.pair_scores()
+    for n in range(1, 5):
+        got, _ = m.top_pairs(n)
+        assert [(a, b) for a, b, _ in got] == _best_pairs(pairs, n)
+    got, _ = m.top_pairs(2)
+    assert [(a, b) for a, b, _ in got] == [(0, 0), (0, 1)]
@@ -0,0 +1,32 @@
+import json
+
+from mhctyper.metrics import (
+    collect_metrics,
+    collecting,
+    record_allele,
+    stage,
+)
+
+
+def test_metrics_off_by_default():
+    with collect_metrics(False) as metrics, stage("score_a1"):
+        record_allele("hla_a_01_01_01", 0.1, {"read": 10})
+        assert not collecting()
+    assert metrics is None
+
+
+def test_collect_metrics(tmp_path):
+    with collect_metrics() as metrics:
+        assert collecting()
+        with stage("score_a1"):
+            with stage("type"):
+                record_allele("hla_a_01_01_01", 0.1, {"read": 10})
+    record_allele("hla_a_02_01_01", 0.1, {"read": 10})
+    assert metrics is not None
+    assert [s["stage"] for s in metrics.stages] == ["type", "score_a1"]
+    assert metrics.alleles == [
+        {"allele": "hla_a_01_01_01", "elapsed_s": 0.1, "read": 10}
+    ]
+    metrics.write(tmp_path / "metrics.json")
+    report = json.loads((tmp_path / "metrics.json").read_text())
+    assert set(report) == {"stages", "alleles", "genes"}
@@ -0,0 +1,213 @@
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from mhctyper import mhctyper, score_alleles
+from mhctyper.mhctyper import (
+    _load_kept_alleles,
+    _prepare_sample,
+    merge_shards,
+    read_batch_manifest,
+    run_mhctyper,
+    run_mhctyper_batch,
+    run_mhctyper_shard,
+    type_alleles,
+)
+from mhctyper.score_alleles import score_a_one
+
+from .conftest import CONTIGS, RECORDS, write_bam
+
+MIN_ECNT = 999
+
+
+def outputs(outdir, sm="test"):
+    """Scores of first and second alleles, and typing results of a run"""
+    a1 = pl.read_parquet(outdir / f"{sm}.a1.parquet")
+    return (
+        a1.sort(a1.columns).rows(),
+        (outdir / f"{sm}.a2.tsv").read_text(),
+        (outdir / f"{sm}.hlatyping.res.tsv").read_text(),
+    )
+
+
+@pytest.fixture(scope="module")
+def single_run(bam_fspath, freq_fspath, tmp_path_factory):
+    """Output folder of an uninterrupted run"""
+    outdir = tmp_path_factory.mktemp("single")
+    run_mhctyper(
+        bam_fspath, freq_fspath, outdir, MIN_ECNT, 1, backend="thread"
+    )
+    return outdir
+
+
+def score_shards(bam, freq, outdir, shards):
+    for shard in shards:
+        run_mhctyper_shard(
+            bam, freq, outdir, MIN_ECNT, shard, 1, backend="thread"
+        )
+
+
+def test_read_batch_manifest(tmp_path):
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text("bam\toutdir\na.bam\tout/a\nb.bam\tout/b\n")
+    assert read_batch_manifest(manifest) == [
+        (Path("a.bam"), Path("out/a")),
+        (Path("b.bam"), Path("out/b")),
+    ]
+
+
+def test_read_batch_manifest_missing_columns(tmp_path):
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text("bam\na.bam\n")
+    with pytest.raises(SystemExit):
+        read_batch_manifest(manifest)
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_merge_shards(bam_fspath, freq_fspath, single_run, tmp_path, n):
+    score_shards(
+        bam_fspath, freq_fspath, tmp_path, [(i, n) for i in range(1, n + 1)]
+    )
+    merge_shards(bam_fspath, tmp_path, backend="thread")
+    assert outputs(tmp_path) == outputs(single_run)
+
+
+@pytest.mark.parametrize(
+    "shards",
+    [[], [(1, 2)], [(1, 2), (1, 3), (2, 3)], [(1, 2), (2, 2), (3, 3)]],
+)
+def test_merge_shards_mismatched(bam_fspath, freq_fspath, tmp_path, shards):
+    score_shards(bam_fspath, freq_fspath, tmp_path, shards)
+    with pytest.raises(SystemExit):
+        merge_shards(bam_fspath, tmp_path, backend="thread")
+    assert not (tmp_path / "test.a1.parquet").exists()
+
+
+def test_resume(bam_fspath, freq_fspath, single_run, tmp_path, monkeypatch):
+    sample = _prepare_sample(
+        bam_fspath,
+        tmp_path,
+        kept=_load_kept_alleles(freq_fspath),
+        min_ecnt=MIN_ECNT,
+        keep_alignments=False,
+        overwrite=False,
+    )
+    checkpointed = "hla_a_01_01_01"
+    assert set(sample.alleles_to_type) > {checkpointed}
+    # fragments left by a run interrupted after scoring one allele
+    store = sample.a1_cache.fragments()
+    store.open(sample.a1_manifest)
+    store.add(
+        checkpointed,
+        pl.read_parquet(single_run / "test.a1.parquet").filter(
+            pl.col("allele") == checkpointed
+        ),
+    )
+
+    scored = []
+    score_per_allele = score_alleles.score_per_allele
+
+    def _score_per_allele(allele, *args, **kwargs):
+        scored.append(allele)
+        return score_per_allele(allele, *args, **kwargs)
+
+    monkeypatch.setattr(score_alleles, "score_per_allele", _score_per_allele)
+    run_mhctyper(
+        bam_fspath, freq_fspath, tmp_path, MIN_ECNT, 1, backend="thread"
+    )
+    assert sorted(scored) == sorted(
+        set(sample.alleles_to_type) - {checkpointed}
+    )
+    assert outputs(tmp_path) == outputs(single_run)
+    assert not store.completed()
+
+
+def test_batch(freq_fspath, tmp_path, monkeypatch):
+    bams = {
+        "s1": write_bam(tmp_path / "s1.bam", sm="s1"),
+        "s2": write_bam(
+            tmp_path / "s2.bam",
+            [(0, 0, "r1", 99, "10M", "5A4")] + RECORDS[1:],
+            sm="s2",
+        ),
+        # a single unpaired read leaves nothing to score
+        "s3": write_bam(tmp_path / "s3.bam", RECORDS[1:2], sm="s3"),
+    }
+    for sm, bam in bams.items():
+        if sm != "s3":
+            outdir = tmp_path / "single" / sm
+            run_mhctyper(
+                bam, freq_fspath, outdir, MIN_ECNT, 1, backend="thread"
+            )
+
+    pools = []
+    make_pool = score_alleles.make_pool
+
+    def _make_pool(*args, **kwargs):
+        pools.append(args)
+        return make_pool(*args, **kwargs)
+
+    monkeypatch.setattr(score_alleles, "make_pool", _make_pool)
+    results = run_mhctyper_batch(
+        [(bam, tmp_path / "batch" / sm) for sm, bam in bams.items()],
+        freq_fspath,
+        tmp_path / "logs",
+        MIN_ECNT,
+        2,
+        backend="thread",
+    )
+    assert len(pools) == 1
+    assert [hla_res for _, hla_res in results] == [
+        tmp_path / "batch" / sm / f"{sm}.hlatyping.res.tsv"
+        for sm in ("s1", "s2")
+    ]
+    for sm in ("s1", "s2"):
+        assert outputs(tmp_path / "batch" / sm, sm) == outputs(
+            tmp_path / "single" / sm, sm
+        )
+    assert outputs(tmp_path / "batch" / "s1", "s1") != outputs(
+        tmp_path / "batch" / "s2", "s2"
+    )
+    assert not (tmp_path / "batch" / "s3" / "s3.hlatyping.res.tsv").exists()
+
+
+def test_pipelined(freq_fspath, tmp_path, monkeypatch):
+    # genes are typed as their alleles are scored
+    bam = write_bam(
+        tmp_path / "test.bam",
+        RECORDS
+        + [(2, 0, "r4", 99, "10M", "10"), (2, 20, "r4", 147, "10M", "2G7")],
+        contigs=CONTIGS + ("hla_b_07_02_01",),
+    )
+    calls = []
+    index_read_counts = mhctyper.index_read_counts
+
+    def _index_read_counts(bam):
+        calls.append(bam)
+        return index_read_counts(bam)
+
+    monkeypatch.setattr(mhctyper, "index_read_counts", _index_read_counts)
+    monkeypatch.setattr(
+        score_alleles, "index_read_counts", _index_read_counts
+    )
+    outdir = tmp_path / "pipelined"
+    run_mhctyper(bam, freq_fspath, outdir, MIN_ECNT, 2, backend="thread")
+    assert calls == [bam]
+
+    sample = _prepare_sample(
+        bam,
+        tmp_path / "typed",
+        kept=_load_kept_alleles(freq_fspath),
+        min_ecnt=MIN_ECNT,
+        keep_alignments=False,
+        overwrite=False,
+    )
+    scores = score_a_one(
+        sample.alleles_to_type, bam, MIN_ECNT, nproc=2, backend="thread"
+    )
+    scores.write_parquet(sample.outdir / "test.a1.parquet")
+    type_alleles(scores.lazy(), "test", sample.out_a2, sample.hla_res)
+    a1, a2, res = outputs(outdir)
+    assert {row[-1] for row in a1} == {"hla_a", "hla_b"}
+    assert (a1, a2, res) == outputs(sample.outdir)
@@ -0,0 +1,50 @@
+import io
+import random
+
+import polars as pl
+
+from mhctyper.pipeline import GeneTracker, GeneTyper
+
+
+def test_gene_tracker():
+    tracker = GeneTracker.from_alleles(
+        ["hla_a_01_01_01", "hla_a_02_01_01", "hla_b_07_02_01"]
+    )
+    assert tracker.complete("hla_a_01_01_01") is None
+    assert tracker.complete("hla_b_07_02_01") == "hla_b"
+    assert tracker.complete("hla_a_02_01_01") == "hla_a"
+    assert tracker.complete("hla_a_02_01_01") is None
+    assert tracker.alleles["hla_a"] == ["hla_a_01_01_01", "hla_a_02_01_01"]
+
+
+def test_gene_typer_by_gene(tmp_path):
+    rng = random.Random(3)
+    rows = [
+        (f"{gene}.r{i}", rng.uniform(90, 100), f"{gene}_{j:02d}", gene)
+        for gene in ("hla_a", "hla_b", "hla_c")
+        for i in range(40)
+        for j in rng.sample(range(6), rng.randint(1, 6))
+    ]
+    scores = pl.DataFrame(
+        rows, schema=["qnames", "scores", "allele", "gene"], orient="row"
+    ).lazy()
+
+    def run(batches):
+        a2_fh, res_fh = io.StringIO(), io.StringIO()
+        typer = GeneTyper("SM", a2_fh, res_fh)
+        for genes in batches:
+            typer.type_genes(scores.filter(pl.col("gene").is_in(genes)))
+        typer.type_genes(scores)
+        a2 = pl.read_csv(io.StringIO(a2_fh.getvalue()), separator="\t")
+        res = typer.result(tmp_path / "res.tsv")
+        return a2.sort("qnames", "allele"), res
+
+    a2, res = run([])
+    a2_by_gene, res_by_gene = run([["hla_c"], ["hla_a"]])
+    assert a2_by_gene.equals(a2)
+    assert res_by_gene.equals(res)
+    assert res["gene"].to_list() == ["hla_a"] * 2 + ["hla_b"] * 2 + [
+        "hla_c"
+    ] * 2
+    streamed = pl.read_csv(tmp_path / "res.tsv", separator="\t")
+    assert streamed.equals(res)
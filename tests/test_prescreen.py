@@ -0,0 +1,60 @@
+import polars as pl
+
+from mhctyper.prescreen import allele_groups, select_top_groups
+
+ALLELES = [
+    "hla_a_01_01_01",
+    "hla_a_01_01_02",
+    "hla_a_02_01_01",
+    "hla_a_03_01",
+    "hla_b_07_02_01",
+    "hla_b_08_01_01",
+    "hla_c_01_02_01",
+]
+
+
+def test_allele_groups():
+    groups = allele_groups(ALLELES)
+    assert groups["gene"].to_list() == ["hla_a"] * 4 + ["hla_b"] * 2 + [
+        "hla_c"
+    ]
+    assert groups["group"].to_list() == [
+        "hla_a_01_01",
+        "hla_a_01_01",
+        "hla_a_02_01",
+        "hla_a_03_01",
+        "hla_b_07_02",
+        "hla_b_08_01",
+        "hla_c_01_02",
+    ]
+
+
+def test_select_top_groups():
+    scores = pl.DataFrame(
+        {
+            "qnames": ["r1", "r2", "r1", "r3", "r1"],
+            "scores": [5.0, 5.0, 9.0, 3.0, 1.0],
+            "allele": [
+                "hla_a_01_01_02",
+                "hla_a_01_01_02",
+                "hla_a_02_01_01",
+                "hla_a_03_01",
+                "hla_b_08_01_01",
+            ],
+        }
+    )
+    groups = allele_groups(ALLELES)
+    # all alleles of a kept group, and of genes without scores, are kept
+    assert select_top_groups(groups, scores, 1) == [
+        "hla_a_01_01_01",
+        "hla_a_01_01_02",
+        "hla_b_08_01_01",
+        "hla_c_01_02_01",
+    ]
+    assert select_top_groups(groups, scores, 2) == [
+        "hla_a_01_01_01",
+        "hla_a_01_01_02",
+        "hla_a_02_01_01",
+        "hla_b_08_01_01",
+        "hla_c_01_02_01",
+    ]
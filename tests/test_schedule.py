@@ -0,0 +1,37 @@
+from mhctyper.schedule import (
+    balance_blocks,
+    gene_fractions,
+    schedule_alleles,
+    shard_alleles,
+)
+
+
+def test_schedule_alleles_largest_first():
+    counts = {"a": 1, "b": 100, "c": 2, "d": 50, "e": 3, "f": 1}
+    tasks = schedule_alleles(list(counts), counts, nproc=2)
+    # target cost per task is 157 // 8 = 19
+    assert tasks == [["b"], ["d"], ["e", "c", "a", "f"]]
+
+
+def test_balance_blocks_keeps_order():
+    counts = {"a": 10, "b": 10, "c": 40, "d": 20, "e": 20}
+    blocks = balance_blocks(list(counts), counts, 2)
+    assert blocks == [["a", "b", "c"], ["d", "e"]]
+    assert sum(blocks, []) == list(counts)
+    assert balance_blocks(["a"], counts, 4) == [["a"]]
+
+
+def test_shard_alleles():
+    counts = {"a": 10, "b": 10, "c": 40, "d": 20, "e": 20, "f": 0}
+    shards = shard_alleles(list(counts), counts, 2)
+    assert shards == [["a", "c", "f"], ["b", "d", "e"]]
+    assert shard_alleles(list(counts), counts, 2) == shards
+    assert sorted(sum(shard_alleles(list(counts), counts, 8), [])) == sorted(
+        counts
+    )
+
+
+def test_gene_fractions():
+    genes = {"a1": "a", "a2": "a", "b1": "b", "c1": "c"}
+    counts = {"a1": 400, "a2": 100, "b1": 100}
+    assert gene_fractions(genes, counts, 100) == {"a": 0.5, "b": 1.0, "c": 1.0}
@@ -0,0 +1,80 @@
+import random
+
+import polars as pl
+import pytest
+
+from mhctyper.bam import flat_alignments
+from mhctyper.score_alleles import (
+    apply_min_ecnt,
+    filter_alignments,
+    score_a_one,
+    score_alignment_rows,
+    score_alleles_in_batch,
+    score_pairs,
+)
+
+
+@pytest.fixture(scope="module")
+def alignments():
+    """Alignments of read pairs with random mms, indels, and proper flags"""
+    rng = random.Random(7)
+    rows, bqs = [], []
+    for i in range(200):
+        for _ in range(rng.choice([1, 2, 2, 2])):
+            rows.append(
+                {
+                    "qnames": f"r{i}",
+                    "propers": rng.random() > 0.1,
+                    "mm_ecnt": rng.randint(-1, 6),
+                    "indel_ecnt": int(rng.random() < 0.1),
+                }
+            )
+            bqs.append(bytes(rng.randint(2, 40) for _ in range(20)))
+    table = pl.DataFrame(
+        rows,
+        schema={
+            "qnames": pl.String,
+            "propers": pl.Boolean,
+            "mm_ecnt": pl.Int16,
+            "indel_ecnt": pl.Int16,
+        },
+    )
+    return flat_alignments(bqs, pl.Series(["10A9"] * len(bqs)), table)
+
+
+@pytest.mark.parametrize("min_ecnt", [0, 1, 3, 999])
+def test_apply_min_ecnt_matches_filtered_scoring(alignments, min_ecnt):
+    allele, gene = "hla_a_01_01_01", "hla_a"
+    kept = filter_alignments(alignments.table, min_ecnt)
+    expect = score_pairs(alignments.with_table(kept), allele, gene).sort(
+        "qnames"
+    )
+    aln_scores = score_alignment_rows(alignments, allele, gene)
+    assert aln_scores.shape[0] == len(alignments)
+    got = apply_min_ecnt(aln_scores, min_ecnt).collect().sort("qnames")
+    assert got.columns == expect.columns
+    assert got.equals(expect)
+
+
+def test_score_a_one_backends_agree(bam_fspath):
+    alleles = ["hla_a_01_01_01", "hla_a_02_01_01"]
+    scores = {
+        backend: score_a_one(
+            alleles, bam_fspath, 999, nproc=2, memo_size=10, backend=backend
+        ).sort("allele", "qnames")
+        for backend in ("process", "thread")
+    }
+    assert scores["thread"].equals(scores["process"])
+    assert scores["thread"].height > 0
+
+
+def test_score_alleles_in_batch_counts(bam_fspath):
+    alleles = ["hla_a_01_01_01", "hla_a_02_01_01"]
+    results = score_alleles_in_batch(alleles, bam_fspath, 999)
+    assert [r.counts for r in results] == [None, None]
+    counted = score_alleles_in_batch(alleles, bam_fspath, 999, count=True)
+    for res, expect in zip(counted, results):
+        assert res.counts is not None
+        assert res.counts["read"] > 0
+        assert res.counts["read"] >= res.counts["paired"]
+        assert (res.scores is None) == (expect.scores is None)
@@ -0,0 +1,52 @@
+from multiprocessing.pool import ThreadPool
+
+from mhctyper.worker import WorkerState, close_worker_state, worker_state
+
+
+def test_worker_state_reuses_bam(bam_fspath):
+    state = WorkerState()
+    bamf = state.bam(bam_fspath)
+    assert state.bam(bam_fspath) is bamf
+    assert bamf.references == ("hla_a_01_01_01", "hla_a_02_01_01")
+    state.close()
+    assert not state.bams and not bamf.is_open
+
+
+def test_worker_state_hla_gene():
+    state = WorkerState()
+    assert state.hla_gene("hla_a_01_01_01") == "hla_a"
+    assert state.hla_gene("hla_drb1_15_01_01") == "hla_drb1"
+
+
+def test_worker_state_is_kept_per_process():
+    state = worker_state()
+    assert worker_state() is state
+    close_worker_state()
+    assert worker_state() is not state
+    close_worker_state()
+
+
+def test_worker_state_closes_least_recently_used_bam(bam_fspath, tmp_path):
+    other = tmp_path / "other.bam"
+    other.symlink_to(bam_fspath)
+    (tmp_path / "other.bam.bai").symlink_to(f"{bam_fspath}.bai")
+    state = WorkerState(max_open_bams=1)
+    bamf = state.bam(bam_fspath)
+    state.bam(other)
+    assert list(state.bams) == [other] and not bamf.is_open
+    state.close()
+
+
+def test_worker_state_keeps_bams_per_thread(bam_fspath):
+    state = WorkerState()
+    with ThreadPool(2) as pool:
+        # each thread opens the BAM file once, and reuses it
+        bamfs = pool.map(
+            lambda _: (state.bam(bam_fspath), state.bam(bam_fspath)),
+            range(2),
+            chunksize=1,
+        )
+    assert all(a is b for a, b in bamfs)
+    assert state.bam(bam_fspath) not in {a for a, _ in bamfs}
+    state.close()
+    assert not any(bamf.is_open for bamf, _ in bamfs)